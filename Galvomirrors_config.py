@@ -49,7 +49,8 @@ all_motors_config = {'volts_per_deg':0.8,
                      'output_error_deg_per_volts':2.5,
                      'step_response(ms)':0.3,
                      'fullscale_response(ms)':10.,
-                     'moving_tol(deg)':0.05} #final error 0.26um with 4x objective 
+                     'moving_tol(deg)':0.05, #final error 0.26um with 4x objective 
+                     'settle_samples':100} #samples of the error channel per settle check (Motor.isMoving)
                      
 xconfig = copy.deepcopy(all_motors_config)
 yconfig = copy.deepcopy(all_motors_config)
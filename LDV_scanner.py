@@ -6,26 +6,49 @@ from galvomirrors import *
 import pico2000
 import pico5000
 from scipy.spatial import ConvexHull
-from matplotlib.path import Path
 from hdf5_utils import *
+import scan_paths
 import pyqtgraph as pg
 from PyQt5.QtWidgets import QApplication
 
 for_test= False #for code development only
 
 
+def amplitude(readout):
+    '''
+    default amplitude metric of the adaptive scans: half the peak-to-peak of the board output (channel B)
+    averaged over the segments (in V)
+    '''
+    return 0.5*np.ptp(np.mean(pico5000.volts(readout,'B (V)'),axis=1))
+
+def _storable(settings):
+    #whether the settings are saved and loaded unchanged by hdf5_utils: strings, numbers and numeric arrays
+    for value in settings.values():
+        if isinstance(value,dict):
+            if not _storable(value):
+                return False
+        elif isinstance(value,(list,np.ndarray)):
+            if np.asarray(value).dtype.kind not in 'biuf':
+                return False
+        elif not isinstance(value,(str,int,float,np.int64,np.float64,np.float32)): #e.g. tuples
+            return False
+    return True
 
 
 
 class LDV_scanner():
     
     def __init__(self,scopes2000,scope5000,scan_path={'type':'circle','radius (mm)':0.5,'resolution (um)':100},
-                 lens_name='4x',centering_test=True,readout='analog',results_folder = './'):
-        timeStr = time.asctime( time.localtime(time.time()) ).replace(':','-')
-        self.results_folder = os.path.join(results_folder,timeStr)
-        os.mkdir(self.results_folder)
+                 lens_name='4x',centering_test=True,readout='analog',results_folder = './',resume=False):
+        #resume: results_folder is the folder of an interrupted scan (see resume), rather than the parent folder
+        if resume:
+            self.results_folder = results_folder
+        else:
+            timeStr = time.asctime( time.localtime(time.time()) ).replace(':','-')
+            self.results_folder = os.path.join(results_folder,timeStr)
+            os.mkdir(self.results_folder)
         self.galvo = Galvosystem(scopes2000,lens_name=lens_name)
-        self.scan_path = self._design_path(scan_path)
+        self.set_scan_path(scan_path)
         self.wind = pg.GraphicsWindow()
         self.scan_ax = self.wind.addPlot(title='scanning head position')
         self.scan_ax.setLabel('left', "y", units='mm')
@@ -42,23 +65,70 @@ class LDV_scanner():
         else:
             self.board = ReadoutDigital(scope5000)
         self.board.scope.recall_config(pico5000_configLDV)
+        if resume:
+            self.board.scope.recall_config(load_dict_from_hdf5(os.path.join(self.results_folder,'config_pico5000')))
         self.current_fileID = 0
         self.lens_name = lens_name
         self.results = [{}]
+        self._indices = [] #scan path indices of the results (see saveData)
+        self._resumed = None #first point of a resumed scan (see resume)
         self.saveConfig()
     
+    @classmethod
+    def resume(cls,results_folder,scopes2000,scope5000,centering_test=True,readout='analog'):
+        '''
+        resumes an interrupted scan (see scan) from its results folder: reloads the config (lens, scan path and
+        pico5000 configuration) and the checkpoint of the saved points, then measures the remaining points with
+        the settings of the scan. The data files are those of an uninterrupted scan: the last data file, when
+        the scan stopped before its autosave, is reloaded and completed
+        arguments:
+            results_folder: the folder of the interrupted scan (with its config, checkpoint and data files)
+            scopes2000, scope5000: see LDV_scanner
+        keyword arguments:
+            centering_test, readout: see LDV_scanner
+        returns:
+            the scanner
+        the points measured after the last saved data file are measured again
+        '''
+        with h5py.File(os.path.join(results_folder,'checkpoint'),'r') as f:
+            assert f.attrs['scan']=='scan', 'only the scans of the whole scan path can be resumed'
+        with h5py.File(os.path.join(results_folder,'config'),'r') as f:
+            lens_name = load_dataset(f['lens_name'])
+            if 'scan_path_settings' in f:
+                scan_path = recursively_load_dict_contents_from_group(f,'/scan_path_settings/')
+                n_points,first_block = len(f['scan_path']),f['scan_path'][:1000]
+            else: #custom scan path
+                scan_path = f['scan_path'][()]
+        scanner = cls(scopes2000,scope5000,scan_path=scan_path,lens_name=lens_name,centering_test=centering_test,
+                      readout=readout,results_folder=results_folder,resume=True)
+        if isinstance(scan_path,dict):
+            assert len(scanner.scan_path)==n_points and np.allclose(scanner.scan_path[:1000],first_block), \
+                   'the scan path designed from the config differs from the saved scan path'
+        settings = scanner._load_checkpoint()
+        if scanner._resumed==len(scanner.scan_path):
+            print('the scan was already complete')
+        else:
+            print('resuming the scan at point {0} of {1}'.format(scanner._resumed,len(scanner.scan_path)))
+            scanner.scan(**settings)
+        return scanner
+    
     def __enter__(self):
         return self
     
     def __exit__(self,type,value,traceback):
         self.saveData()
         self.saveConfig()
+        self.galvo.close()
         
-    def _move(self,point,n_attempts=3):
+    def _move(self,point,n_attempts=3,index=None):
+        #index: index of the point in the compiled scan path (see Galvosystem.compile_path)
         fail = True
         while fail and n_attempts>0:
             try:
-                self.galvo.move(point[0],point[1])
+                if index is None:
+                    self.galvo.move(point[0],point[1])
+                else:
+                    self.galvo.move_to_index(index)
                 fail = False
             except MotorError:
                 n_attempts-=1
@@ -68,74 +138,220 @@ class LDV_scanner():
                                pen=None,symbolBrush=(2,2))
         QApplication.processEvents()
     
-    def scan(self,n_attempts=3,autosave_every=100,timeBetweenSegments=1e-3):
-        for i,p in enumerate(self.scan_path):
-            self._move(p,n_attempts=n_attempts)
-            readout = self.board.read(n_attempts=n_attempts,timeBetweenSegments=timeBetweenSegments)
-            readout.update({'x':p[0],'y':p[1]})
-            self.results.append(readout)
-            if i>0 and np.mod(i,autosave_every)==0:
-                self.saveData()
-            try:
-                self.scope_ax.removeItem(self.previous_scope_ax)
-            except AttributeError:
-                pass #this is the first iteration of the loop
-            finally:
-                self.previous_scope_ax = self.scope_ax.plot(1e6*readout['time (s)'],np.mean(readout['B (V)'],axis=1))
-            QApplication.processEvents()
+    def scan(self,n_attempts=3,autosave_every=100,timeBetweenSegments=1e-3,raw=False,auto_range=None):
+        '''
+        scans the sample along the scan path
+        keyword arguments:
+            n_attempts: maximum attempts to move and to collect the readout at each point
+            autosave_every: number of points between two data files
+            timeBetweenSegments: delay between soft triggers (in s)
+            raw: stores the scope ADC counts (and their scale) rather than the voltages
+            auto_range: size of the scan regions (in m) sharing the same scope ranges, found by a pre-capture
+                        at the first point of each region (see pico5000.Pico5000.autoRange). None keeps the
+                        configured ranges. A readout that clipped is measured again after ranging its region again
+        the saved points are recorded in a checkpoint, to resume an interrupted scan (see resume)
+        '''
+        first = self._checkpoint('scan',n_attempts=n_attempts,autosave_every=autosave_every,
+                                 timeBetweenSegments=timeBetweenSegments,raw=raw,auto_range=auto_range)
+        for start,block in self.scan_path.blocks(first=first):
+            for k,p in enumerate(block):
+                i = start+k
+                self._measure(i,point=p,n_attempts=n_attempts,timeBetweenSegments=timeBetweenSegments,raw=raw,auto_range=auto_range)
+                if i>0 and np.mod(i,autosave_every)==0:
+                    self.saveData()
         self.saveData()
         print('scan completed successfully')
+    
+    def scan_adaptive(self,levels=2,threshold=0.2,gradient_threshold=0.2,metric=amplitude,
+                      n_attempts=3,autosave_every=100,timeBetweenSegments=1e-3,raw=False,auto_range=None):
+        '''
+        coarse-to-fine scan of the scan path (see scan_paths.adaptive): a coarse pass 2**levels times sparser than
+        the scan path, then, one level at a time, the points around the points of high amplitude or high amplitude
+        gradient are measured, down to the scan path resolution.
+        The readouts are stored as in scan, with the refinement level of their pass in 'level' (0: finest)
+        keyword arguments:
+            levels: number of coarse levels
+            threshold: the points of amplitude above threshold*(peak amplitude) are refined
+            gradient_threshold: the points of amplitude slope above gradient_threshold*(peak amplitude)
+                                per spacing of their level are refined, None refines on the amplitude only
+            metric: function readout -> amplitude (see amplitude)
+            the other keyword arguments are those of scan
+        returns:
+            the amplitude at each point of the scan path (nan when not measured)
+        the points of the scan path are all loaded, to find the neighbours of the points.
+        The saved points are recorded in a checkpoint, but an adaptive scan cannot be resumed (its passes depend
+        on the amplitudes measured)
+        '''
+        self._checkpoint('adaptive',n_attempts=n_attempts,autosave_every=autosave_every,
+                         timeBetweenSegments=timeBetweenSegments,raw=raw,auto_range=auto_range)
+        count = 0
+        def measure(indices,level):
+            nonlocal count
+            values = []
+            for i in indices:
+                readout = self._measure(i,n_attempts=n_attempts,timeBetweenSegments=timeBetweenSegments,raw=raw,
+                                        auto_range=auto_range,level=level)
+                values.append(metric(readout))
+                if count>0 and np.mod(count,autosave_every)==0:
+                    self.saveData()
+                count += 1
+            return values
+        values,passes = scan_paths.adaptive(self.scan_path[:],measure,levels=levels,threshold=threshold,
+                                            gradient_threshold=gradient_threshold)
+        self.saveData()
+        print('adaptive scan completed successfully: {0} points measured out of {1}'.format(count,len(self.scan_path)))
+        return values
+    
+    def _measure(self,index,point=None,n_attempts=3,timeBetweenSegments=1e-3,raw=False,auto_range=None,**tags):
+        '''
+        moves to the point index of the scan path (point, when already read), reads the board and stores the readout,
+        with the point position in 'x' and 'y' and the tags (see scan)
+        returns:
+            the readout
+        '''
+        p = self.scan_path[index] if point is None else point
+        self._move(p,n_attempts=n_attempts,index=self._compiled(index))
+        if auto_range is not None:
+            region = tuple(np.floor(np.asarray(p)/auto_range).astype(int))
+            self.scope5000.autoRange(fire=lambda: self.scope5000.awg.softTrig(True),region=region)
+        readout = self.board.read(n_attempts=n_attempts,timeBetweenSegments=timeBetweenSegments,raw=raw)
+        if auto_range is not None and readout.clipped:
+            del self.scope5000.ranges[region]
+            self.scope5000.autoRange(fire=lambda: self.scope5000.awg.softTrig(True),region=region)
+            readout = self.board.read(n_attempts=n_attempts,timeBetweenSegments=timeBetweenSegments,raw=raw)
+        readout.update({'x':p[0],'y':p[1]})
+        readout.update(tags)
+        self.results.append(readout)
+        self._indices.append(index)
+        try:
+            self.scope_ax.removeItem(self.previous_scope_ax)
+        except AttributeError:
+            pass #this is the first iteration of the loop
+        finally:
+            self.previous_scope_ax = self.scope_ax.plot(1e6*readout['time (s)'],np.mean(pico5000.volts(readout,'B (V)'),axis=1))
+        QApplication.processEvents()
+        return readout
+    
+    def _compiled(self,index):
+        '''
+        compiles the galvo commands of the block of the scan path containing index (see Galvosystem.compile_path),
+        returns the index of the point in the compiled block
+        '''
+        size = self.scan_path.block_size
+        start = index-index%size
+        if self._compiled_block!=start or self.galvo.compiled is None:
+            self.galvo.compile_path(self.scan_path[start:start+size])
+            self._compiled_block = start
+        return index-start
+    
+    def _checkpoint(self,scan,**settings):
+        '''
+        starts the checkpoint of a scan: saves the config and creates the checkpoint file of the results folder,
+        with the scan type and settings (attributes), the scan path indices of the saved points ('index') and the
+        number of points of each data file ('files', from the data file 'first file'), see saveData.
+        A resumed scan continues its checkpoint instead (see resume)
+        returns:
+            the index of the first point to measure
+        '''
+        if self._resumed is not None:
+            first,self._resumed = self._resumed,None
+            return first
+        self.saveConfig()
+        with h5py.File(os.path.join(self.results_folder,'checkpoint'),'w') as f:
+            f.attrs['scan'] = scan
+            f.attrs['first file'] = self.current_fileID
+            for key,value in settings.items():
+                if value is not None:
+                    f.attrs[key] = value
+            f.create_dataset('index',shape=(0,),maxshape=(None,),dtype=np.int64)
+            f.create_dataset('files',shape=(0,),maxshape=(None,),dtype=np.int64)
+        return 0
+    
+    def _load_checkpoint(self):
+        '''
+        reloads the checkpoint of an interrupted scan: the data files after the last saved point are dropped,
+        the last data file is reloaded when the scan stopped before its autosave (it is saved again once complete)
+        returns:
+            the scan settings
+        '''
+        with h5py.File(os.path.join(self.results_folder,'checkpoint'),'a') as f:
+            settings = {key:(value.item() if isinstance(value,np.generic) else value) for key,value in f.attrs.items()}
+            del settings['scan']
+            first_file = settings.pop('first file')
+            files = f['files'][()]
+            n_files = len(files)
+            while n_files>0 and files[n_files-1]==0: #e.g. saved on exit after an autosave
+                n_files -= 1
+            n_saved = int(np.sum(files[:n_files]))
+            assert n_saved==0 or f['index'][n_saved-1]==n_saved-1, 'the saved points should start the scan path'
+            last = n_saved-1
+            if n_saved>0 and not ((last>0 and last%settings['autosave_every']==0) or last==len(self.scan_path)-1):
+                n_files -= 1
+                self.results = [{}]+self._load_data(first_file+n_files)
+                self._indices = list(range(n_saved-len(self.results)+1,n_saved))
+            f['files'].resize((n_files,))
+            f['index'].resize((n_saved-len(self._indices),))
+        self.current_fileID = first_file+n_files
+        self._resumed = n_saved
+        return settings
+    
+    def _load_data(self,fileID,fname='data'):
+        '''
+        returns the readouts of a data file (see saveData)
+        '''
+        return load_results_from_hdf5(os.path.join(self.results_folder,fname+'_'+str(fileID)))[1:]
         
     def set_scan_path(self,scan_path={'type':'circle','radius (mm)':0.5,'resolution (um)':100}):
+        '''
+        sets the scan path: a custom m*2 array of positions (in m, visited in the given order), a scan_paths.ScanPath,
+        or a dictionary designing a lattice inside a region ('type', 'resolution (um)', the region keys
+        and optionally 'lattice', see scan_paths.region and scan_paths.fill),
+        the 'order' key ordering its points ('serpentine' by default, 'tour' or 'none', see scan_paths.design_path).
+        The scan path is read block by block (see scan_paths.ScanPath)
+        '''
+        self.scan_path_settings = scan_path if isinstance(scan_path,dict) else None #see saveConfig
         if type(scan_path) is np.ndarray:
-                assert path.shape[1]==2, 'custom scan_path must be an m*2 numpy array'
-                self.scan_path = scan_path
+                assert scan_path.ndim==2 and scan_path.shape[1]==2, 'custom scan_path must be an m*2 numpy array'
+                self.scan_path = scan_paths.ScanPath(scan_path)
+        elif isinstance(scan_path,scan_paths.ScanPath):
+            self.scan_path = scan_path
         else:
-            assert scan_path['type'] in ['circle','rectangle'], 'scan_path types can only be circles and rectangles'
             self.scan_path = self._design_path(scan_path)
+        self._compiled_block = None #see _compiled
             
   
     def _design_path(self,scan_path):
-        if scan_path['type']=='circle':
-            theta = np.linspace(0, 2*np.pi, 1000) #the number of points will be changed later
-            x = 1e-3*scan_path['radius (mm)']*np.cos(theta)
-            y = 1e-3*scan_path['radius (mm)']*np.sin(theta)
-            if 'xoffset' in scan_path.keys():
-                x = x+scan_path['xoffset']*1e-3
-            if 'yoffset' in scan_path.keys():
-                y = y+scan_path['yoffset']*1e-3
-                
-        elif scan_path['type']=='rectangle':
-            xl = scan_path['xlength (mm)']
-            yl = scan_path['ylength (mm)']
-            x = [-xl,xl,xl,-xl,-xl]
-            y = [-yl,-yl,yl,yl,-yl]
-        #discretization
-        h = scan_path['resolution (um)']*1e-6*np.sqrt(3.)/2.
-        xi1 = np.arange(np.min(x),np.max(x),h)
-        yi1 = np.arange(np.min(y),np.max(y),2*h)
-        xi2 = 0.5*h+np.arange(np.min(x),np.max(x),h)
-        yi2 = h+np.arange(np.min(y),np.max(y),2*h)
-        xi1,yi1 = np.meshgrid(xi1,yi1)
-        xi2,yi2 = np.meshgrid(xi2,yi2)
-        xi = np.hstack([xi1.ravel(),xi2.ravel()])
-        yi = np.hstack([yi1.ravel(),yi2.ravel()])
-        border = Path([(xp,yp) for xp,yp in zip(x,y)])
-        points = [(xp,yp) for xp,yp in zip(xi,yi)]
-        inside = border.contains_points(points)
-        scan_path = np.array([xi[inside],yi[inside]]).T
-        return scan_path
-    
-    def path_preview(self,centering_test=True):
-        ch = ConvexHull(self.scan_path)
-        border = self.scan_path[ch.vertices,:]
-        #plt.figure()
-        self.scan_ax.plot(1e3*self.scan_path[:,0],1e3*self.scan_path[:,1], pen=None, symbol='o',symbolBrush=(1,2))
-        #plt.plot(self.scan_path[:,0],self.scan_path[:,1],'.k')
-        #plt.plot(border[:,0],border[:,1],'k')
+        path = scan_paths.design_path(scan_path)
+        self._path_report(scan_paths.design_path(dict(scan_path,order='none')),'design')
+        self._path_report(path,scan_path.get('order','serpentine'))
+        return path
+    
+    def _path_report(self,path,name):
+        '''
+        prints the travel, the largest step and the predicted settle time (see Galvosystem.predict_settle)
+        of a scan path, computed block by block
+        '''
+        distance,largest,settle = 0.,0.,0.
+        for start,block in path.blocks(overlap=1):
+            block_distance,block_largest = scan_paths.travel(block)
+            distance,largest = distance+block_distance,max(largest,block_largest)
+            settle += self.galvo.predict_settle(block)
+        print('{0} order: travel {1:.1f} mm, largest step {2:.0f} um, predicted settle time {3:.2f} s'.format(
+              name,1e3*distance,1e6*largest,settle))
+    
+    def path_preview(self,centering_test=True,max_points=100000):
+        '''
+        plots the scan path and its convex hull block by block (at most about max_points points are shown),
+        the centering test moves the beam along the hull
+        '''
+        stride = max(1,int(np.ceil(len(self.scan_path)/max_points)))
+        border = np.empty((0,2))
+        for start,block in self.scan_path.blocks():
+            shown = block[(-start)%stride::stride]
+            self.scan_ax.plot(1e3*shown[:,0],1e3*shown[:,1], pen=None, symbol='o',symbolBrush=(1,2))
+            candidates = np.vstack([border,block])
+            border = candidates[ConvexHull(candidates).vertices,:]
         self.scan_ax.plot(1e3*border[:,0],1e3*border[:,1], pen=(1,2), symbol=None)
-        #plt.axis('equal')
-        #plt.show()
         if centering_test:
             user_input = 'n'
             while user_input=='n':
@@ -147,19 +363,25 @@ class LDV_scanner():
     
     def saveData(self,fname = 'data'):
         '''
-        saves the current scan data
+        saves the current scan data, and records the saved points in the checkpoint of the scan (see _checkpoint)
         arguments:
             None
         output:
             None
         '''
         fname = os.path.join(self.results_folder,fname+'_'+str(self.current_fileID))
-        with h5py.File(fname, "w") as f:
-            for i,data in enumerate(self.results):
-                for k,v in data.items():
-                    dset = f.create_dataset(k+'_'+str(i), data=v)
+        save_results_to_hdf5(self.results, fname)
+        checkpoint = os.path.join(self.results_folder,'checkpoint')
+        if os.path.exists(checkpoint):
+            with h5py.File(checkpoint,'a') as f:
+                n_saved = len(f['index'])
+                f['index'].resize((n_saved+len(self._indices),))
+                f['index'][n_saved:] = self._indices
+                f['files'].resize((len(f['files'])+1,))
+                f['files'][-1] = len(self._indices)
         self.current_fileID+=1
         self.results = [{}]
+        self._indices = []
     
     def saveConfig(self,fname='config'):
         '''
@@ -172,7 +394,12 @@ class LDV_scanner():
         fname = os.path.join(self.results_folder,fname)
         with h5py.File(fname, "w") as f:
             dset = f.create_dataset('lens_name', data=self.lens_name)
-            dset = f.create_dataset('scan_path', data=self.scan_path)
+            dset = f.create_dataset('scan_path', shape=(len(self.scan_path),2), dtype=float)
+            for start,block in self.scan_path.blocks():
+                dset[start:start+len(block)] = block
+            #to design the scan path again (see resume), otherwise (e.g. a list of regions) the saved scan path is reloaded
+            if self.scan_path_settings is not None and _storable(self.scan_path_settings):
+                recursively_save_dict_contents_to_group(f,'/scan_path_settings/',self.scan_path_settings)
             #dset = f.create_dataset('pico5000config', data=self.scope5000.save_config())
             #dset = f.create_dataset('pico2000_0_config', data=self.scopes2000[0].save_config())
             #dset = f.create_dataset('pico2000_1_config', data=self.scopes2000[1].save_config())
@@ -190,4 +417,6 @@ if __name__ == '__main__':
         scope.set_trigger(threshold_mV=1000,source='D')
         scope.set_timeBase(sampleRate=10e6)
         scope.awg.set_builtin(freq=[7e6, 7e6],pkToPk=1.)
-        ldv.scan()
\ No newline at end of file
+        ldv.scan()
+        #an interrupted scan is continued with:
+        #ldv = LDV_scanner.resume('./<date of the scan>',[scope1,scope2],scope)
\ No newline at end of file
@@ -68,13 +68,14 @@ class ReadoutBoard():
             print('calibration successful, max noise {0} mV'.format(1e3*_max[-1]))
             
             
-    def read(self,n_attempts=3,timeBetweenSegments=1e-3):
+    def read(self,n_attempts=3,timeBetweenSegments=1e-3,raw=False):
         '''
         reads the board readout
         arguments:
             None
         keyword arguments: 
             n_attempts: maximum attempts to collect the output
+            raw: returns the ADC counts instead of the voltages (see pico5000.Pico5000.read)
         returns:
             results: raw oscilloscope readout (in V). See RF_readout_board to config trigger, frames and so on.
         '''
@@ -87,7 +88,7 @@ class ReadoutBoard():
                     self.scope.awg.softTrig(True)
                     time.sleep(timeBetweenSegments)
                 self.scope.waitUntilReady(timeout=0.1)
-                results = self.scope.read()
+                results = self.scope.read(raw=raw)
                 fail=False
             except TimeoutError:
                 n_attempts-=1
@@ -200,15 +201,17 @@ class ReadoutDigital():
         self.board = HilbertBoard(50e6,500e6,order=8)#VirtualBoard(50e6,500e6,order=8) 
 
     def _process(self,results):
-        return self.board(results['A (V)'],results['time (s)'])
+        return self.board(pico5000.volts(results,'A (V)'),results['time (s)'])
             
-    def read(self,n_attempts=3,timeBetweenSegments=1e-3):
+    def read(self,n_attempts=3,timeBetweenSegments=1e-3,raw=False):
         '''
         returns the digital readout
         arguments:
             None
         keyword arguments: 
             n_attempts: maximum attempts to collect the output
+            raw: keeps the ADC counts of the scope channels (see pico5000.Pico5000.read),
+                 only channel A is converted to volts for processing
         returns:
             results: processed oscilloscope readout (in V). See RF_readout_board to config trigger, frames and so on.
         '''
@@ -221,7 +224,7 @@ class ReadoutDigital():
                     self.scope.awg.softTrig(True)
                     time.sleep(timeBetweenSegments)
                 self.scope.waitUntilReady(timeout=0.1)
-                results = self.scope.read()
+                results = self.scope.read(raw=raw)
                 fail=False
             except TimeoutError:
                 n_attempts-=1
@@ -0,0 +1,176 @@
+'''
+asyncio front-end for the scopes and the galvo system.
+The blocking driver calls of each device run in a single-thread executor dedicated to that device:
+the calls to one device stay in order, while the devices work concurrently. For instance, the
+readout of a capture can be transferred while the galvo mirrors move to the next point
+(the moves are those of galvomirrors.Galvosystem, settle models and compiled paths included):
+    async def main():
+        with AsyncPico5000(scope) as ascope, AsyncGalvosystem(galvo) as agalvo:
+            results = await scan(agalvo,ascope,points,fire=fire)
+    asyncio.run(main())
+'''
+
+import asyncio
+import concurrent.futures
+import functools
+
+
+class AsyncDevice():
+    '''
+    runs the blocking calls of a device in its own single-thread executor
+    (or in the given single-thread executor, which is then not shut down by close)
+    '''
+    def __init__(self,device,executor=None):
+        self.device = device
+        self._owned = executor is None
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=1) if executor is None else executor
+
+    async def call(self,function,*args,**kwargs):
+        '''
+        runs function(*args,**kwargs) in the device executor and returns its result
+        '''
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor,functools.partial(function,*args,**kwargs))
+
+    def close(self):
+        if self._owned:
+            self.executor.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,type,value,traceback):
+        self.close()
+
+
+class AsyncScope(AsyncDevice):
+    '''
+    asynchronous block captures, for Pico5000 and Pico2000 scopes
+    '''
+    async def arm(self,**kwargs):
+        '''
+        arms the trigger (see runBlock)
+        '''
+        await self.call(self.device.runBlock,**kwargs)
+
+    async def wait_ready(self,timeout=1.):
+        '''
+        waits until the capture is complete (see waitUntilReady)
+        '''
+        await self.call(self.device.waitUntilReady,timeout=timeout)
+
+    async def read(self,**kwargs):
+        '''
+        returns the scope results (see read)
+        '''
+        return await self.call(self.device.read,**kwargs)
+
+    async def capture(self,fire=None,timeout=1.,**kwargs):
+        '''
+        arms the trigger, calls fire (e.g. soft triggers, in the scope executor), waits and reads the results
+        keyword arguments:
+            fire: function triggering the capture
+            timeout: maximum capture duration (in s)
+            other keyword arguments are passed to read
+        returns the scope results
+        '''
+        await self.arm()
+        if fire is not None:
+            await self.call(fire)
+        await self.wait_ready(timeout=timeout)
+        return await self.read(**kwargs)
+
+
+class AsyncPico5000(AsyncScope):
+    '''
+    asynchronous pico5000.Pico5000 (the capture completion is awaited on the driver callback when available)
+    '''
+
+
+class AsyncPico2000(AsyncScope):
+    '''
+    asynchronous pico2000.Pico2000
+    '''
+
+
+class AsyncMotor(AsyncDevice):
+    '''
+    asynchronous galvomirrors.Motor: the settling is polled in the motor executor, without blocking the other devices
+    '''
+    async def move(self,angle):
+        '''
+        moves the motor to angle and waits until the motor is stable, checks the position (see Motor.move_simple)
+        arguments:
+            angle (in degrees)
+        '''
+        await self.call(self.device.move_simple,angle)
+
+
+class AsyncGalvosystem(AsyncDevice):
+    '''
+    asynchronous galvomirrors.Galvosystem: the moves (see Galvosystem.move) run in the galvo executor and
+    the calls to each motor in the worker of its axis (shared with the AsyncMotor of self.motor),
+    both motors move and settle concurrently
+    '''
+    def __init__(self,galvo):
+        super().__init__(galvo)
+        self.galvo = galvo
+        self.motor = {direction:AsyncMotor(motor,executor=galvo._workers[direction]) for direction,motor in galvo.motor.items()}
+
+    async def move(self,posx,posy,n_attempts=3):
+        '''
+        moves the laser beam, waits until motion is complete (see Galvosystem.move)
+        arguments:
+            posx: position along x-axis (m), as defined by the motor X
+            posy: position along y-axis (m), as defined by the motor Y
+        keyword arguments:
+            n_attempts: maximum number of attempts before running the motor diagnostic
+        '''
+        await self.call(self.galvo.move,posx,posy,n_attempts=n_attempts)
+
+    async def compile_path(self,points):
+        '''
+        compiles a scan path (see Galvosystem.compile_path)
+        '''
+        return await self.call(self.galvo.compile_path,points)
+
+    async def move_to_index(self,index,n_attempts=3):
+        '''
+        moves the laser beam to a point of the compiled scan path (see Galvosystem.move_to_index)
+        '''
+        await self.call(self.galvo.move_to_index,index,n_attempts=n_attempts)
+
+    def close(self):
+        for motor in self.motor.values():
+            motor.close()
+        super().close()
+
+
+async def scan(galvo,scope,points,fire=None,**kwargs):
+    '''
+    measures at each point of a path: the readout of a point is transferred while the beam moves to the next one
+    arguments:
+        galvo: an AsyncGalvosystem
+        scope: an AsyncPico5000
+        points: the positions (m), m*2 array (compiled, see Galvosystem.compile_path)
+    keyword arguments:
+        fire: function triggering the captures (e.g. soft triggers)
+        other keyword arguments are passed to the scope read
+    returns the list of the scope results (with the point position in 'x' and 'y')
+    '''
+    results = []
+    if len(points):
+        await galvo.compile_path(points)
+        await galvo.move_to_index(0)
+    for k,point in enumerate(points):
+        await scope.arm()
+        if fire is not None:
+            await scope.call(fire)
+        await scope.wait_ready()
+        readout = asyncio.ensure_future(scope.read(**kwargs))
+        if k+1<len(points): #the beam leaves the point once the capture is complete
+            await asyncio.gather(readout,galvo.move_to_index(k+1))
+        readout = await readout
+        readout.update({'x':point[0],'y':point[1]})
+        results.append(readout)
+    return results
@@ -0,0 +1,432 @@
+'''
+micro-benchmarks of the host-side acquisition code,
+run with: python benchmarks.py
+'''
+
+import ctypes
+import timeit
+import numpy as np
+from picosdk.functions import adc2mV
+import helper_functions
+
+
+def _report(name,seconds,reference=None):
+    line = '{0:<40s} {1:10.3f} ms'.format(name,1e3*seconds)
+    if reference is not None:
+        line += '   (x{0:.1f})'.format(reference/seconds)
+    print(line)
+
+def bench_adc2V(noSamples=5000,nSegments=32,repeat=10):
+    '''
+    ADC counts to volts conversion of a noSamples*nSegments block (12BIT, 1V range):
+    list-based picosdk adc2mV per segment against helper_functions.adc2V over the whole block
+    '''
+    print('-- ADC to volts, {0} samples x {1} segments --'.format(noSamples,nSegments))
+    rng = np.random.default_rng(0)
+    maxADC = ctypes.c_int16(32767)
+    _chRange = 6 #1V
+    buffers = rng.integers(-32767,32767,size=(nSegments,noSamples),dtype=np.int16)
+    ctypes_buffers = [(ctypes.c_int16*noSamples)(*row) for row in buffers]
+    def list_based():
+        return np.vstack([1e-3*np.array(adc2mV(b,_chRange,maxADC)) for b in ctypes_buffers]).T
+    def vectorized(dtype=np.float64):
+        return helper_functions.adc2V(buffers.T,_chRange,maxADC,dtype=dtype)
+    assert np.array_equal(list_based(),vectorized()), 'adc2V and adc2mV voltages differ'
+    reference = min(timeit.repeat(list_based,number=1,repeat=repeat))
+    _report('adc2mV + vstack',reference)
+    _report('adc2V float64',min(timeit.repeat(vectorized,number=1,repeat=repeat)),reference)
+    _report('adc2V float32',min(timeit.repeat(lambda: vectorized(np.float32),number=1,repeat=repeat)),reference)
+
+def bench_streaming(sampleRate=10e6,chunkSize=int(1e5),maxSamples=int(1e7)):
+    '''
+    continuous acquisition on the virtual ps5000a driver: checks that the chunks have no gap
+    and reports the streaming counters
+    '''
+    print('-- streaming, {0:.0f} MS/s, {1} samples --'.format(1e-6*sampleRate,maxSamples))
+    import virtual_pico
+    virtual_pico.install()
+    import pico5000
+    with pico5000.Pico5000() as scope:
+        scope.set_timeBase(sampleRate=sampleRate)
+        expected = 0
+        with scope.streaming(chunkSize=chunkSize,maxSamples=maxSamples,raw=True) as stream:
+            for chunk in stream:
+                first = int(round(chunk['time (s)'][0]/stream.timeIntervalSeconds))
+                assert first==expected and not chunk['gap'], 'gap in the streamed chunks'
+                expected += len(chunk['time (s)'])
+        print(stream.throughput)
+
+def bench_pipeline(n_points=100,nSegments=32,noSamples=5000,transfer_rate=50e6,fire_s=5e-3,process_s=5e-3):
+    '''
+    points/s of a rapid block acquisition on the virtual ps5000a driver, each point being fired
+    (soft triggers, fire_s), transferred (at transfer_rate bytes/s), converted and processed (process_s):
+    sequential read loop against Pico5000.pipeline
+    '''
+    print('-- rapid block pipeline, {0} points of {1} x {2} samples --'.format(n_points,nSegments,noSamples))
+    import time
+    import virtual_pico
+    driver = virtual_pico.install()
+    driver.transfer_rate = transfer_rate
+    import pico5000
+    with pico5000.Pico5000() as scope:
+        scope.channels['B'].set_channel(enabled=True)
+        scope.set_timeBase(sampleRate=250e6,noSamples=noSamples)
+        scope.trigger.set_trigger(nSegments=nSegments)
+        fire = lambda: time.sleep(fire_s)
+        scope.runBlock() #warm-up
+        scope.waitUntilReady()
+        scope.read()
+        start_time = time.perf_counter()
+        for k in range(n_points):
+            scope.runBlock()
+            fire()
+            scope.waitUntilReady()
+            results = scope.read()
+            time.sleep(process_s)
+        sequential = n_points/(time.perf_counter()-start_time)
+        pipeline = scope.pipeline(n_points,fire=fire)
+        for results in pipeline:
+            time.sleep(process_s)
+    print('sequential: {0:.1f} points/s, pipelined: {1:.1f} points/s'.format(sequential,pipeline.pointsPerSecond))
+
+def bench_accumulate(noSamples=5000,nSegments=32,repeat=10):
+    '''
+    mean over the segments of a rapid block read on the virtual ps5000a driver (host side only):
+    conversion of the noSamples*nSegments block to volts then np.mean, against the integer Accumulator
+    '''
+    print('-- segment averaging, {0} samples x {1} segments --'.format(noSamples,nSegments))
+    import virtual_pico
+    virtual_pico.install()
+    import pico5000
+    with pico5000.Pico5000() as scope:
+        scope.set_timeBase(sampleRate=250e6,noSamples=noSamples)
+        scope.trigger.set_trigger(nSegments=nSegments)
+        scope.runBlock()
+        scope.waitUntilReady()
+        scope.read()
+        maxADC = scope._maxADC
+        def mean_of_volts():
+            return np.mean(scope._results(['A'],noSamples,maxADC=maxADC)['A (V)'],axis=1)
+        def accumulated(variance=False):
+            accumulator = pico5000.Accumulator(variance=variance)
+            accumulator.add(scope,['A'],noSamples,maxADC=maxADC)
+            return accumulator.results()['A (V)'][:,0]
+        assert np.allclose(mean_of_volts(),accumulated(),rtol=0,atol=1e-12), 'accumulated mean differs'
+        reference = min(timeit.repeat(mean_of_volts,number=1,repeat=repeat))
+        _report('adc2V + np.mean',reference)
+        _report('Accumulator',min(timeit.repeat(accumulated,number=1,repeat=repeat)),reference)
+        _report('Accumulator with variance',min(timeit.repeat(lambda: accumulated(True),number=1,repeat=repeat)),reference)
+
+def bench_align(noSamples=2000,nSegments=64,freq=20e6,sampleRate=62.5e6,repeat=10):
+    '''
+    averaging of rapid block segments with trigger jitter (virtual ps5000a: random offset within one sample):
+    amplitude of the mean segment at freq without and with the trigger offset alignment, and host time
+    '''
+    print('-- trigger offset alignment, {0} segments, {1} MHz at {2} MS/s --'.format(nSegments,1e-6*freq,1e-6*sampleRate))
+    import virtual_pico
+    virtual_pico.install()
+    import pico5000
+    def amplitude(mean):
+        return 2*np.max(np.abs(np.fft.rfft(mean-np.mean(mean))))/len(mean)
+    with pico5000.Pico5000() as scope:
+        scope.set_timeBase(sampleRate=sampleRate,noSamples=noSamples)
+        scope.trigger.set_trigger(nSegments=nSegments)
+        scope.awg.set_builtin(freq=[freq,freq],pkToPk=1.)
+        scope.runBlock()
+        scope.waitUntilReady()
+        for align in [False,True]:
+            results = scope.read(accumulate=True,align=align)
+            duration = min(timeit.repeat(lambda: scope.read(accumulate=True,align=align),number=1,repeat=repeat))
+            print('align={0}: amplitude {1:.4f} V (0.5 V sent), read {2:.3f} ms'.format(
+                  align,amplitude(results['A (V)'][:,0]),1e3*duration))
+
+def bench_save(n_readouts=100,noSamples=5000,nSegments=8):
+    '''
+    autosave of n_readouts readouts in the LDV_scanner data file layout (hdf5_utils.save_results_to_hdf5, virtual ps5000a),
+    in volts and in ADC counts (raw), with a save/load round trip check of one readout (overflow flags and scale included)
+    '''
+    print('-- data file of {0} readouts, {1} samples x {2} segments --'.format(n_readouts,noSamples,nSegments))
+    import os
+    import tempfile
+    import time
+    import virtual_pico
+    virtual_pico.install()
+    import pico5000
+    import hdf5_utils
+    with pico5000.Pico5000() as scope, tempfile.TemporaryDirectory() as folder:
+        scope.channels['B'].set_channel(enabled=True)
+        scope.set_timeBase(sampleRate=250e6,noSamples=noSamples)
+        scope.trigger.set_trigger(nSegments=nSegments)
+        for raw in [False,True]:
+            scope.runBlock()
+            scope.waitUntilReady()
+            readout = scope.read(raw=raw)
+            readout.update({'x':1e-4,'y':-2e-4})
+            fname = os.path.join(folder,'data_{0}'.format(int(raw)))
+            start_time = time.perf_counter()
+            hdf5_utils.save_results_to_hdf5([{}]+n_readouts*[readout],fname)
+            duration = time.perf_counter()-start_time
+            loaded = hdf5_utils.load_results_from_hdf5(fname)
+            assert len(loaded)==n_readouts+1 and loaded[0]=={}, 'readouts lost in the data file'
+            assert sorted(loaded[1])==sorted(readout.keys()), 'keys lost in the data file'
+            for key,value in readout.items():
+                if isinstance(value,dict):
+                    for channel,flags in value.items():
+                        assert np.array_equal(loaded[1][key][channel],flags), '{0} differs in the data file'.format(key)
+                else:
+                    assert np.array_equal(loaded[1][key],value), '{0} differs in the data file'.format(key)
+            print('raw={0}: {1:.2f} ms per readout, {2:.1f} MB, round trip ok'.format(
+                  raw,1e3*duration/n_readouts,1e-6*os.path.getsize(fname)))
+
+def bench_settle(n_points=50,latency=0.1e-3,transfer_rate=1e6,radius=0.5e-3):
+    '''
+    per-point duration of Galvosystem.move on the virtual ps2000 drivers (simulated motors, latency (in s)
+    per driver call, values transferred at transfer_rate bytes/s): settle checks over the full block
+    against the short error-channel settle check, with the X and Y axes polled in series or in parallel,
+    then open-loop moves with the calibrated settle models
+    '''
+    print('-- galvo settle check, {0} points --'.format(n_points))
+    import time
+    import virtual_pico
+    virtual_pico.install(ps2000=virtual_pico.VirtualPs2000(latency=latency,transfer_rate=transfer_rate))
+    import pico2000
+    import galvomirrors
+    theta = np.linspace(0,2*np.pi,n_points)
+    points = radius*np.array([np.cos(theta),np.sin(theta)]).T
+    with pico2000.Pico2000() as scope1, pico2000.Pico2000() as scope2, galvomirrors.Galvosystem([scope1,scope2]) as galvo:
+        durations = {}
+        for name,settle_samples,parallel in [('full block',scope1.settings['noSamples'],False),
+                                             ('settle check',galvo.motor['X'].settle_samples,False),
+                                             ('settle check, X/Y parallel',galvo.motor['X'].settle_samples,True)]:
+            for motor in galvo.motor.values():
+                motor.settle_samples = settle_samples
+            galvo.parallel = parallel
+            galvo.move(*points[-1])
+            start_time = time.perf_counter()
+            for point in points:
+                galvo.move(*point)
+            durations[name] = (time.perf_counter()-start_time)/n_points
+            _report('{0} ({1} samples)'.format(name,settle_samples),durations[name],durations.get('full block'))
+        galvo.calibrate_settle()
+        for verify_every in [1,10]:
+            galvo.verify_every = verify_every
+            start_time = time.perf_counter()
+            for point in points:
+                galvo.move(*point)
+            _report('settle model, verify 1/{0}'.format(verify_every),(time.perf_counter()-start_time)/n_points,
+                    durations['full block'])
+        print('open-loop moves: {0}'.format(galvo.open_loop))
+
+def bench_commands(n_points=2000,repeat=5):
+    '''
+    host time of the galvo commands of a scan path on the virtual ps2000 drivers (no latency, no settling):
+    positions converted and checked at each point (Galvosystem.move) against the compiled path
+    (Galvosystem.compile_path, then a single driver call per motor as in move_to_index)
+    '''
+    print('-- galvo commands, {0} points --'.format(n_points))
+    import timeit
+    import virtual_pico
+    virtual_pico.install(ps2000=virtual_pico.VirtualPs2000())
+    import pico2000
+    import galvomirrors
+    points = np.random.default_rng(0).uniform(-0.5e-3,0.5e-3,(n_points,2))
+    with pico2000.Pico2000() as scope1, pico2000.Pico2000() as scope2, galvomirrors.Galvosystem([scope1,scope2]) as galvo:
+        galvo.parallel = False
+        def per_point():
+            for posx,posy in points:
+                angles = {'X':np.rad2deg(galvo.pos2angle(posx)),'Y':np.rad2deg(galvo.pos2angle(posy))}
+                for direction,angle in angles.items():
+                    assert(np.abs(angle)<=10.6)
+                    galvo.motor[direction]._move(angle)
+        def compiled():
+            galvo.compile_path(points)
+            angles,offsets = galvo.compiled['angles'],galvo.compiled['offsets']
+            for index in range(n_points):
+                for k,direction in enumerate(['X','Y']):
+                    galvo.motor[direction]._command(offsets[index,k],angles[index,k])
+        reference = min(timeit.repeat(per_point,number=1,repeat=repeat))/n_points
+        _report('per point',reference)
+        _report('compiled path',min(timeit.repeat(compiled,number=1,repeat=repeat))/n_points,reference)
+
+def bench_read2000(sizes=(100,2000),repeat=1000):
+    '''
+    latency of Pico2000.read for the galvo settle check (channel B only) and a full read (channels A and B),
+    for each block size: on the virtual ps2000 driver (simulated motor, no latency, no transfer time), and
+    with a driver call returning at once (the overhead of the wrapper alone)
+    '''
+    print('-- pico2000 read latency --')
+    import timeit
+    import virtual_pico
+    driver = virtual_pico.VirtualPs2000()
+    virtual_pico.install(ps2000=driver)
+    import pico2000
+    get_values = driver.ps2000_get_values
+    with pico2000.Pico2000() as scope:
+        for noSamples in sizes:
+            scope.runBlock(noSamples=noSamples)
+            scope.waitUntilReady()
+            for source in [['B'],['A','B']]:
+                durations = []
+                for stub in [False,True]:
+                    driver.ps2000_get_values = (lambda *args: noSamples) if stub else get_values
+                    durations.append(min(timeit.repeat(lambda: scope.read(source=source,noSamples=noSamples),number=1,repeat=repeat)))
+                driver.ps2000_get_values = get_values
+                print('{0:5d} samples, channels {1:<4s} read {2:7.1f} us, wrapper only {3:6.1f} us'.format(
+                      noSamples,'+'.join(source),1e6*durations[0],1e6*durations[1]))
+
+def bench_order(radius=0.9e-3,resolution=50e-6,calibrated=True):
+    '''
+    travel and predicted galvo settle time (see galvomirrors.Galvosystem.predict_settle, virtual ps2000 motors)
+    of a hex lattice disk in the design order (rows in the same direction, see scan_paths.fill) and ordered
+    by scan_paths.order_path, and the ordering time
+    '''
+    print('-- scan order, disk of {0} mm radius at {1} um --'.format(1e3*radius,1e6*resolution))
+    import time
+    import virtual_pico
+    virtual_pico.install(ps2000=virtual_pico.VirtualPs2000())
+    import pico2000
+    import galvomirrors
+    import scan_paths
+    points = scan_paths.design({'type':'circle','radius (mm)':1e3*radius,'resolution (um)':1e6*resolution})
+    with pico2000.Pico2000() as scope1, pico2000.Pico2000() as scope2, galvomirrors.Galvosystem([scope1,scope2]) as galvo:
+        if calibrated:
+            galvo.calibrate_settle(n_repeats=1)
+        for method in ['none','serpentine','tour']:
+            start_time = time.perf_counter()
+            path = points[scan_paths.order_path(points,method=method)]
+            duration = time.perf_counter()-start_time
+            distance,largest = scan_paths.travel(path)
+            print('{0:<10s} {1:6d} points: travel {2:7.1f} mm, largest step {3:6.0f} um, predicted settle {4:6.2f} s, ordered in {5:7.1f} ms'.format(
+                  'design' if method=='none' else method,len(path),1e3*distance,1e6*largest,galvo.predict_settle(path),1e3*duration))
+
+def bench_adaptive(radius=0.9e-3,resolution=25e-6,spot=0.15e-3,noise=1e-3):
+    '''
+    points measured and travel of coarse-to-fine scans (scan_paths.adaptive) of a hex lattice disk, against the
+    full scan, on a synthetic sample: a vibration localised in a spot (gaussian envelope of radius spot,
+    ring pattern), measurement noise relative to the peak. missed counts the points above 30% of the peak
+    that were not measured
+    '''
+    print('-- adaptive scan, disk of {0} mm radius at {1} um --'.format(1e3*radius,1e6*resolution))
+    import time
+    import scan_paths
+    points = scan_paths.design({'type':'circle','radius (mm)':1e3*radius,'resolution (um)':1e6*resolution})
+    points = points[scan_paths.serpentine(points)]
+    rng = np.random.default_rng(0)
+    def sample(p):
+        r = np.hypot(p[:,0]-0.2e-3,p[:,1]+0.1e-3)
+        return np.exp(-(r/spot)**2)*np.abs(np.cos(r/40e-6))
+    truth = sample(points)
+    print('full scan  {0:6d} points, travel {1:7.1f} mm'.format(len(points),1e3*scan_paths.travel(points)[0]))
+    for levels in [1,2,3]:
+        visited = []
+        def measure(indices,level):
+            visited.extend(indices)
+            return sample(points[indices])+noise*rng.standard_normal(len(indices))
+        start_time = time.perf_counter()
+        values,passes = scan_paths.adaptive(points,measure,levels=levels)
+        duration = time.perf_counter()-start_time
+        print('levels={0}   {1:6d} points (x{2:.1f}), travel {3:7.1f} mm, missed {4}, planned in {5:.1f} ms'.format(
+              levels,len(visited),len(points)/len(visited),1e3*scan_paths.travel(points[visited])[0],
+              np.sum((truth>0.3)&(passes<0)),1e3*duration))
+
+def bench_design(resolution=5.):
+    '''
+    generation time and peak memory of scan paths (scan_paths.design) of millions of points, at resolution (in um),
+    and of a lazy scan path (scan_paths.design_path) of hundreds of millions of points
+    '''
+    print('-- scan path design at {0} um --'.format(resolution))
+    import time
+    import tracemalloc
+    import scan_paths
+    yy,xx = np.mgrid[-1:1:500j,-1:1:500j]
+    designs = {'circle':{'type':'circle','radius (mm)':5.},
+               'annulus':{'type':'annulus','inner radius (mm)':2.,'outer radius (mm)':5.},
+               'polygon':{'type':'polygon','vertices (mm)':5*np.array([np.cos(np.linspace(0,2*np.pi,200,endpoint=False)*3),
+                                                                     np.sin(np.linspace(0,2*np.pi,200,endpoint=False)*3)]).T*
+                                                           (1+0.3*np.cos(np.linspace(0,6*np.pi,200)))[:,None]/3},
+               'regions':{'type':'regions','regions':[{'type':'circle','radius (mm)':2.,'xoffset':-3.},
+                                                      {'type':'rectangle','xlength (mm)':2.,'ylength (mm)':3.,'xoffset':3.}]},
+               'mask':{'type':'mask','mask':np.hypot(xx,yy)**2+0.5*np.sin(8*xx)>0.3,'pixel (um)':20.,'origin (mm)':(-5.,-5.)}}
+    for name,settings in designs.items():
+        settings['resolution (um)'] = resolution
+        tracemalloc.start()
+        start_time = time.perf_counter()
+        points = scan_paths.design(settings)
+        duration = time.perf_counter()-start_time
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        print('{0:<8s} {1:9d} points in {2:6.3f} s, output {3:6.1f} MB, peak {4:6.1f} MB'.format(
+              name,len(points),duration,1e-6*points.nbytes,1e-6*peak))
+    #lazy path of a 100 mm wafer, read by blocks
+    tracemalloc.start()
+    start_time = time.perf_counter()
+    path = scan_paths.design_path({'type':'circle','radius (mm)':50.,'resolution (um)':resolution})
+    duration = time.perf_counter()-start_time
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    print('wafer    {0:9d} points in {1:6.3f} s (lazy), peak {2:6.1f} MB'.format(len(path),duration,1e-6*peak))
+    start_time = time.perf_counter()
+    n_points = 0
+    for start,block in path.blocks(size=int(1e6)):
+        n_points += len(block)
+        if n_points>=int(1e7):
+            break
+    print('wafer    {0:9d} points read by blocks in {1:6.3f} s'.format(n_points,time.perf_counter()-start_time))
+
+def bench_async(n_points=50,nSegments=8,noSamples=5000,transfer_rate=20e6,latency=0.5e-3,radius=0.5e-3):
+    '''
+    points/s of a scan on the virtual drivers (two ps2000 driving the galvo motors, with latency (in s) per call,
+    and a ps5000a transferring at transfer_rate bytes/s): sequential move/capture/read loop against
+    async_devices.scan, where the readout of a point is transferred while the beam moves to the next one
+    (both move along the compiled path, see Galvosystem.move_to_index)
+    '''
+    print('-- asyncio scan, {0} points --'.format(n_points))
+    import asyncio
+    import time
+    import virtual_pico
+    driver = virtual_pico.install(ps2000=virtual_pico.VirtualPs2000(latency=latency))
+    driver.transfer_rate = transfer_rate
+    import pico2000
+    import pico5000
+    import galvomirrors
+    import async_devices
+    theta = np.linspace(0,2*np.pi,n_points)
+    points = radius*np.array([np.cos(theta),np.sin(theta)]).T
+    with pico2000.Pico2000() as scope1, pico2000.Pico2000() as scope2, pico5000.Pico5000() as scope, galvomirrors.Galvosystem([scope1,scope2]) as galvo:
+        scope.channels['B'].set_channel(enabled=True)
+        scope.set_timeBase(sampleRate=250e6,noSamples=noSamples)
+        scope.trigger.set_trigger(nSegments=nSegments)
+        scope.runBlock() #warm-up
+        scope.waitUntilReady()
+        scope.read()
+        start_time = time.perf_counter()
+        galvo.compile_path(points)
+        for k in range(n_points):
+            galvo.move_to_index(k)
+            scope.runBlock()
+            scope.waitUntilReady()
+            scope.read()
+        sequential = n_points/(time.perf_counter()-start_time)
+        async def main():
+            with async_devices.AsyncGalvosystem(galvo) as agalvo, async_devices.AsyncPico5000(scope) as ascope:
+                return await async_devices.scan(agalvo,ascope,points)
+        start_time = time.perf_counter()
+        results = asyncio.run(main())
+        concurrent = n_points/(time.perf_counter()-start_time)
+    print('sequential: {0:.1f} points/s, asyncio: {1:.1f} points/s'.format(sequential,concurrent))
+
+
+if __name__ == '__main__':
+    bench_adc2V()
+    bench_streaming()
+    bench_pipeline()
+    bench_accumulate()
+    bench_align()
+    bench_save()
+    bench_settle()
+    bench_commands()
+    bench_read2000()
+    bench_design()
+    bench_order()
+    bench_adaptive()
+    bench_async()
@@ -1,4 +1,5 @@
 import pico2000
+import concurrent.futures
 import numpy as np
 import time
 import matplotlib.pyplot as plt
@@ -8,6 +9,32 @@ from Galvomirrors_config import*
 class MotorError(Exception):
     pass
 
+class SettleModel():
+    '''
+    settle time of a motor as a function of the step size and direction, measured by Motor.calibrate_settle.
+    The times are interpolated linearly between the calibrated step sizes and multiplied by margin,
+    steps larger than the largest calibrated step are not predicted (closed-loop settling)
+    '''
+    def __init__(self,steps,times,margin=1.2):
+        '''
+        arguments:
+            steps: the calibrated step sizes (in degrees, increasing)
+            times: {+1: settle times of the positive steps, -1: of the negative steps} (in s)
+        keyword arguments:
+            margin: safety factor applied to the predictions
+        '''
+        self.steps = np.asarray(steps,dtype=float)
+        self.times = {direction:np.asarray(values,dtype=float) for direction,values in times.items()}
+        self.margin = margin
+    
+    def predict(self,step):
+        '''
+        returns the settle time (in s) of a step (in degrees, signed), None beyond the calibrated steps
+        '''
+        if np.abs(step)>self.steps[-1]:
+            return None
+        return self.margin*np.interp(np.abs(step),self.steps,self.times[1 if step>=0 else -1])
+
 class Motor():
     '''
     motor object, controlled by the picoscope2000 (scope) with (possibly) an amplifier
@@ -35,6 +62,24 @@ class Motor():
             raise KeyError('This scope should not be connected to a motor')
         self.gain = self.config['volts_per_deg']/self.config['gain']
         self.max_range = 2./self.gain
+        self.settle_samples = min(self.config['settle_samples'],self.scope.settings['noSamples'])
+        self.angle = None #last commanded angle (in degrees)
+        self.settle_model = None #see calibrate_settle
+    
+    def _acquire(self,source,noSamples=None):
+        '''
+        captures a block and reads a single channel
+        arguments:
+            source: the channel to read ('A': position, 'B': error)
+        keyword arguments:
+            noSamples: number of samples, defaults to the scope settings
+        returns:
+            the channel voltage (in V)
+        '''
+        self.scope.runBlock(noSamples=noSamples)
+        self.armed_at = time.perf_counter() #the capture starts at the latest now
+        self.scope.waitUntilReady()
+        return self.scope.read(source=[source],noSamples=noSamples)[source+' (V)']
         
     def _move(self,angle):
         '''
@@ -47,6 +92,33 @@ class Motor():
         v = self.gain*angle + self.config['offset']
         assert(np.abs(v)<=2.),'motor range exceeded'
         self.scope.awg.set_builtin(offsetVoltage= v)
+        self.angle = angle
+    
+    def command(self,angles):
+        '''
+        converts angles to command offset voltages, vectorized (see Galvosystem.compile_path)
+        arguments:
+            angles (in degrees, array)
+        returns:
+            the offset voltages (in V)
+        raises AssertionError when the motor range is exceeded
+        '''
+        v = self.gain*np.asarray(angles,dtype=float) + self.config['offset']
+        exceeded = np.flatnonzero(np.abs(v)>2.)
+        assert not len(exceeded), 'motor range exceeded at point {0}'.format(exceeded[0])
+        return v
+    
+    def _command(self,offsetVoltage,angle):
+        '''
+        starts moving the motor with a precompiled command (see command): a single driver call
+        arguments:
+            offsetVoltage: the command (in V)
+            angle: the corresponding angle (in degrees)
+        returns:
+            None
+        '''
+        self.scope.awg.set_offset(offsetVoltage)
+        self.angle = angle
         
     def move_simple(self,angle):
         '''
@@ -57,13 +129,84 @@ class Motor():
             None
         '''
         self._move(angle)
+        self.wait_settled(2*self.config['fullscale_response(ms)']/1000)
+        assert(np.abs(angle - self.position) < 10*self.config['moving_tol(deg)'])
+        
+    def settle_times(self,steps):
+        '''
+        predicted settle times of steps, vectorized: the settle model when calibrated and the step is within
+        its range, otherwise interpolated from step_response (small steps) to fullscale_response (full range)
+        arguments:
+            steps (in degrees, signed, array)
+        returns:
+            the settle times (in s)
+        '''
+        steps = np.asarray(steps,dtype=float)
+        times = 1e-3*np.interp(np.abs(steps),[0.,2*self.max_range],
+                               [self.config['step_response(ms)'],self.config['fullscale_response(ms)']])
+        model = self.settle_model
+        if model is not None:
+            for direction,selected in [(1,steps>=0),(-1,steps<0)]:
+                selected &= np.abs(steps)<=model.steps[-1]
+                times[selected] = model.margin*np.interp(np.abs(steps[selected]),model.steps,model.times[direction])
+        return times
+    
+    def wait_settled(self,timeout):
+        '''
+        polls the settle check (isMoving) until the motor is stable
+        arguments:
+            timeout: maximum waiting time (in s)
+        returns:
+            None
+        raises TimeoutError when the motor does not settle
+        '''
         start_time = time.time()
-        timeout = 2*self.config['fullscale_response(ms)']/1000
         while self.isMoving:
             time.sleep(self.config['step_response(ms)']/1000.)
             if time.time() - start_time > timeout: raise TimeoutError('for some reason the motors took too long to respond')
-        assert(np.abs(angle - self.position) < 10*self.config['moving_tol(deg)'])
         
+    def calibrate_settle(self,steps=np.geomspace(0.01,2.,9),n_repeats=3,base=0.,margin=1.2):
+        '''
+        measures the settle time of steps from base, in both directions: the shortest wait after the command
+        (doubled from step_response/10) after which a single settle check finds the motor stable n_repeats
+        times in a row. The time recorded runs from the command to the end of the settle check capture
+        (median of the n_repeats checks), and is made non-decreasing with the step size.
+        the result is stored in self.settle_model (see SettleModel)
+        keyword arguments:
+            steps: the step sizes (in degrees)
+            n_repeats: number of consecutive stable checks required
+            base: the starting angle of the steps (in degrees)
+            margin: safety factor of the model
+        returns:
+            the SettleModel
+        '''
+        timeout = 2*self.config['fullscale_response(ms)']/1000
+        capture = self.settle_samples*self.scope.settings['timeIntervalSeconds'] #settle check duration
+        times = {1:[],-1:[]}
+        for step in steps:
+            for direction in [1,-1]:
+                wait = 0.
+                while True:
+                    durations = []
+                    for k in range(n_repeats):
+                        self._move(base)
+                        self.wait_settled(5*timeout)
+                        self._move(base+direction*step)
+                        start_time = time.perf_counter()
+                        time.sleep(wait)
+                        if self.isMoving:
+                            break
+                        durations.append(self.armed_at-start_time+capture)
+                    else:
+                        times[direction].append(np.median(durations))
+                        break
+                    wait = 2*wait if wait else self.config['step_response(ms)']/1e4
+                    if wait > timeout: raise MotorError('the motor does not settle')
+        self.move_simple(base)
+        times = {direction:np.maximum.accumulate(values) for direction,values in times.items()}
+        self.settle_model = SettleModel(steps,times,margin=margin)
+        return self.settle_model
+    
     @property
     def position(self):
         '''
@@ -73,10 +216,7 @@ class Motor():
         returns:
             motor angle in degrees
         '''
-        self.scope.runBlock()
-        self.scope.waitUntilReady()
-        results = self.scope.read()
-        return np.mean(results['A (V)'])/self.config['output_deg_per_volts']-self.config['offset']/self.gain
+        return np.mean(self._acquire('A'))/self.config['output_deg_per_volts']-self.config['offset']/self.gain
     
     @property
     def error(self):
@@ -87,24 +227,20 @@ class Motor():
         returns:
             motor angle error in degrees
         '''
-        self.scope.runBlock()
-        self.scope.waitUntilReady()
-        results = self.scope.read()
-        return np.mean(results['B (V)'])*self.config['output_error_deg_per_volts']
+        return np.mean(self._acquire('B'))*self.config['output_error_deg_per_volts']
     
     @property
     def isMoving(self):
         '''
         based on the positioning error, indicates whether the motor has completed its motion.
+        The settle check is a short block (motor.settle_samples samples) of the error channel only
         arguments: 
             None
         returns:
             boolean (True if the error is below motor.config['moving_tol(deg)'] )
         '''
-        self.scope.runBlock()
-        self.scope.waitUntilReady()
-        results = self.scope.read()
-        return np.max(np.abs(results['B (V)']))*self.config['output_error_deg_per_volts']>self.config['moving_tol(deg)']  
+        error = self._acquire('B',noSamples=self.settle_samples)
+        return np.max(np.abs(error))*self.config['output_error_deg_per_volts']>self.config['moving_tol(deg)']  
     
     @property
     def diagnose(self):
@@ -163,6 +299,27 @@ class Galvosystem():
                               self.angle2pos(np.deg2rad(self.motor['X'].max_range)),
                               self.angle2pos(np.deg2rad(self.motor['Y'].max_range))])
         print('scanner magnification: {0},\n max range (mm): +/- {1}'.format(self.magn,1e3*self.max_range))
+        #the two motors are on independent scopes: they are polled in parallel, one worker per axis
+        #(the calls to a motor stay in its worker, see async_devices.AsyncGalvosystem)
+        self.parallel = True
+        self._workers = {direction:concurrent.futures.ThreadPoolExecutor(max_workers=1) for direction in ['X','Y']}
+        #open-loop moves with the settle models of the motors (see calibrate_settle): the predicted time
+        #is waited and one move in verify_every is verified, a failed verification falls back to polling
+        self.verify_every = 1
+        self.open_loop = {'moves':0,'verified':0,'failed':0}
+    
+    def close(self):
+        '''
+        shuts down the axis workers (the scopes are closed by their owner)
+        '''
+        for worker in self._workers.values():
+            worker.shutdown(wait=True)
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self,type,value,traceback):
+        self.close()
            
         
     def set_lens(self,lens_name='4x'):
@@ -174,6 +331,7 @@ class Galvosystem():
             None
         '''
         self.lens = lens_specs[lens_name]
+        self.compiled = None #the compiled scan path depends on the lens, see compile_path
         self.magn = lens_specs['100mm']['effectiveFocalLength(mm)']/self.lens['effectiveFocalLength(mm)']
         self.magn_cam = lens_specs['camLens']['effectiveFocalLength(mm)']/self.lens['effectiveFocalLength(mm)']
         self.optics_range = self.angle2pos(np.deg2rad(10.6))
@@ -201,9 +359,100 @@ class Galvosystem():
         angle = np.arctan(0.5*self.magn*pos*1e3/(lens_specs['scan']['effectiveFocalLength(mm)'])) #the mirror is at 45 degrees so the deflection is doubled
         return angle
     
+    def compile_path(self,points):
+        '''
+        compiles a scan path into the per-axis command table used by move_to_index: the angles
+        (with the current lens magnification) and the offset voltages of all the points are computed
+        and checked at once
+        arguments:
+            points: the positions (m), m*2 array
+        returns:
+            the offset voltages (in V), m*2 array (columns X and Y)
+        raises AssertionError when a point is outside the optics range or the motors range
+        '''
+        points = np.asarray(points,dtype=float)
+        assert points.ndim==2 and points.shape[1]==2, 'the scan path must be an m*2 array'
+        angles = np.rad2deg(self.pos2angle(points))
+        outside = np.flatnonzero(np.any(np.abs(angles)>10.6,axis=1))
+        assert not len(outside), 'the point {0} is outside the optics range'.format(outside[0])
+        offsets = np.column_stack([self.motor[direction].command(angles[:,k]) for k,direction in enumerate(['X','Y'])])
+        self.compiled = {'points':points,'angles':angles,'offsets':offsets}
+        return offsets
+    
+    def _each_axis(self,function):
+        '''
+        runs function(direction) for the X and Y axes, in parallel when self.parallel
+        returns:
+            {direction: result}
+        the exception of a failing axis is raised once both axes are done
+        '''
+        if not self.parallel:
+            return {direction:function(direction) for direction in ['X','Y']}
+        futures = {direction:self._workers[direction].submit(function,direction) for direction in ['X','Y']}
+        concurrent.futures.wait(futures.values())
+        return {direction:future.result() for direction,future in futures.items()}
+    
+    def calibrate_settle(self,**kwargs):
+        '''
+        calibrates the settle model of both motors (see Motor.calibrate_settle), the next moves are open-loop.
+        The motors are calibrated one after the other, not to disturb the timings
+        keyword arguments are passed to Motor.calibrate_settle
+        returns:
+            {direction: SettleModel}
+        '''
+        return {direction:motor.calibrate_settle(**kwargs) for direction,motor in self.motor.items()}
+    
+    def _settle_time(self,angles):
+        #predicted settle time of the move to angles (in s), None when a step is not covered by a settle model
+        durations = []
+        for direction,angle in angles.items():
+            motor = self.motor[direction]
+            if motor.settle_model is None or motor.angle is None:
+                return None
+            duration = motor.settle_model.predict(angle-motor.angle)
+            if duration is None:
+                return None
+            durations.append(duration)
+        return max(durations)
+    
+    def predict_settle(self,points):
+        '''
+        predicted settle time of a scan path: the sum over the moves of the slowest axis (see Motor.settle_times)
+        arguments:
+            points: the positions (m), m*2 array
+        returns:
+            the total settle time (in s)
+        '''
+        angles = np.rad2deg(self.pos2angle(np.asarray(points,dtype=float)))
+        steps = np.diff(angles,axis=0)
+        if not len(steps):
+            return 0.
+        return np.sum(np.max([self.motor[direction].settle_times(steps[:,k]) for k,direction in enumerate(['X','Y'])],axis=0))
+    
+    def _open_loop_move(self,command,duration):
+        '''
+        commands both axes (command(direction)) and waits for the predicted settle time,
+        returns False when the move is verified and a motor is still moving (the margins are then increased)
+        '''
+        self._each_axis(command)
+        time.sleep(duration)
+        self.open_loop['moves'] += 1
+        if self.open_loop['moves']%self.verify_every:
+            return True
+        self.open_loop['verified'] += 1
+        if not any(self._each_axis(lambda direction: self.motor[direction].isMoving).values()): #a single settle check
+            return True
+        self.open_loop['failed'] += 1
+        for motor in self.motor.values(): #the model was optimistic
+            motor.settle_model.margin *= 1.5
+        return False
+    
     def move(self,posx,posy, n_attempts = 3):
         '''
         moves the laser beam, waits until motion is complete
+        (the X and Y axes are moved, polled and checked in parallel, see self.parallel).
+        With calibrated settle models, the predicted settle time is waited instead of polling
+        (see calibrate_settle and self.verify_every), polling is used when a verification fails
         arguments:
             posx: position along x-axis (m), as defined by the motor X
             posy: position along y-axis (m), as defined by the motor Y
@@ -214,37 +463,66 @@ class Galvosystem():
         assert(np.rad2deg(np.abs(anglex))<=10.6), 'the required position is outside the optics range'
         angley = self.pos2angle(posy)
         assert(np.rad2deg(np.abs(angley))<=10.6), 'the required position is outside the optics range'
+        angles = {'X':np.rad2deg(anglex),'Y':np.rad2deg(angley)}
+        self._goto(angles,n_attempts=n_attempts)
+    
+    def move_to_index(self,index,n_attempts=3):
+        '''
+        moves the laser beam to a point of the compiled scan path (see compile_path), waits until motion
+        is complete (see move). Each motor is commanded by a single driver call
+        arguments:
+            index: index of the point in the compiled path
+        returns:
+            None
+        '''
+        assert self.compiled is not None, 'no compiled scan path, see compile_path'
+        angles = {'X':self.compiled['angles'][index,0],'Y':self.compiled['angles'][index,1]}
+        offsets = {'X':self.compiled['offsets'][index,0],'Y':self.compiled['offsets'][index,1]}
+        self._goto(angles,n_attempts=n_attempts,offsets=offsets)
+    
+    def _goto(self,angles,n_attempts=3,offsets=None):
+        '''
+        moves the motors to angles {direction: angle (in degrees)}, with the precompiled offsets
+        {direction: offset voltage (in V)} when given, and waits until motion is complete
+        '''
+        timeout = 10*all_motors_config['fullscale_response(ms)']/1000
+        def command(direction):
+            if offsets is None:
+                self.motor[direction]._move(angles[direction])
+            else:
+                self.motor[direction]._command(offsets[direction],angles[direction])
+        def settle(direction):
+            #moves one axis, waits until it is stable and returns its position
+            command(direction)
+            self.motor[direction].wait_settled(timeout)
+            return self.motor[direction].position
+        duration = self._settle_time(angles)
+        if duration is not None and self._open_loop_move(command,duration):
+            return
         fail = True
         while fail and n_attempts>0:
             try:
-                self.motor['X']._move(np.rad2deg(anglex))
-                self.motor['Y']._move(np.rad2deg(angley))
-                timeout = 10*all_motors_config['fullscale_response(ms)']/1000
-                start_time = time.time()
-                while self.motor['X'].isMoving or self.motor['Y'].isMoving:
-                    time.sleep(all_motors_config['step_response(ms)']/1000.)
-                    if time.time()-start_time>timeout:  raise TimeoutError('for some reason the motors took too long to respond')
-                if np.abs(np.rad2deg(anglex) - self.motor['X'].position) > 10*all_motors_config['moving_tol(deg)']:
-                    raise ValueError
-                if np.abs(np.rad2deg(angley) - self.motor['Y'].position) > 10*all_motors_config['moving_tol(deg)']:
-                    raise ValueError
+                positions = self._each_axis(settle) #settled once both axes are stable
+                for direction,angle in angles.items():
+                    if np.abs(angle - positions[direction]) > 10*all_motors_config['moving_tol(deg)']:
+                        raise ValueError
                 fail = False
             except TimeoutError:
                 n_attempts-=1
             except ValueError:
                 n_attempts-=1
-        if np.abs(np.rad2deg(anglex) - self.motor['X'].position) > 10*all_motors_config['moving_tol(deg)']:
-            self.motor['X']. diagnose 
-            self.motor['X'].move_simple(np.rad2deg(anglex))  
-        if np.abs(np.rad2deg(angley) - self.motor['Y'].position) > 10*all_motors_config['moving_tol(deg)']:
-            self.motor['Y']. diagnose
-            self.motor['X'].move_simple(np.rad2deg(anglex))   
+        if not fail: #the positions were just checked
+            return
+        positions = self._each_axis(lambda direction: self.motor[direction].position)
+        for direction,angle in angles.items():
+            if np.abs(angle - positions[direction]) > 10*all_motors_config['moving_tol(deg)']:
+                self.motor[direction].diagnose
+                self.motor[direction].move_simple(angle)
             
 if __name__ == '__main__':
-    with pico2000.Pico2000() as scope1, pico2000.Pico2000() as scope2:
+    with pico2000.Pico2000() as scope1, pico2000.Pico2000() as scope2, Galvosystem([scope1,scope2],lens_name='4x') as galvo:
         #motor = Motor(scope1)
         #motor.move_simple(1.0) 
-        galvo = Galvosystem([scope1,scope2],lens_name='4x') 
         r = 0.5e-3
         theta = np.linspace(0,10*np.pi,200)
         x = r*np.cos(theta)
@@ -13,7 +13,33 @@ def load_dict_from_hdf5(filename):
     with h5py.File(filename, 'r') as h5file:
         return recursively_load_dict_contents_from_group(h5file, '/')
 
+def save_results_to_hdf5(results, filename):
+    # list of readouts (e.g. LDV_scanner.results), the key k of readout i is saved as k_i
+    with h5py.File(filename, 'w') as h5file:
+        for i, data in enumerate(results):
+            for k, v in data.items():
+                if isinstance(v, dict): # e.g. the overflow flags and the scale of the readouts
+                    recursively_save_dict_contents_to_group(h5file, '/' + k + '_' + str(i) + '/', v)
+                else:
+                    h5file.create_dataset(k + '_' + str(i), data=v)
+
+def load_results_from_hdf5(filename):
+    # inverse of save_results_to_hdf5, the readouts without data are empty dicts
+    data = load_dict_from_hdf5(filename)
+    results = {}
+    for key, value in data.items():
+        k, i = key.rsplit('_', 1)
+        results.setdefault(int(i), {})[k] = value
+    return [results.get(i, {}) for i in range(max(results) + 1 if results else 0)]
+
+
 
+def load_dataset(dataset):
+    #scalars are read back as python values (h5py >= 3 reads the strings as bytes)
+    value = dataset[()]
+    if isinstance(value, np.generic):
+        value = value.item()
+    return value.decode() if isinstance(value, bytes) else value
 
 def recursively_save_dict_contents_to_group( h5file, path, dic):
 
@@ -35,10 +61,10 @@ def recursively_save_dict_contents_to_group( h5file, path, dic):
         if not isinstance(key, str):
             raise ValueError("dict keys must be strings to save to hdf5")
         # save strings, numpy.int64, and numpy.float64 types
-        if isinstance(item, (np.int64, np.float64, str, np.float, float, np.float32,int)):
+        if isinstance(item, (np.int64, np.float64, str, float, np.float32,int)):
             #print( 'here' )
             h5file[path + key] = item
-            if not h5file[path + key][()] == item:
+            if not load_dataset(h5file[path + key]) == item:
                 raise ValueError('The data representation in the HDF5 file does not match the original dict.')
         # save numpy arrays
         elif isinstance(item, np.ndarray):            
@@ -62,7 +88,7 @@ def recursively_load_dict_contents_from_group( h5file, path):
     ans = {}
     for key, item in h5file[path].items():
         if isinstance(item, h5py._hl.dataset.Dataset):
-            ans[key] = item.value
+            ans[key] = load_dataset(item)
         elif isinstance(item, h5py._hl.group.Group):
             ans[key] = recursively_load_dict_contents_from_group(h5file, path + key + '/')
     return ans         
\ No newline at end of file
@@ -1,10 +1,74 @@
-def dichotomic_search(f,xmin,xmax,f0=0,tol=1,growing=True):
-    g = {True:1,False:-1}
-    xmed = tol*int((xmax+xmin)/(2*tol))
-    if xmed==xmax or xmed==xmin:
-        return xmed
-    else:
-        if (g[growing]*(f(xmed)- f0))>0:
-            return dichotomic_search(f,xmin,xmed,f0=f0,tol=tol,growing=growing)
-        else:
-            return dichotomic_search(f,xmed,xmax,f0=f0,tol=tol,growing=growing)
\ No newline at end of file
+import numpy as np
+
+#input ranges (in mV) indexed by the driver range enums, as in picosdk.functions.adc2mV
+channelInputRanges = [10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 20000, 50000, 100000, 200000]
+
+def last_admissible(admissible,xmin,xmax,guess):
+    '''
+    largest integer x in [xmin,xmax] such that admissible(x), xmin if there is none.
+    admissible has to be True up to some x and False beyond (at least around the answer),
+    guess is a closed-form estimate of the answer: only the few points between guess and the answer are evaluated
+    arguments:
+        admissible: predicate on integers
+        xmin, xmax: search interval (included)
+        guess: estimate of the answer (clipped to [xmin,xmax])
+    returns:
+        the last admissible integer
+    '''
+    x = min(max(int(guess),xmin),xmax)
+    while x>xmin and not admissible(x):
+        x -= 1
+    while x<xmax and admissible(x+1):
+        x += 1
+    return x
+
+def adc2V(bufferADC,range,maxADC,dtype=np.float64):
+    '''
+    converts a whole block of ADC counts to volts
+    arguments:
+        bufferADC: ADC counts (int16 array of any shape)
+        range: the driver voltage range (enum value)
+        maxADC: the maximum ADC count (ctypes.c_int16)
+    keyword arguments:
+        dtype: np.float64 gives the same voltages as 1e-3*np.array(adc2mV(...)), bit for bit,
+               np.float32 halves the output size (single scale multiply)
+    returns:
+        voltages (in V), same shape as bufferADC
+    '''
+    vRange = channelInputRanges[range]
+    if np.dtype(dtype)==np.float32:
+        return np.multiply(bufferADC,np.float32(1e-3*vRange/maxADC.value),dtype=np.float32)
+    #same operation order as adc2mV, in place over the output
+    out = np.multiply(bufferADC,vRange,dtype=np.float64)
+    out /= maxADC.value
+    out *= 1e-3
+    return out
+
+def align_segments(segments,offsets,dt,axis=0):
+    '''
+    removes sub-sample trigger jitter: each segment is delayed by its trigger time offset with an FFT
+    phase shift (all the segments at once), so that its samples are taken at the nominal times k*dt.
+    The straight line between the first and last samples is shifted analytically and removed before
+    the FFT, to limit the ringing of the periodic extension
+    arguments:
+        segments: the samples (float array), time along axis, one segment per column
+        offsets: trigger time offset of each segment (in s), the k-th sample being taken at k*dt+offset
+        dt: the sample interval (in s)
+    keyword arguments:
+        axis: the time axis of segments
+    returns:
+        aligned segments (float64, same shape as segments)
+    '''
+    y = np.moveaxis(np.asarray(segments,dtype=np.float64),axis,0)
+    n = y.shape[0]
+    if n<2:
+        return np.moveaxis(y.copy(),0,axis)
+    shift = np.asarray(offsets,dtype=np.float64)/dt #sample k is read at position k-shift of the segment
+    k = np.arange(n).reshape((n,)+(1,)*(y.ndim-1))
+    first = y[0]
+    slope = (y[-1]-y[0])/(n-1)
+    F = np.fft.rfft(y-(first+slope*k),axis=0)
+    F *= np.exp(-2j*np.pi*np.fft.rfftfreq(n).reshape((-1,)+k.shape[1:])*shift)
+    aligned = np.fft.irfft(F,n=n,axis=0)
+    aligned += first+slope*(k-shift)
+    return np.moveaxis(aligned,0,axis)
@@ -0,0 +1,151 @@
+'''
+opt-in latency instrumentation of the picoscope driver calls.
+enable() replaces the driver (ps) of the pico5000 and pico2000 modules by a proxy timing every
+ps5000a*/ps2000_* call, disable() restores it:
+    import instrumentation
+    instrumentation.enable()
+    ...acquisition...
+    print(instrumentation.summary())
+    instrumentation.dump('driver_calls.json')
+    instrumentation.disable()
+the bytes transferred are reported by the wrappers with record_bytes (a no-op when disabled)
+'''
+
+import collections
+import json
+import sys
+import threading
+import time
+import numpy as np
+
+
+class InstrumentedDriver():
+    '''
+    proxy of a picosdk driver object, records count, duration and bytes of the driver calls
+    the durations of the last window calls of each function are kept for the percentiles
+    '''
+    def __init__(self,driver,window=100000):
+        self._driver = driver
+        self._window = window
+        self._wrappers = {}
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.stats = {}
+
+    def _stats(self,name):
+        if not name in self.stats:
+            self.stats[name] = {'count':0,'total':0.,'min':np.inf,'max':0.,'bytes':0,
+                                'durations':collections.deque(maxlen=self._window)}
+        return self.stats[name]
+
+    def _record(self,name,duration):
+        with self._lock:
+            stats = self._stats(name)
+            stats['count'] += 1
+            stats['total'] += duration
+            stats['min'] = min(stats['min'],duration)
+            stats['max'] = max(stats['max'],duration)
+            stats['durations'].append(duration)
+
+    def add_bytes(self,name,nBytes):
+        with self._lock:
+            self._stats(name)['bytes'] += int(nBytes)
+
+    def __getattr__(self,name):
+        attribute = getattr(self._driver,name)
+        if not (name.startswith('ps') and callable(attribute)): #enums, callback types
+            return attribute
+        if not name in self._wrappers:
+            def timed(*args):
+                start_time = time.perf_counter()
+                try:
+                    return attribute(*args)
+                finally:
+                    self._record(name,time.perf_counter()-start_time)
+            self._wrappers[name] = timed
+        return self._wrappers[name]
+
+    def report(self,percentiles=(50,90,99)):
+        '''
+        returns {function: {count, total, mean, min, max, p50.., bytes}} (durations in s)
+        '''
+        report = {}
+        with self._lock:
+            for name,stats in self.stats.items():
+                line = {key:stats[key] for key in ['count','total','min','max','bytes']}
+                line['mean'] = stats['total']/stats['count'] if stats['count'] else 0.
+                if stats['durations']:
+                    for p,value in zip(percentiles,np.percentile(stats['durations'],percentiles)):
+                        line['p{0}'.format(p)] = float(value)
+                else: #bytes only
+                    line['min'] = 0.
+                report[name] = line
+        return report
+
+
+_modules = ['pico5000','pico2000']
+
+def _instrumented(modules):
+    modules = _modules if modules is None else modules
+    return [sys.modules[name] for name in modules if name in sys.modules]
+
+def enable(modules=None,window=100000):
+    '''
+    instruments the driver of the (already imported) wrapper modules
+    keyword arguments:
+        modules: module names, defaults to pico5000 and pico2000
+        window: number of durations kept per function for the percentiles
+    '''
+    for module in _instrumented(modules):
+        if not isinstance(module.ps,InstrumentedDriver):
+            module.ps = InstrumentedDriver(module.ps,window=window)
+
+def disable(modules=None):
+    '''
+    restores the driver of the wrapper modules
+    '''
+    for module in _instrumented(modules):
+        if isinstance(module.ps,InstrumentedDriver):
+            module.ps = module.ps._driver
+
+def record_bytes(driver,name,nBytes):
+    '''
+    adds nBytes to the bytes transferred by the driver function name, when the driver is instrumented
+    '''
+    if isinstance(driver,InstrumentedDriver):
+        driver.add_bytes(name,nBytes)
+
+def reset(modules=None):
+    for module in _instrumented(modules):
+        if isinstance(module.ps,InstrumentedDriver):
+            module.ps.reset()
+
+def report(modules=None):
+    '''
+    returns {module: {function: statistics}}, see InstrumentedDriver.report
+    '''
+    return {module.__name__:module.ps.report() for module in _instrumented(modules)
+            if isinstance(module.ps,InstrumentedDriver)}
+
+def summary(modules=None):
+    '''
+    returns a table of the driver calls, sorted by total duration
+    '''
+    lines = ['{0:<42s} {1:>8s} {2:>11s} {3:>10s} {4:>10s} {5:>10s} {6:>10s} {7:>12s}'.format(
+             'function','count','total (ms)','mean (us)','p50 (us)','p99 (us)','max (us)','bytes')]
+    for module,functions in report(modules).items():
+        for name,line in sorted(functions.items(),key=lambda item: -item[1]['total']):
+            lines.append('{0:<42s} {1:8d} {2:11.3f} {3:10.1f} {4:10.1f} {5:10.1f} {6:10.1f} {7:12d}'.format(
+                         module+'.'+name,line['count'],1e3*line['total'],1e6*line['mean'],
+                         1e6*line.get('p50',0.),1e6*line.get('p99',0.),1e6*line['max'],line['bytes']))
+    return '\n'.join(lines)
+
+def dump(fname,modules=None):
+    '''
+    writes the report to a json file
+    '''
+    with open(fname,'w') as f:
+        json.dump(report(modules),f,indent=2)
@@ -12,11 +12,13 @@ import matplotlib.pyplot as plt
 from picosdk.functions import adc2mV, assert_pico2000_ok, mV2adc
 from pico2000_admissible_settings import*
 import helper_functions
+import instrumentation
 import time
 
 class Channel():
     def __init__(self,scope,source='A',**kwargs):
         self.chandle = scope.chandle
+        self.scope = scope
         self.status = {}
         assert source in ['A','B'], 'channel name should be either A or B'
         self.source = source
@@ -37,9 +39,14 @@ class Channel():
         _channel = ctypes.c_int16(ps.PS2000_CHANNEL[channel_index[self.source]])
         _coupling_type = ctypes.c_int16(ps.PICO_COUPLING[coupling_type_index[settings['coupling_type']]])
         _chRange = ctypes.c_int16(ps.PS2000_VOLTAGE_RANGE[range_index[settings['chRange']]])
-        self.status["setCh"] = ps.ps2000_set_channel(self.chandle, _channel, 1, 
-                                                _coupling_type,_chRange) 
-        assert_pico2000_ok(self.status["setCh"])
+        #the driver call is skipped when the channel is already in this state
+        call = 'setCh'+self.source
+        arguments = (_coupling_type.value,_chRange.value)
+        if self.scope._changed(call,arguments):
+            self.status["setCh"] = ps.ps2000_set_channel(self.chandle, _channel, 1, 
+                                                    _coupling_type,_chRange) 
+            assert_pico2000_ok(self.status["setCh"])
+            self.scope._applied[call] = arguments
         self.settings = settings
         self._chRange = _chRange
         
@@ -80,23 +87,26 @@ class Trigger():
         _direction = ctypes.c_int16(int(direction_index[settings['direction']]))
         _delay = ctypes.c_int16(delay)
         _autoTrigger_ms = ctypes.c_int16(settings['auto_trigger_ms'])
-        # direction = PS5000A_RISING = 2
-        # delay = 0 s
-        # auto Trigger = 1000 ms
-        self.status["trigger"] = ps.ps2000_set_trigger(self.chandle, 
-                                                       _source, 
-                                                       _threshold, _direction, 
-                                                       _delay, _autoTrigger_ms)
-        assert_pico2000_ok(self.status["trigger"])
+        arguments = (_source.value,_threshold.value,_direction.value,_delay.value,_autoTrigger_ms.value)
+        if scope._changed('trigger',arguments):
+            # direction = PS5000A_RISING = 2
+            # delay = 0 s
+            # auto Trigger = 1000 ms
+            self.status["trigger"] = ps.ps2000_set_trigger(self.chandle, 
+                                                           _source, 
+                                                           _threshold, _direction, 
+                                                           _delay, _autoTrigger_ms)
+            assert_pico2000_ok(self.status["trigger"])
+            scope._applied['trigger'] = arguments
         self.settings = settings
     
     
-    def runBlock(self,scope,**kwargs): 
+    def runBlock(self,scope,noSamples=None,**kwargs): 
         settings = {}
         for key,current_value in self.settings.items():
             settings[key] = kwargs[key] if key in kwargs else current_value
         check_kwargs_scope(**kwargs)  
-        _noSamples = int(scope.settings['noSamples'])
+        _noSamples = int(scope.settings['noSamples'] if noSamples is None else noSamples)
         _timebase = scope.settings['timebase']
         _timeIndisposeMs = ctypes.c_int32()
         _oversample = ctypes.c_int16(scope.settings['oversample'])
@@ -104,6 +114,7 @@ class Trigger():
         self.status["runBlock"] = ps.ps2000_run_block(self.chandle, _noSamples, 
                                                 _timebase, _oversample, ctypes.byref(_timeIndisposeMs))
         assert_pico2000_ok(self.status["runBlock"])
+        scope._armedSamples = _noSamples
         self.settings = settings
 
 
@@ -120,6 +131,8 @@ class Function_generator():
                           'sweepType':'up',
                           'sweeps':0}
         self.status = {}
+        self._builtin = None #driver arguments of the last set_builtin call after the offset, see set_offset
+        self._builtinValues = None #and their values, compared by set_offset
         
     
     def set_builtin(self,**kwargs):
@@ -156,18 +169,44 @@ class Function_generator():
         _sweepType = ctypes.c_int32(sweep_type_index[settings['sweepType']])
         _sweeps = ctypes.c_uint32(settings['sweeps'])
         
-        
-        self.status["setSigGenBuiltIn"] = ps.ps2000_set_sig_gen_built_in(self.chandle, 
-                                                                    _offsetVoltage, 
-                                                                    _pkToPk, 
-                                                                    _waveType, 
-                                                                    _freqMin, _freqMax, 
-                                                                    _increment,
-                                                                    _dwellTime, 
-                                                                    _sweepType,  
-                                                                    _sweeps)
-        assert_pico2000_ok(self.status["setSigGenBuiltIn"])
+        arguments = (_offsetVoltage.value,_pkToPk.value,_waveType.value,_freqMin.value,_freqMax.value,
+                     _increment.value,_dwellTime.value,_sweepType.value,_sweeps.value)
+        if self.scope._changed('setSigGenBuiltIn',arguments):
+            self.status["setSigGenBuiltIn"] = ps.ps2000_set_sig_gen_built_in(self.chandle, 
+                                                                        _offsetVoltage, 
+                                                                        _pkToPk, 
+                                                                        _waveType, 
+                                                                        _freqMin, _freqMax, 
+                                                                        _increment,
+                                                                        _dwellTime, 
+                                                                        _sweepType,  
+                                                                        _sweeps)
+            assert_pico2000_ok(self.status["setSigGenBuiltIn"])
+            self.scope._applied['setSigGenBuiltIn'] = arguments
+        self._builtin = (_pkToPk,_waveType,_freqMin,_freqMax,_increment,_dwellTime,_sweepType,_sweeps)
+        self._builtinValues = arguments[1:]
         self.settings = settings
+    
+    def set_offset(self,offsetVoltage):
+        '''
+        fast path of set_builtin when only the offset voltage changes (e.g. the precompiled galvo commands,
+        see galvomirrors.Galvosystem.compile_path): a single driver call reusing the other arguments of
+        the last set_builtin call, without merging nor checking the settings
+        arguments:
+            offsetVoltage: (in V), checked by the caller
+        '''
+        if self._builtin is None:
+            self.set_builtin(offsetVoltage=offsetVoltage)
+            return
+        _offsetVoltage = int(offsetVoltage*1e6)
+        arguments = (_offsetVoltage,)+self._builtinValues
+        if self.scope._changed('setSigGenBuiltIn',arguments):
+            self.status["setSigGenBuiltIn"] = ps.ps2000_set_sig_gen_built_in(self.chandle,
+                                                                        ctypes.c_int32(_offsetVoltage),
+                                                                        *self._builtin)
+            assert_pico2000_ok(self.status["setSigGenBuiltIn"])
+            self.scope._applied['setSigGenBuiltIn'] = arguments
+        self.settings['offsetVoltage'] = offsetVoltage
 
 
 
@@ -180,8 +219,25 @@ class Pico2000():
                          'noSamples':2000,
                          'segmentIndex':0,
                          'oversample':1}
+        # the ps2000 driver has no block ready callback: isBusy is polled with an interval
+        # adapted to the expected capture duration
+        self.polling = {'fraction':0.1, #of the expected capture duration
+                        'min_interval':20e-6, #s
+                        'max_interval':10e-3} #s
         self.channels = {}
         self._maxADC = ctypes.c_int16(32767)
+        #time intervals read from the driver and solved timebases, see _findTimebase
+        self._timeIntervals = {}
+        self._timebases = {}
+        # last arguments applied to each setting driver call, see _changed
+        self._applied = {}
+        self.calls = {'issued':0,'skipped':0}
+        #number of samples of the last armed block
+        self._armedSamples = self.settings['noSamples']
+        #persistent read buffers (channels A and B) and time axes, see _bufferPool and read
+        self._buffers = None
+        self._overflow = ctypes.c_int16()
+        self._times = {}
         # Open 2000 series PicoScope
         # Returns handle to chandle for use in future API functions
         self.status["openUnit"] = ps.ps2000_open_unit()
@@ -239,6 +295,33 @@ class Pico2000():
                '_timeUnits':_timeUnits}
         return out
     
+    def _timeInterval(self,settings,timebase):
+        #time interval of a timebase (in s), read once from the driver
+        key = (timebase,settings['oversample'],len(self.channels))
+        if key not in self._timeIntervals:
+            self._timeIntervals[key] = self._timeBase(settings,timebase)['timeIntervalSeconds']
+        return self._timeIntervals[key]
+    
+    def _findTimebase(self,settings,sampleRate=None,timeIntervalSeconds=None):
+        '''
+        the slowest timebase whose sample rate is at least sampleRate (or whose time interval is at most timeIntervalSeconds),
+        the fastest timebase if none is. The time interval doubles with each timebase: the answer is guessed from
+        the fastest timebase interval and checked against the driver table.
+        Results are memoized per (oversample, number of channels, requested value)
+        '''
+        key = (settings['oversample'],len(self.channels),sampleRate,timeIntervalSeconds)
+        if key not in self._timebases:
+            xmin = len(self.channels)
+            if sampleRate is not None:
+                admissible = lambda n: 1./self._timeInterval(settings,n)>=sampleRate
+                ratio = 1./(sampleRate*self._timeInterval(settings,xmin))
+            else:
+                admissible = lambda n: self._timeInterval(settings,n)<=timeIntervalSeconds
+                ratio = timeIntervalSeconds/self._timeInterval(settings,xmin)
+            guess = xmin+np.floor(np.log2(ratio)) if ratio>=1 else xmin
+            self._timebases[key] = helper_functions.last_admissible(admissible,xmin,23,guess)
+        return self._timebases[key]
+    
     @property
     def info(self):
         '''
@@ -282,23 +365,28 @@ class Pico2000():
         #if these two parameters are provided, the conflict is raised
         assert not ('sampleRate' in kwargs and 'timeIntervalSeconds' in kwargs)
         if 'sampleRate' in kwargs:
-            value = kwargs['sampleRate']
-            timeBaseFunction = lambda timebase: self._timeBase(settings,timebase)['sampleRate']
-            growing = False
+            settings['timebase'] = self._findTimebase(settings,sampleRate=kwargs['sampleRate'])
         if 'timeIntervalSeconds' in kwargs:
-            value = kwargs['timeIntervalSeconds']
-            timeBaseFunction = lambda timebase: self._timeBase(settings,timebase)['timeIntervalSeconds']
-            growing = True
-        if 'sampleRate' in kwargs or 'timeIntervalSeconds' in kwargs:
-            settings['timebase'] = helper_functions.dichotomic_search(timeBaseFunction,len(self.channels),23,f0=value,tol=1,growing=growing)
-        out = self._timeBase(settings,settings['timebase'])
-        settings['sampleRate'] = out['sampleRate']
-        settings['timeIntervalSeconds'] = out['timeIntervalSeconds']
+            settings['timebase'] = self._findTimebase(settings,timeIntervalSeconds=kwargs['timeIntervalSeconds'])
+        #the sample rate of the last query is kept when nothing it depends on changed
+        arguments = (settings['timebase'],settings['noSamples'],settings['oversample'],len(self.channels))
+        if self._changed('getTimebase',arguments):
+            out = self._timeBase(settings,settings['timebase'])
+            settings['sampleRate'] = out['sampleRate']
+            settings['timeIntervalSeconds'] = out['timeIntervalSeconds']
+            self._applied['getTimebase'] = arguments
+        else:
+            settings['sampleRate'] = self.settings['sampleRate']
+            settings['timeIntervalSeconds'] = self.settings['timeIntervalSeconds']
         settings['noSamples'] = settings['noSamples']
         self.settings = settings
         
-    def runBlock(self,**kwargs):
-        self.trigger.runBlock(self,**kwargs)
+    def runBlock(self,noSamples=None,**kwargs):
+        '''
+        arms the trigger for a block of noSamples samples (defaults to self.settings['noSamples']),
+        a shorter block (e.g. a settle check) is armed without changing the timebase settings
+        '''
+        self.trigger.runBlock(self,noSamples=noSamples,**kwargs)
     
     
     @property
@@ -313,22 +401,33 @@ class Pico2000():
     
     
     
+    @property
+    def _pollInterval(self):
+        expected = self._armedSamples*self.settings['timeIntervalSeconds']*self.settings['oversample']
+        interval = self.polling['fraction']*expected
+        return min(max(interval,self.polling['min_interval']),self.polling['max_interval'])
+    
     def waitUntilReady(self,timeout=1.):
         '''
-        waits until the scope is ready
+        waits until the scope is ready,
+        polls isBusy with an interval adapted to the expected capture duration (see self.polling)
         '''
+        interval = self._pollInterval
         start_time = time.time()
         while self.isBusy:
-            time.sleep(0.01)
+            time.sleep(interval)
             if time.time()-start_time>timeout: raise TimeoutError('The scope did not respond')
     
-    def read(self,**kwargs):
+    def read(self,dtype=np.float64,source=('A','B'),noSamples=None,**kwargs):
         '''
         reads the scope results:
         arguments: none
-        keyword arguments: none
+        keyword arguments:
+            dtype: the voltage data type (np.float64 or np.float32)
+            source: the channels to transfer and convert (e.g. ['B'] for a settle check)
+            noSamples: the number of samples to read, defaults to the samples of the last armed block
         the results (in V) are returned in a dictionary:
-            time:                   the time (in s)
+            time:                   the time (in s), read-only (shared by the reads of the same length)
             A (V):   channel A voltage (in V)
             B (V):   channel B voltage (in V)
         '''
@@ -337,32 +436,45 @@ class Pico2000():
         for key,current_value in self.settings.items():
             settings[key] = kwargs[key] if key in kwargs else current_value
         check_kwargs_scope(**kwargs)  
-        # Create buffers ready for data
-        _bufferA = (ctypes.c_int16 * self.settings['noSamples'])()
-        _bufferB = (ctypes.c_int16 * self.settings['noSamples'])()
+        noSamples = self._armedSamples if noSamples is None else noSamples
+        # the driver writes in the persistent buffers, only for the channels read
+        pointers = self._bufferPool(noSamples)
+        _bufferA = pointers['A'] if 'A' in source else None
+        _bufferB = pointers['B'] if 'B' in source else None
         #_bufferC = None
         #_bufferD = None
-        # create overflow loaction
-        _overflow = ctypes.c_int16()
-        # create converted type maxSamples
-        cmaxSamples = ctypes.c_int32(self.settings['noSamples'])
-        self.status["getValues"] = ps.ps2000_get_values(self.chandle, ctypes.byref(_bufferA),  
-                                                        ctypes.byref(_bufferB), None, None,
-                                                        ctypes.byref(_overflow), cmaxSamples)
+        self.status["getValues"] = ps.ps2000_get_values(self.chandle, _bufferA,  
+                                                        _bufferB, None, None,
+                                                        ctypes.byref(self._overflow), ctypes.c_int32(noSamples))
         assert_pico2000_ok(self.status["getValues"])
+        instrumentation.record_bytes(ps,'ps2000_get_values',2*len(source)*self.status["getValues"]) #values per channel
 
         self.settings = settings
         
-        # Create time data
-        time = np.linspace(0, (cmaxSamples.value) * self.settings['timeIntervalSeconds'], cmaxSamples.value)
+        # time data, shared by the reads of the same length (read-only)
+        n = self.status["getValues"]
+        key = (n,self.settings['timeIntervalSeconds'])
+        if not key in self._times:
+            self._times[key] = np.linspace(0, n * self.settings['timeIntervalSeconds'], n)
+            self._times[key].setflags(write=False)
 
-        results = {'time (s)':time}
-        # convert ADC counts data to mV
-        adc2mVChA =  adc2mV(_bufferA, self.channels['A']._chRange.value, self._maxADC)
-        adc2mVChB =  adc2mV(_bufferB, self.channels['B']._chRange.value, self._maxADC)
-        results['A (V)']=1e-3*np.array(adc2mVChA).reshape(-1,1)
-        results['B (V)']=1e-3*np.array(adc2mVChB).reshape(-1,1)
+        results = {'time (s)':self._times[key]}
+        # convert ADC counts data to V, straight from the buffers
+        for channel in source:
+            results[channel+' (V)']=helper_functions.adc2V(self._buffers[channel_row[channel],:n,None], self.channels[channel]._chRange.value, 
+                                                           self._maxADC, dtype=dtype)
         return results    
+    
+    def _bufferPool(self,noSamples):
+        '''
+        returns the driver pointers {channel: pointer} of the persistent read buffers (one int16 row per channel),
+        the pool is reallocated only when it is too short for noSamples
+        '''
+        if self._buffers is None or self._buffers.shape[1]<noSamples:
+            self._buffers = np.zeros((len(channel_row),noSamples),dtype=np.int16)
+            self._pointers = {channel:self._buffers[row].ctypes.data_as(ctypes.POINTER(ctypes.c_int16))
+                              for channel,row in channel_row.items()}
+        return self._pointers
 
     def save_config(self):
         '''
@@ -376,10 +488,24 @@ class Pico2000():
             config[channelName]=channel.settings
         return config
     
+    def _changed(self,call,arguments):
+        '''
+        diff against the last applied state of the scope: returns False when the driver call was
+        last issued with the same arguments (the call can be skipped), True otherwise.
+        self.calls counts the issued and skipped calls,
+        the caller updates self._applied[call] once the call succeeded
+        '''
+        if call in self._applied and self._applied[call]==arguments:
+            self.calls['skipped'] += 1
+            return False
+        self.calls['issued'] += 1
+        return True
+    
     def recall_config(self,config):
         '''
         recall the scope configuration from a config dictionnary,
         config dictionnary can be generated with save_config
+        only the driver calls whose settings differ from the current state are issued (see self.calls)
         '''
         for channelName, channelSettings in config.items():
             if channelName in ['A','B','C','D']:
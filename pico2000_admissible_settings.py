@@ -6,6 +6,8 @@ from picosdk.functions import adc2mV, assert_pico_ok, mV2adc
 channel_index = {'A':"PS2000_CHANNEL_A",
                  'B':"PS2000_CHANNEL_B"}
 
+channel_row = {'A':0,'B':1} #rows of the read buffers
+
 coupling_type_index = {'DC':"DC",
                        'AC':"AC"}
 
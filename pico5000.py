@@ -10,9 +10,13 @@ import numpy as np
 from picosdk.ps5000a import ps5000a as ps
 import matplotlib.pyplot as plt
 from picosdk.functions import adc2mV, assert_pico_ok, mV2adc
+from picosdk.constants import PICO_STATUS
 from pico5000_admissible_settings import*
 import helper_functions
+import instrumentation
+import threading
 import time
+import collections
 
 
 
@@ -28,6 +32,9 @@ class Channel():
                         'chRange':2.,
                         'analogueOffset':0.,
                         'reduction_mode':'none'}
+        self._bufferMax = None #buffer pool, see _setDataBuffers
+        self._bufferMin = None
+        self._registered = None
         self.set_channel(**kwargs)
         
     def set_channel(self, **kwargs):
@@ -48,18 +55,23 @@ class Channel():
         
         #checks
         check_kwargs_scope(**kwargs)
-        if 'analogueOffset' in kwargs:
-            self.check_analogueOffset(settings)
         
         # handle = chandle
         self._source = ps.PS5000A_CHANNEL[channel_index[self.source]]
         _enabled = int(settings['enabled'])
         _coupling_type = ps.PS5000A_COUPLING[coupling_type_index[settings['coupling_type']]]
         _chRange = ps.PS5000A_RANGE[range_index[settings['chRange']]]
-        _analogueOffset = ctypes.c_float(settings['analogueOffset']) #V
-        self.status["setCh"] = ps.ps5000aSetChannel(self.chandle, self._source, _enabled, 
-                                                _coupling_type, _chRange, _analogueOffset)
-        assert_pico_ok(self.status["setCh"])
+        #the driver call is skipped when the channel is already in this state
+        call = 'setCh'+self.source
+        arguments = (_enabled,_coupling_type,_chRange,settings['analogueOffset'])
+        if self.scope._changed(call,arguments):
+            if 'analogueOffset' in kwargs:
+                self.check_analogueOffset(settings)
+            _analogueOffset = ctypes.c_float(settings['analogueOffset']) #V
+            self.status["setCh"] = ps.ps5000aSetChannel(self.chandle, self._source, _enabled, 
+                                                    _coupling_type, _chRange, _analogueOffset)
+            assert_pico_ok(self.status["setCh"])
+            self.scope._applied[call] = arguments
         self.settings = settings
         
     def check_analogueOffset(self,settings):
@@ -73,19 +85,22 @@ class Channel():
         assert_msg = 'analogue offset should be within [{0}, {1}]V'.format(minOffset.value,maxOffset.value)
         assert (settings['analogueOffset']<=maxOffset.value and settings['analogueOffset']>=minOffset.value), assert_msg
         
-    def _setDataBuffers(self,**kwargs):
+    def _setDataBuffers(self,nSegments=None,segmentIndex=None,**kwargs):
         '''
         sets the data reduction method.
         arguments: none
         keyword arguments (defaults in channel.settings):
+        nSegments: number of segments in the pool (defaults to scope.trigger.settings['nSegments'])
+        segmentIndex: the first segment to read (defaults to scope.settings['segmentIndex'], mostly useful for rapidBlock)
         reduction_mode:     'none':          no data reduction,
                             'aggregate':     min and max over block,
                             'decimate':      just the first value in the block
                             'average':       average over block
-        segmentIndex: the segment to read (mostly useful for rapidBlock)
+        the buffers are a pool of contiguous int16 arrays (nSegments*noSamples), one row per segment.
+        The pool is reallocated and registered again with the driver only when noSamples, nSegments,
+        segmentIndex or reduction_mode change.
         '''
         settings = {} #in case of failure, settings is updated only at the end
-        settings['segmentIndex'] = self.scope.settings['segmentIndex'] #default value
         for key,current_value in self.settings.items():
             settings[key] = kwargs[key] if key in kwargs else current_value
         
@@ -93,43 +108,68 @@ class Channel():
         check_kwargs_scope(**kwargs)
         
         maxSamples = self.scope.settings['noSamples']
-        # Create buffers ready for assigning pointers for data collection
+        if nSegments is None:
+            nSegments = self.scope.trigger.settings['nSegments']
+        if segmentIndex is None:
+            segmentIndex = self.scope.settings['segmentIndex']
         _ratio_mode = ratio_mode_index[settings['reduction_mode']]
-        self._bufferMax = [(ctypes.c_int16 * maxSamples)() for i in range(self.scope.trigger.settings['nSegments'])]
-        self._bufferMin = [(ctypes.c_int16 * maxSamples)() for i in range(self.scope.trigger.settings['nSegments'])] # used for downsampling which isn't in the scope of this example
-        for _bufferMax,_bufferMin,i in zip(self._bufferMax,self._bufferMin,range(self.scope.trigger.settings['nSegments'])):
-            # Set data buffer location for data collection from channel
-            # handle = chandle
-            #source = ps.PS5000A_CHANNEL["PS5000A_CHANNEL_A"]
-            # pointer to buffer max = ctypes.byref(bufferMax)
-            # pointer to buffer min = ctypes.byref(bufferMin)
-            # buffer length = maxSamples
-            # segment index = 0
-            # ratio mode = PS5000A_RATIO_MODE_NONE = 0
-            self.status["setDataBuffers"] = ps.ps5000aSetDataBuffers(self.chandle, self._source, 
-                                                                     ctypes.byref(_bufferMax), ctypes.byref(_bufferMin), 
-                                                                     maxSamples, settings['segmentIndex']+i, _ratio_mode)
-            assert_pico_ok(self.status["setDataBuffers"])
+        # Create buffers ready for assigning pointers for data collection
+        if self._bufferMax is None or self._bufferMax.shape!=(nSegments,maxSamples):
+            self._bufferMax = np.zeros((nSegments,maxSamples),dtype=np.int16)
+            self._bufferMin = np.zeros((nSegments,maxSamples),dtype=np.int16) # used for downsampling
+            self._registered = None
+        registration = (nSegments,maxSamples,segmentIndex,_ratio_mode)
+        if registration!=self._registered:
+            for i in range(nSegments):
+                # Set data buffer location for data collection from channel
+                # handle = chandle
+                # pointer to buffer max = row i of the pool
+                # pointer to buffer min = row i of the pool
+                # buffer length = maxSamples
+                # segment index = segmentIndex+i
+                # ratio mode = PS5000A_RATIO_MODE_NONE = 0
+                self.status["setDataBuffers"] = ps.ps5000aSetDataBuffers(self.chandle, self._source, 
+                                                                         self._bufferMax[i].ctypes.data_as(ctypes.POINTER(ctypes.c_int16)), 
+                                                                         self._bufferMin[i].ctypes.data_as(ctypes.POINTER(ctypes.c_int16)), 
+                                                                         maxSamples, segmentIndex+i, _ratio_mode)
+                assert_pico_ok(self.status["setDataBuffers"])
+            self._registered = registration
         self.settings = settings
     
-
+    @property
+    def counts_max(self):
+        '''
+        raw ADC counts, noSamples*nSegments view into the buffer pool (overwritten by the next read)
+        '''
+        return self._bufferMax.T
     
+    @property
+    def counts_min(self):
+        '''
+        raw ADC counts, noSamples*nSegments view into the buffer pool (overwritten by the next read)
+        '''
+        return self._bufferMin.T
+    
+    def to_volts(self,counts,dtype=np.float64,maxADC=None):
+        '''
+        converts ADC counts of this channel to volts
+        arguments:
+            counts: ADC counts (e.g. counts_max)
+        keyword arguments:
+            dtype: np.float64 (default) or np.float32, see helper_functions.adc2V
+            maxADC: the maximum ADC count (queried from the scope by default)
+        '''
+        _chRange = ps.PS5000A_RANGE[range_index[self.settings['chRange']]]
+        maxADC = self.scope._maxADC if maxADC is None else maxADC
+        return helper_functions.adc2V(counts, _chRange, maxADC, dtype=dtype)
     
     @property
     def data_max(self):
-        _chRange = ps.PS5000A_RANGE[range_index[self.settings['chRange']]]
-        out =[]
-        for _bufferMax in self._bufferMax:
-            out.append(1e-3*np.array(adc2mV(_bufferMax, _chRange, self.scope._maxADC)))
-        return np.vstack(out).T
+        return self.to_volts(self.counts_max)
     
     @property
     def data_min(self):
-        _chRange = ps.PS5000A_RANGE[range_index[self.settings['chRange']]]
-        out =[]
-        for _bufferMin in self._bufferMin:
-            out.append(1e-3*np.array(adc2mV(_bufferMin, _chRange, self.scope._maxADC)))
-        return np.vstack(out).T
+        return self.to_volts(self.counts_min)
 
 class Trigger():
     
@@ -184,15 +224,17 @@ class Trigger():
         _direction = int(direction_index[settings['direction']])
         _delay = ctypes.c_uint32(delay)
         _autoTrigger_ms = ctypes.c_int16(settings['auto_trigger_ms'])
-        time.sleep(0)
-        # direction = PS5000A_RISING = 2
-        # delay = 0 s
-        # auto Trigger = 1000 ms
-        self.status["trigger"] = ps.ps5000aSetSimpleTrigger(self.chandle, 
-                                                       _enabled,_source, 
-                                                       _threshold, _direction, 
-                                                       _delay, _autoTrigger_ms)
-        assert_pico_ok(self.status["trigger"])
+        arguments = (_enabled,_source,_threshold,_direction,delay,settings['auto_trigger_ms'])
+        if self.scope._changed('trigger',arguments):
+            # direction = PS5000A_RISING = 2
+            # delay = 0 s
+            # auto Trigger = 1000 ms
+            self.status["trigger"] = ps.ps5000aSetSimpleTrigger(self.chandle, 
+                                                           _enabled,_source, 
+                                                           _threshold, _direction, 
+                                                           _delay, _autoTrigger_ms)
+            assert_pico_ok(self.status["trigger"])
+            self.scope._applied['trigger'] = arguments
         self.settings = settings
     
     
@@ -212,24 +254,8 @@ class Trigger():
             settings[key] = kwargs[key] if key in kwargs else current_value
         check_kwargs_scope(**kwargs) 
         
-        
-        cmaxSamples = ctypes.c_int32(self.scope.settings['noSamples'])
-        self.status["MemorySegments"] = ps.ps5000aMemorySegments(self.chandle, settings['nSegments'], ctypes.byref(cmaxSamples))
-        assert_pico_ok(self.status["MemorySegments"])
-        
-        # sets number of captures
-        self.status["SetNoOfCaptures"] = ps.ps5000aSetNoOfCaptures(self.chandle, settings['nSegments'])
-        assert_pico_ok(self.status["SetNoOfCaptures"])
-         
-        _preTriggerSamples = int(self.scope.settings['noSamples']*settings['preTrigger'])
-        _postTriggerSamples = self.scope.settings['noSamples'] - _preTriggerSamples
-        _timebase = self.scope.settings['timebase']
-        _timeIndisposeMs = ctypes.c_int32()
-        _segmentIndex = settings['segmentIndex']
-        #additional callback options here, use isready instead
-        self.status["runBlock"] = ps.ps5000aRunBlock(self.chandle, _preTriggerSamples, _postTriggerSamples, 
-                                                _timebase, ctypes.byref(_timeIndisposeMs), _segmentIndex, None, None)
-        assert_pico_ok(self.status["runBlock"])
+        self._setCaptures(settings['nSegments'],settings['nSegments'])
+        self._run(settings)
         self.settings = settings
         
     def runRapidBlock(self,**kwargs):
@@ -251,33 +277,44 @@ class Trigger():
         # Handle = Chandle
         # nSegments = 10
         # nMaxSamples = ctypes.byref(cmaxSamples)
-        cmaxSamples = ctypes.c_int32(self.scope.settings['noSamples'])
-        self.status["MemorySegments"] = ps.ps5000aMemorySegments(self.chandle, settings['nSegments'], ctypes.byref(cmaxSamples))
-        assert_pico_ok(self.status["MemorySegments"])
+        self._setCaptures(settings['nSegments'],settings['nSegments'])
         
-        # sets number of captures
-        self.status["SetNoOfCaptures"] = ps.ps5000aSetNoOfCaptures(self.chandle, settings['nSegments'])
-        assert_pico_ok(self.status["SetNoOfCaptures"])
+        self._run(settings)
+        self.settings = settings
+    
+    def _setCaptures(self,nMemorySegments,nCaptures):
+        #segments the scope memory and sets the number of captures, unless they are already set
+        if self.scope._changed('MemorySegments',nMemorySegments):
+            cmaxSamples = ctypes.c_int32(self.scope.settings['noSamples'])
+            self.status["MemorySegments"] = ps.ps5000aMemorySegments(self.chandle, nMemorySegments, ctypes.byref(cmaxSamples))
+            assert_pico_ok(self.status["MemorySegments"])
+            self.scope._applied['MemorySegments'] = nMemorySegments
         
+        # sets number of captures
+        if self.scope._changed('SetNoOfCaptures',nCaptures):
+            self.status["SetNoOfCaptures"] = ps.ps5000aSetNoOfCaptures(self.chandle, nCaptures)
+            assert_pico_ok(self.status["SetNoOfCaptures"])
+            self.scope._applied['SetNoOfCaptures'] = nCaptures
+    
+    def _run(self,settings):
         # Starts the block capture
         # Handle = chandle
         # Number of prTriggerSamples
         # Number of postTriggerSamples
         # Timebase = 2 = 4ns (see Programmer's guide for more information on timebases)
         # time indisposed ms = None (This is not needed within the example)
-        # Segment index = 0
-        # LpRead = None
+        # Segment index = first segment of the capture(s)
+        # LpRead = block ready callback (None when polling)
         # pParameter = None
         _preTriggerSamples = int(self.scope.settings['noSamples']*settings['preTrigger'])
         _postTriggerSamples = self.scope.settings['noSamples'] - _preTriggerSamples
         _timebase = self.scope.settings['timebase']
         _timeIndisposeMs = ctypes.c_int32()
         _segmentIndex = settings['segmentIndex']
-        self.status["runblock"] = ps.ps5000aRunBlock(self.chandle, _preTriggerSamples, _postTriggerSamples, 
-                                                _timebase, ctypes.byref(_timeIndisposeMs), _segmentIndex, None, None)
-        assert_pico_ok(self.status["runblock"])
-        self.settings = settings
-        
+        _lpReady = self.scope._armBlockReady()
+        self.status["runBlock"] = ps.ps5000aRunBlock(self.chandle, _preTriggerSamples, _postTriggerSamples, 
+                                                _timebase, ctypes.byref(_timeIndisposeMs), _segmentIndex, _lpReady, None)
+        assert_pico_ok(self.status["runBlock"])
 
 
 class Function_generator():
@@ -350,21 +387,26 @@ class Function_generator():
         _chRange = ps.PS5000A_RANGE[range_index[5.]]
         _extInThreshold = ctypes.c_int16(int(mV2adc(int(1e3*settings['threshold']),_chRange, self.scope._maxADC)))
         
-        self.status["setSigGenBuiltInV2"] = ps.ps5000aSetSigGenBuiltInV2(self.chandle, 
-                                                                    _offsetVoltage, 
-                                                                    _pkToPk, 
-                                                                    _waveType, 
-                                                                    _freqMin, _freqMax, 
-                                                                    _increment,
-                                                                    _dwellTime, 
-                                                                    _sweepType, 
-                                                                    _operation, 
-                                                                    _shots, 
-                                                                    _sweeps,
-                                                                    _triggerType, 
-                                                                    _triggerSource, 
-                                                                    _extInThreshold)
-        assert_pico_ok(self.status["setSigGenBuiltInV2"])
+        arguments = (_offsetVoltage.value,_pkToPk.value,_waveType.value,_freqMin.value,_freqMax.value,
+                     _increment.value,_dwellTime.value,_sweepType.value,_shots.value,_sweeps.value,
+                     _triggerType.value,_triggerSource.value,_extInThreshold.value)
+        if self.scope._changed('setSigGenBuiltInV2',arguments):
+            self.status["setSigGenBuiltInV2"] = ps.ps5000aSetSigGenBuiltInV2(self.chandle, 
+                                                                        _offsetVoltage, 
+                                                                        _pkToPk, 
+                                                                        _waveType, 
+                                                                        _freqMin, _freqMax, 
+                                                                        _increment,
+                                                                        _dwellTime, 
+                                                                        _sweepType, 
+                                                                        _operation, 
+                                                                        _shots, 
+                                                                        _sweeps,
+                                                                        _triggerType, 
+                                                                        _triggerSource, 
+                                                                        _extInThreshold)
+            assert_pico_ok(self.status["setSigGenBuiltInV2"])
+            self.scope._applied['setSigGenBuiltInV2'] = arguments
         self.settings = settings
            
     def softTrig(self,state):
@@ -378,6 +420,584 @@ class Function_generator():
         self.status["softTrig"] = ps.ps5000aSigGenSoftwareControl(self.chandle,state)
         assert_pico_ok(self.status["softTrig"])    
 
+class RingBuffer():
+    '''
+    single-producer single-consumer ring buffer of int16 samples (nChannels*capacity).
+    The producer only updates self.written and the consumer only updates self.read (both are
+    total sample counts), so the driver callback never waits for the consumer.
+    When the consumer falls behind by more than capacity samples, the newest samples are dropped
+    and counted in self.dropped (one overrun per incomplete write).
+    Each drop is queued in self.gaps as (written, dropped): the samples stored from written on were
+    acquired dropped samples later than their position in the ring, read_chunk uses it to return the
+    index of each sample in the acquisition.
+    '''
+    def __init__(self,nChannels,capacity):
+        self.data = np.zeros((nChannels,capacity),dtype=np.int16)
+        self.capacity = capacity
+        self.written = 0
+        self.read = 0
+        self.dropped = 0
+        self.overruns = 0
+        self.gaps = collections.deque()
+        self._skipped = 0 #samples dropped before self.read
+        
+    @property
+    def available(self):
+        '''
+        number of samples ready to be consumed
+        '''
+        return self.written-self.read
+    
+    def write(self,block):
+        '''
+        producer side: copies a nChannels*n block
+        '''
+        n = block.shape[1]
+        free = self.capacity-(self.written-self.read)
+        if n>free:
+            self.dropped += n-free
+            self.overruns += 1
+            n = free
+        start = self.written%self.capacity
+        first = min(n,self.capacity-start)
+        self.data[:,start:start+first] = block[:,:first]
+        self.data[:,:n-first] = block[:,first:n]
+        self.written += n
+        if n<block.shape[1]:
+            self.gaps.append((self.written,self.dropped))
+    
+    def read_chunk(self,n):
+        '''
+        consumer side: returns (a copy of) the next n samples, n should not exceed self.available
+        returns:
+            counts: nChannels*n int16 array,
+            index: index of each sample in the acquisition (dropped samples included),
+            gap: True if samples were dropped just before or within the chunk
+        '''
+        start = self.read%self.capacity
+        first = min(n,self.capacity-start)
+        out = np.empty((self.data.shape[0],n),dtype=np.int16)
+        out[:,:first] = self.data[:,start:start+first]
+        out[:,first:] = self.data[:,:n-first]
+        index = np.arange(self.read,self.read+n)+self._skipped
+        gap = False
+        #the gaps before self.read+n are complete: the producer has already written beyond them
+        while self.gaps and self.gaps[0][0]<self.read+n:
+            written,dropped = self.gaps.popleft()
+            index[written-self.read:] += dropped-self._skipped
+            self._skipped = dropped
+            gap = True
+        self.read += n
+        return out,index,gap
+
+
+class Streaming():
+    '''
+    continuous acquisition (ps5000aRunStreaming), iterating over fixed-size chunks.
+    A producer thread calls ps5000aGetStreamingLatestValues, whose callback copies the new samples
+    into a RingBuffer, while the consumer iterates over the chunks:
+        with scope.streaming(chunkSize=100000,maxSamples=int(1e7)) as stream:
+            for chunk in stream:
+                ...
+        print(stream.throughput)
+    each chunk has the same structure as Pico5000.read(raw=...) (with one column per channel),
+    plus 'dropped': the total number of samples dropped so far and 'gap': True if samples were dropped
+    just before or within the chunk ('time (s)' accounts for the dropped samples)
+    '''
+    def __init__(self,scope,chunkSize=int(1e5),bufferSize=int(1e5),capacity=None,maxSamples=None,
+                 raw=False,poll_interval=1e-3):
+        self.scope = scope
+        self.chandle = scope.chandle
+        self.status = {}
+        self.settings = {'chunkSize':chunkSize,
+                         'bufferSize':bufferSize,
+                         'capacity':capacity if capacity is not None else 10*max(chunkSize,bufferSize),
+                         'maxSamples':maxSamples,
+                         'raw':raw,
+                         'poll_interval':poll_interval}
+        self.source = scope.enabledChannels
+        self._maxADC = scope._maxADC #cached by the scope: the consumer must not call the driver during the streaming
+        self.ring = RingBuffer(len(self.source),self.settings['capacity'])
+        self._driverBuffers = np.zeros((len(self.source),bufferSize),dtype=np.int16)
+        self._callback = ps.StreamingReadyType(self._on_data) #keeps a reference for the driver
+        self._callbacks = 0
+        self._autoStop = False
+        self._error = None
+        self._running = False
+        self._newData = threading.Event()
+    
+    def start(self):
+        '''
+        registers the streaming buffers, starts the acquisition and the producer thread
+        '''
+        _ratio_mode = ratio_mode_index['none']
+        for i,channel in enumerate(self.source):
+            self.status["setDataBuffer"] = ps.ps5000aSetDataBuffer(self.chandle, self.scope.channels[channel]._source, 
+                                                                   self._driverBuffers[i].ctypes.data_as(ctypes.POINTER(ctypes.c_int16)), 
+                                                                   self.settings['bufferSize'], 0, _ratio_mode)
+            assert_pico_ok(self.status["setDataBuffer"])
+            self.scope.channels[channel]._registered = None #block mode has to register its buffers again
+        _sampleInterval = ctypes.c_uint32(max(1,int(round(1e9*self.scope.settings['timeIntervalSeconds']))))
+        _units = ps.PS5000A_TIME_UNITS['PS5000A_NS']
+        _autoStop = int(self.settings['maxSamples'] is not None)
+        _maxSamples = self.settings['maxSamples'] if _autoStop else self.settings['bufferSize']
+        self.status["runStreaming"] = ps.ps5000aRunStreaming(self.chandle, ctypes.byref(_sampleInterval), _units, 
+                                                             0, _maxSamples, _autoStop, 1, _ratio_mode, 
+                                                             self.settings['bufferSize'])
+        assert_pico_ok(self.status["runStreaming"])
+        self.timeIntervalSeconds = 1e-9*_sampleInterval.value
+        self._running = True
+        self._start_time = time.perf_counter()
+        self._producer = threading.Thread(target=self._produce,daemon=True)
+        self._producer.start()
+        
+    def _on_data(self,handle,noOfSamples,startIndex,overflow,triggerAt,triggered,autoStop,param):
+        #driver callback, runs in the producer thread
+        self._callbacks += 1
+        instrumentation.record_bytes(ps,'ps5000aGetStreamingLatestValues',2*noOfSamples*len(self.source))
+        self.ring.write(self._driverBuffers[:,startIndex:startIndex+noOfSamples])
+        self._autoStop = bool(autoStop)
+        self._newData.set()
+    
+    def _produce(self):
+        try:
+            while self._running and not self._autoStop:
+                written = self.ring.written
+                status = ps.ps5000aGetStreamingLatestValues(self.chandle, self._callback, None)
+                if status!=PICO_STATUS['PICO_BUSY']: #no new data yet
+                    assert_pico_ok(status)
+                if self.ring.written==written:
+                    time.sleep(self.settings['poll_interval'])
+        except Exception as error:
+            self._error = error
+        finally:
+            self._newData.set()
+    
+    def stop(self):
+        '''
+        stops the acquisition
+        '''
+        if self._running:
+            self._running = False
+            self._producer.join()
+            self.status["stop"] = ps.ps5000aStop(self.chandle)
+            assert_pico_ok(self.status["stop"])
+    
+    @property
+    def throughput(self):
+        '''
+        returns a dictionary of streaming counters:
+            samples: samples received (per channel),
+            samples/s: average receiving rate (per channel),
+            dropped: samples dropped because the consumer was too slow,
+            overruns: number of ring buffer overruns,
+            callbacks: number of driver callbacks
+        '''
+        elapsed = time.perf_counter()-self._start_time
+        return {'samples':self.ring.written,
+                'samples/s':self.ring.written/elapsed if elapsed>0 else 0.,
+                'dropped':self.ring.dropped,
+                'overruns':self.ring.overruns,
+                'callbacks':self._callbacks}
+    
+    def _chunk(self,n):
+        counts,index,gap = self.ring.read_chunk(n)
+        results = {'time (s)':self.timeIntervalSeconds*index,
+                   'dropped':self.ring.dropped,
+                   'gap':gap}
+        maxADC = self._maxADC
+        for i,channel in enumerate(self.source):
+            if self.settings['raw']:
+                results[channel+' (counts)'] = counts[i].reshape(-1,1)
+            else:
+                results[channel+' (V)'] = self.scope.channels[channel].to_volts(counts[i].reshape(-1,1),maxADC=maxADC)
+        if self.settings['raw']:
+            results['scale'] = {channel:{'chRange':self.scope.channels[channel].settings['chRange'],
+                                         'analogueOffset':self.scope.channels[channel].settings['analogueOffset'],
+                                         'maxADC':maxADC.value} for channel in self.source}
+        return results
+    
+    def __iter__(self):
+        n = self.settings['chunkSize']
+        while True:
+            self._newData.clear()
+            if self.ring.available>=n:
+                yield self._chunk(n)
+                continue
+            if self._error is not None:
+                raise self._error
+            if not self._producer.is_alive():
+                if self.ring.available>0: #last (incomplete) chunk
+                    yield self._chunk(self.ring.available)
+                return
+            self._newData.wait(0.1)
+    
+    def __enter__(self):
+        self.start()
+        return self
+    
+    def __exit__(self,type,value,traceback):
+        self.stop()
+
+
+class TimeAxis():
+    '''
+    sampling times t0 + k*dt, k=0..n-1 (the step used by align_segments and Accumulator),
+    described by (t0, dt, n). The times are computed once, on first access, as a read-only array:
+    use time_axis to share a single instance between the captures with identical timebase
+    '''
+    __slots__ = ('t0','dt','n','_time')
+    
+    def __init__(self,t0,dt,n):
+        self.t0 = t0
+        self.dt = dt
+        self.n = n
+        self._time = None
+    
+    @property
+    def time(self):
+        if self._time is None:
+            time = self.t0 + self.dt*np.arange(self.n)
+            time.setflags(write=False)
+            self._time = time
+        return self._time
+    
+    def __len__(self):
+        return self.n
+    
+    def __repr__(self):
+        return 'TimeAxis(t0={0}, dt={1}, n={2})'.format(self.t0,self.dt,self.n)
+
+
+_time_axes = {}
+
+def time_axis(t0,dt,n):
+    '''
+    returns the TimeAxis (t0, dt, n), shared by all the callers asking for the same axis
+    '''
+    key = (t0,dt,n)
+    if not key in _time_axes:
+        _time_axes[key] = TimeAxis(t0,dt,n)
+    return _time_axes[key]
+
+
+class Capture():
+    '''
+    results of a read, compact: the ADC counts of the channels (int16, copied out of the buffer pools),
+    their scale and a shared TimeAxis. The voltages are converted on access (not stored, keep the
+    returned array when it is used several times).
+    The capture is accessed as the former results dictionary:
+        capture['time (s)'], capture['A (V)'], capture['A (counts)'], capture['scale'],
+        'A (V)' in capture, capture.keys(), capture.items(), capture.update({'x':x,'y':y})...
+    keys() lists the voltages, or the counts and the scale for a raw read (the stored content),
+    the keys set by the caller (e.g. a processed 'B (V)') are kept as given and override the channels.
+    When the trigger time offsets of the segments are given (read with align=True), the voltages are
+    aligned on the nominal sampling times (see helper_functions.align_segments).
+    capture['overflow'] holds the driver overflow flags: {channel: one flag per segment, True when over range}
+    '''
+    __slots__ = ('axis','counts','scale','raw','dtype','offsets','overflow','extra')
+    
+    def __init__(self,axis,counts,scale,raw=False,dtype=np.float64,offsets=None,overflow=None):
+        '''
+        arguments:
+            axis: the TimeAxis of the samples
+            counts: {name: ADC counts, noSamples*nSegments int16}, name e.g. 'A' or 'A_{max}'
+            scale: {channel: {'chRange','analogueOffset','maxADC'}}
+        keyword arguments:
+            raw: whether keys() lists the counts (raw read) or the voltages
+            dtype: the voltage data type (np.float64 or np.float32)
+            offsets: the trigger time offset of each segment (in s), to align the voltages
+            overflow: {channel: overflow flag of each segment}
+        '''
+        self.axis = axis
+        self.counts = counts
+        self.scale = scale
+        self.raw = raw
+        self.dtype = dtype
+        self.offsets = offsets
+        self.overflow = overflow
+        self.extra = {}
+    
+    def volts(self,key,dtype=None):
+        '''
+        converts the counts of key (e.g. 'A (V)' or 'A_{max} (V)') to volts, aligned when the offsets are known
+        '''
+        dtype = self.dtype if dtype is None else dtype
+        scale = self.scale[key[0]]
+        _chRange = ps.PS5000A_RANGE[range_index[scale['chRange']]]
+        voltages = helper_functions.adc2V(self.counts[key[:-len(' (V)')]], _chRange, ctypes.c_int16(scale['maxADC']), dtype=dtype)
+        if self.offsets is None:
+            return voltages
+        return helper_functions.align_segments(voltages,self.offsets,self.axis.dt).astype(dtype,copy=False)
+    
+    def keys(self):
+        keys = ['time (s)']
+        if self.raw:
+            keys += ['scale'] + [name+' (counts)' for name in self.counts]
+        else:
+            keys += [name+' (V)' for name in self.counts]
+        if self.offsets is not None:
+            keys.append('trigger offsets (s)')
+        if self.overflow is not None:
+            keys.append('overflow')
+        return [key for key in keys if not key in self.extra] + list(self.extra)
+    
+    def __getitem__(self,key):
+        if key in self.extra:
+            return self.extra[key]
+        if key=='time (s)':
+            return self.axis.time
+        if key=='scale':
+            return self.scale
+        if key=='trigger offsets (s)' and self.offsets is not None:
+            return self.offsets
+        if key=='overflow' and self.overflow is not None:
+            return self.overflow
+        if key.endswith(' (counts)') and key[:-len(' (counts)')] in self.counts:
+            return self.counts[key[:-len(' (counts)')]]
+        if key.endswith(' (V)') and key[:-len(' (V)')] in self.counts:
+            return self.volts(key)
+        raise KeyError(key)
+    
+    def __setitem__(self,key,value):
+        self.extra[key] = value
+    
+    def __contains__(self,key):
+        if key in self.extra or key in ['time (s)','scale']:
+            return True
+        if key=='trigger offsets (s)':
+            return self.offsets is not None
+        if key=='overflow':
+            return self.overflow is not None
+        for unit in [' (counts)',' (V)']:
+            if key.endswith(unit) and key[:-len(unit)] in self.counts:
+                return True
+        return False
+    
+    def __iter__(self):
+        return iter(self.keys())
+    
+    def __len__(self):
+        return len(self.keys())
+    
+    def get(self,key,default=None):
+        return self[key] if key in self else default
+    
+    def update(self,other=(),**kwargs):
+        self.extra.update(other,**kwargs)
+    
+    def items(self):
+        for key in self.keys():
+            yield key,self[key]
+    
+    def values(self):
+        for key in self.keys():
+            yield self[key]
+    
+    @property
+    def clipped(self):
+        '''
+        the channels that went over range in at least one segment
+        '''
+        if self.overflow is None:
+            return []
+        return [channel for channel,flags in self.overflow.items() if np.any(flags)]
+    
+    @property
+    def nbytes(self):
+        '''
+        host memory held by the capture (counts and the caller arrays, the shared time axis excluded)
+        '''
+        return sum(counts.nbytes for counts in self.counts.values())+sum(getattr(value,'nbytes',0) for value in self.extra.values())
+
+
+class Accumulator():
+    '''
+    running sums of the segments read by Pico5000.read, kept in ADC counts (integers):
+    the mean (and variance) over any number of segments and captures is obtained without
+    storing the segments nor converting them to volts
+        accumulator = pico5000.Accumulator(variance=True)
+        for k in range(n_captures):
+            scope.runBlock()
+            ...
+            scope.waitUntilReady()
+            scope.read(accumulator=accumulator)
+        results = accumulator.results()
+    the channel ranges and noSamples should not change between two reads
+    '''
+    def __init__(self,variance=False):
+        self.variance = variance
+        self.reset()
+        
+    def reset(self):
+        self.count = 0 #number of accumulated segments
+        self.sums = {}
+        self.squares = {}
+        self.scale = {} #V per ADC count
+        self.overflows = {} #number of segments over range
+        self.axis = None
+    
+    def add(self,scope,source,noSamples,segments=slice(None),maxADC=None,offsets=None,overflow=None):
+        '''
+        adds the segments of the channel buffer pools to the sums
+        arguments:
+            scope: the Pico5000 the segments were read with
+            source: the channels to accumulate
+            noSamples: number of samples per segment
+        keyword arguments:
+            segments: the rows of the buffer pools to accumulate
+            maxADC: the maximum ADC count (queried from the scope by default)
+            offsets: the trigger time offsets of the segments (in s), to align them before summing
+                     (see helper_functions.align_segments, the sums are then kept in floating point)
+            overflow: {channel: overflow flag of each segment}, counted in the results
+        '''
+        maxADC = scope._maxADC if maxADC is None else maxADC
+        if self.axis is None:
+            self.axis = time_axis(0.,scope.settings['timeIntervalSeconds'],noSamples)
+        assert len(self.axis)==noSamples, 'noSamples changed during the accumulation'
+        nSegments = 0
+        for channel in source:
+            counts = scope.channels[channel]._bufferMax[segments,:noSamples] #nSegments*noSamples int16
+            _chRange = ps.PS5000A_RANGE[range_index[scope.channels[channel].settings['chRange']]]
+            scale = 1e-3*helper_functions.channelInputRanges[_chRange]/maxADC.value
+            if not channel in self.sums:
+                self.sums[channel] = np.zeros(noSamples,dtype=np.int64)
+                self.squares[channel] = np.zeros(noSamples,dtype=np.int64)
+                self.scale[channel] = scale
+                self.overflows[channel] = 0
+            if overflow is not None:
+                self.overflows[channel] += int(np.count_nonzero(overflow[channel]))
+            assert self.scale[channel]==scale, 'the range of channel {0} changed during the accumulation'.format(channel)
+            if offsets is not None:
+                aligned = helper_functions.align_segments(counts,offsets,scope.settings['timeIntervalSeconds'],axis=1)
+                self.sums[channel] = self.sums[channel]+np.sum(aligned,axis=0)
+                if self.variance:
+                    self.squares[channel] = self.squares[channel]+np.einsum('ij,ij->j',aligned,aligned)
+            else:
+                #int32 sums of up to 2**16 segments cannot overflow, int64 beyond
+                _dtype = np.int32 if counts.shape[0]<=2**16 else np.int64
+                self.sums[channel] += np.sum(counts,axis=0,dtype=_dtype)
+                if self.variance:
+                    self.squares[channel] += np.einsum('ij,ij->j',counts,counts,dtype=np.int64)
+            nSegments = counts.shape[0]
+        self.count += nSegments
+    
+    def results(self):
+        '''
+        returns a results structure similar to Pico5000.read, with noSamples*1 voltages:
+            time:                       the time (in s)
+            channel+' (V)':             mean channel voltage over the accumulated segments (in V)
+            channel+'_{var} (V^2)':     voltage variance over the accumulated segments (in V^2, with variance=True)
+            'averages':                 the number of accumulated segments
+            'overflow':                 {channel: number of accumulated segments that went over range}
+        '''
+        assert self.count>0, 'nothing was accumulated'
+        results = {'time (s)':self.axis.time,
+                   'averages':self.count,
+                   'overflow':dict(self.overflows)}
+        for channel,sums in self.sums.items():
+            mean = sums/self.count
+            results[channel+' (V)'] = (self.scale[channel]*mean)[:,np.newaxis]
+            if self.variance:
+                variance = np.maximum(self.squares[channel]/self.count-mean**2,0.)
+                results[channel+'_{var} (V^2)'] = (self.scale[channel]**2*variance)[:,np.newaxis]
+        return results
+
+
+class RapidBlockPipeline():
+    '''
+    pipelined rapid block acquisition: the next capture is armed as soon as the previous one has been
+    transferred (the driver cannot read the device memory during a capture), and the previous capture
+    is converted (and processed by the caller) while it runs.
+        for k,results in enumerate(scope.pipeline(n_captures,fire=fire,prepare=prepare)):
+            ...
+    prepare(k) (e.g. moving the galvo mirrors) and fire() (e.g. the soft triggers) run in a worker
+    thread for the capture k, while the main thread converts and yields the results of capture k-1.
+    The scope should not be used by the caller during the iteration.
+    '''
+    def __init__(self,scope,n_captures,fire=None,prepare=None,nSegments=None,raw=False,dtype=np.float64,timeout=1.):
+        self.scope = scope
+        self.chandle = scope.chandle
+        self.status = {}
+        self.n_captures = n_captures
+        self.fire = fire
+        self.prepare = prepare
+        self.nSegments = scope.trigger.settings['nSegments'] if nSegments is None else nSegments
+        self.raw = raw
+        self.dtype = dtype
+        self.timeout = timeout
+        self.timings = {'points':0,'elapsed':0.}
+        
+    def _setup(self):
+        # captures of nSegments segments, transferred before the next capture is armed
+        cmaxSamples = ctypes.c_int32()
+        self.status["MemorySegments"] = ps.ps5000aMemorySegments(self.chandle, self.nSegments, ctypes.byref(cmaxSamples))
+        assert_pico_ok(self.status["MemorySegments"])
+        assert self.scope.settings['noSamples']<=cmaxSamples.value, 'noSamples exceeds the segment memory ({0})'.format(cmaxSamples.value)
+        self.status["SetNoOfCaptures"] = ps.ps5000aSetNoOfCaptures(self.chandle, self.nSegments)
+        assert_pico_ok(self.status["SetNoOfCaptures"])
+        self.scope._applied['MemorySegments'] = self.nSegments
+        self.scope._applied['SetNoOfCaptures'] = self.nSegments
+        self.source = self.scope.enabledChannels
+        for channel in self.source: #one pool of nSegments rows, registered once
+            self.scope.channels[channel]._setDataBuffers(nSegments=self.nSegments,segmentIndex=0,reduction_mode='none')
+        self._maxADC = self.scope._maxADC
+        self._overflow = (ctypes.c_int16*self.nSegments)()
+        
+    def _arm(self):
+        settings = dict(self.scope.trigger.settings)
+        settings['segmentIndex'] = 0
+        self.scope.trigger._run(settings)
+    
+    def _trigger(self,k):
+        try:
+            if self.prepare is not None:
+                self.prepare(k)
+            if self.fire is not None:
+                self.fire()
+        except Exception as error: #re-raised in the main thread
+            self._error = error
+    
+    def _transfer(self):
+        self.scope.waitUntilReady(timeout=self.timeout)
+        cmaxSamples = ctypes.c_int32(self.scope.settings['noSamples'])
+        self.status["getValuesBulk"] = ps.ps5000aGetValuesBulk(self.chandle, ctypes.byref(cmaxSamples), 
+                                                               0,self.nSegments-1,
+                                                               0, ratio_mode_index['none'],
+                                                               ctypes.byref(self._overflow))
+        assert_pico_ok(self.status["getValuesBulk"])
+        self.scope._transferred('ps5000aGetValuesBulk',cmaxSamples.value,self.nSegments,self.source)
+        return cmaxSamples.value
+        
+    def __iter__(self):
+        self._setup()
+        self._error = None
+        start_time = time.perf_counter()
+        self._arm()
+        self._trigger(0)
+        for k in range(self.n_captures):
+            if self._error is not None:
+                raise self._error
+            noSamples = self._transfer()
+            worker = None
+            if k+1<self.n_captures:
+                self._arm()
+                worker = threading.Thread(target=self._trigger,args=(k+1,))
+                worker.start()
+            try:
+                yield self.scope._results(self.source,noSamples,dtype=self.dtype,
+                                          raw=self.raw,maxADC=self._maxADC,overflow=self._overflow)
+            finally:
+                if worker is not None:
+                    worker.join()
+            self.timings['points'] = k+1
+            self.timings['elapsed'] = time.perf_counter()-start_time
+    
+    @property
+    def pointsPerSecond(self):
+        return self.timings['points']/self.timings['elapsed'] if self.timings['elapsed']>0 else 0.
+
+
 class Pico5000():
     microvolts = 1e6
     def __init__(self,resolution_bits=8):
@@ -393,8 +1013,25 @@ class Pico5000():
                          'down_sample_blocksize':0,
                          'reduction_mode':'none',
                          'nSegments':1}
+        # block capture completion: the driver callback sets blockReady,
+        # polling (with an interval adapted to the capture duration) is the fallback
+        self.use_callback = True
+        self.blockReady = threading.Event()
+        self._blockStatus = None
+        self._callbackArmed = False
+        self._blockReadyCallback = ps.BlockReadyType(self._on_block_ready) #keeps a reference for the driver
+        self.polling = {'fraction':0.1, #of the expected capture duration
+                        'min_interval':50e-6, #s
+                        'max_interval':10e-3} #s
+        # last arguments applied to each setting driver call, see _changed
+        self._applied = {}
+        self.calls = {'issued':0,'skipped':0}
+        # channel ranges found by autoRange, per scan region
+        self.ranges = {}
         # Open 5000 series PicoScope
         self.__open__()
+        #the maximum ADC count only depends on the resolution, it is queried again by the resolution setter
+        self._maxADC = self._query_maxADC()
         #for some reason the channels are on at startup
         self.add_channel(source='A',enabled=True)
         self.add_channel(source='B',enabled=False)
@@ -458,8 +1095,7 @@ class Pico5000():
         self.channels[source]=Channel(self,source=source,**kwargs)
         
     
-    @property
-    def _maxADC(self):
+    def _query_maxADC(self):
         # find maximum ADC count value
         # handle = chandle
         # pointer to value = ctypes.byref(maxADC)
@@ -495,22 +1131,9 @@ class Pico5000():
         status = ps.ps5000aSetDeviceResolution(self.chandle,res)
         assert_pico_ok(status)
         self.settings['resolution'] = value
-    
-    @property
-    def _minTimeBase(self):
-        #find fastest available timebase
-        enabled_channels = len(self.enabledChannels)
-        #don't forget to disable the channels to reach max resolution
-        if self.resolution=='8BIT':
-            return 0 if enabled_channels<=1 else 1
-        if self.resolution=='12BIT':
-            return 1 if enabled_channels<=1 else 2
-        if self.resolution=='14BIT':
-            return 3
-        if self.resolution=='15BIT':
-            return 3 if enabled_channels<=2 else 4
-        if self.resolution=='16BIT':
-            return 4 if enabled_channels<=1 else 5
+        self._maxADC = self._query_maxADC()
+        #the device may reset its channels and memory when the resolution changes
+        self._applied = {}
     
     def set_timeBase(self,**kwargs):
         '''
@@ -539,27 +1162,35 @@ class Pico5000():
         #overwrites the timebase with either timeIntervalNanoseconds or sampleRate
         #if these two parameters are provided, the conflict is raised
         assert not ('sampleRate' in kwargs and 'timeIntervalSeconds' in kwargs)
+        resolution = self.resolution
+        enabled_channels = len(self.enabledChannels)
         if 'sampleRate' in kwargs:
-            value = kwargs['sampleRate']
-            settings['timebase'] = helper_functions.dichotomic_search(sample_rate[self.resolution],self._minTimeBase,2**32-1,f0=value,tol=1,growing=False)
+            settings['timebase'] = find_timebase(resolution,enabled_channels,sampleRate=kwargs['sampleRate'])
         if 'timeIntervalSeconds' in kwargs:
-            value = kwargs['timeIntervalSeconds']
-            settings['timebase'] = helper_functions.dichotomic_search(lambda x: 1./sample_rate[self.resolution](x),self._minTimeBase,2**32-1,f0=value,tol=1,growing=True)
+            settings['timebase'] = find_timebase(resolution,enabled_channels,timeIntervalSeconds=kwargs['timeIntervalSeconds'])
 
         assert type(settings['timebase']) is int, 'timeBase must be an int, use sampleRate or timeIntervalSeconds for convenient setting'
-        assert settings['timebase'] >= self._minTimeBase and settings['timebase']<2**32
+        assert settings['timebase'] >= min_timebase(resolution,enabled_channels) and settings['timebase']<2**32
         _timebase = settings['timebase']
         _noSamples = int(settings['noSamples'])
-        _timeIntervalNanoseconds = ctypes.c_float()
-        _maxSamples = ctypes.c_int32()
-        _segmentIndex = ctypes.c_uint32(settings['segmentIndex'])
-        self.status["getTimebase2"] = ps.ps5000aGetTimebase2(self.chandle, 
-                                                        _timebase, _noSamples, 
-                                                        ctypes.byref(_timeIntervalNanoseconds), 
-                                                        ctypes.byref(_maxSamples), _segmentIndex)
-        assert_pico_ok(self.status["getTimebase2"])
-        settings['timeIntervalSeconds'] = 1e-9*_timeIntervalNanoseconds.value
-        settings['maxSamples'] = _maxSamples.value
+        #the time interval and maxSamples of the last query are kept when nothing they depend on changed
+        arguments = (resolution,tuple(self.enabledChannels),_timebase,_noSamples,settings['segmentIndex'],
+                     self._applied.get('MemorySegments'))
+        if self._changed('getTimebase2',arguments):
+            _timeIntervalNanoseconds = ctypes.c_float()
+            _maxSamples = ctypes.c_int32()
+            _segmentIndex = ctypes.c_uint32(settings['segmentIndex'])
+            self.status["getTimebase2"] = ps.ps5000aGetTimebase2(self.chandle, 
+                                                            _timebase, _noSamples, 
+                                                            ctypes.byref(_timeIntervalNanoseconds), 
+                                                            ctypes.byref(_maxSamples), _segmentIndex)
+            assert_pico_ok(self.status["getTimebase2"])
+            settings['timeIntervalSeconds'] = 1e-9*_timeIntervalNanoseconds.value
+            settings['maxSamples'] = _maxSamples.value
+            self._applied['getTimebase2'] = arguments
+        else:
+            settings['timeIntervalSeconds'] = self.settings['timeIntervalSeconds']
+            settings['maxSamples'] = self.settings['maxSamples']
         self.settings = settings
     
     def set_trigger(self,**kwargs):
@@ -599,8 +1230,130 @@ class Pico5000():
             self.trigger.runRapidBlock(**kwargs)
         self.trigger.settings = settings
         
+    def pipeline(self,n_captures,**kwargs):
+        '''
+        pipelined rapid block acquisition of n_captures captures (see RapidBlockPipeline)
+        arguments:
+            n_captures: number of captures
+        keyword arguments:
+            fire: function triggering a capture (e.g. soft triggers), called once per capture
+            prepare: function called with the capture index before fire (e.g. moving to the next point)
+            nSegments: segments per capture (defaults to self.trigger.settings['nSegments'])
+            raw, dtype: see read
+            timeout: maximum capture duration (in s)
+        returns an iterable over the results of the captures (structured as the read results)
+        '''
+        return RapidBlockPipeline(self,n_captures,**kwargs)
+    
+    def average(self,n_captures,fire=None,variance=False,**kwargs):
+        '''
+        averages n_captures captures of nSegments segments (n_captures*nSegments averages per sample,
+        beyond what the device memory holds in a single read), see Accumulator
+        arguments:
+            n_captures: number of captures
+        keyword arguments:
+            fire: function triggering a capture (e.g. soft triggers), called once per capture
+            variance: if True, also returns the variance over the segments
+            other keyword arguments are passed to read_chunks (e.g. budget, align)
+        returns the accumulated results (see read with accumulate=True)
+        the segments are read in chunks (see read_chunks), so that nSegments is only limited by the device memory
+        '''
+        accumulator = Accumulator(variance=variance)
+        for k in range(n_captures):
+            self.runBlock()
+            if fire is not None:
+                fire()
+            self.waitUntilReady()
+            for chunk in self.read_chunks(accumulator=accumulator,**kwargs):
+                pass
+        return accumulator.results()
+    
+    def autoRange(self,source=None,fire=None,headroom=0.8,preSamples=100,region=None,timeout=1.):
+        '''
+        sets the smallest channel ranges holding the signal, from a short pre-capture: a single segment,
+        transferred as preSamples max/min pairs (aggregate reduction). The range of a channel is set so that
+        its peak (signal and analogue offset) stays below headroom*range; a clipped channel is moved up one
+        range and the pre-capture repeated (the ranges that clipped are not tried again).
+        The trigger threshold is set in ADC counts of the range of its source: the trigger is set again (same
+        threshold in V) when the range of its source changes. The reduction mode of the channels is kept
+        arguments: none
+        keyword arguments:
+            source: the channels to range, defaults to the enabled channels
+            fire: function triggering the pre-capture (e.g. soft trigger)
+            headroom: fraction of the range the peak can reach
+            preSamples: number of max/min pairs transferred per channel
+            region: key of the scan region (any hashable), the ranges found are stored in self.ranges[region]
+                    and set without pre-capture the next time (del self.ranges[region] to range it again)
+            timeout: maximum pre-capture duration (in s)
+        returns:
+            {channel: chRange}
+        '''
+        source = self.enabledChannels if source is None else source
+        if region is not None and region in self.ranges:
+            for channel,chRange in self.ranges[region].items():
+                self.channels[channel].set_channel(chRange=chRange)
+            self.trigger.set_trigger() #skipped when the range of the trigger source is unchanged
+            return dict(self.ranges[region])
+        ranges = sorted(chRange for chRange in range_index if chRange<=max_range)
+        lowest = {channel:0 for channel in source} #index of the smallest range not known to clip
+        lsb = 2**(16-int(self.settings['resolution'][:-3])) #ADC counts per resolution step
+        scopeSettings = dict(self.settings)
+        triggerSettings = dict(self.trigger.settings)
+        reduction_modes = {channel:self.channels[channel].settings['reduction_mode'] for channel in source}
+        blocksize = max(1,self.settings['noSamples']//preSamples)
+        try:
+            for attempt in range(2*len(ranges)):
+                self.runBlock(nSegments=1)
+                if fire is not None:
+                    fire()
+                self.waitUntilReady(timeout=timeout)
+                capture = self.read(raw=True,source=source,reduction_mode='aggregate',down_sample_blocksize=blocksize)
+                changed = False
+                for channel in source:
+                    settings = self.channels[channel].settings
+                    current = min(int(np.searchsorted(ranges,settings['chRange'])),len(ranges)-1)
+                    maxADC = capture['scale'][channel]['maxADC']
+                    peak = max(np.max(np.abs(capture[channel+'_{max} (counts)'])),np.max(np.abs(capture[channel+'_{min} (counts)'])))
+                    if capture['overflow'][channel][0] or peak>=maxADC: #clipped, the peak is unknown
+                        lowest[channel] = min(current+1,len(ranges)-1)
+                        target = lowest[channel]
+                    else: #upper bound of the peak (in V), one resolution step included
+                        peak = (peak+lsb)/maxADC*ranges[current]
+                        target = max(lowest[channel],int(np.searchsorted(ranges,peak/headroom)))
+                    for candidate in range(min(target,len(ranges)-1),len(ranges)):
+                        try: #the analogue offset may not be admissible on the smaller ranges
+                            self.channels[channel].set_channel(chRange=ranges[candidate],analogueOffset=settings['analogueOffset'])
+                            break
+                        except AssertionError:
+                            lowest[channel] = candidate+1
+                    changed = changed or candidate!=current
+                self.trigger.set_trigger() #threshold in ADC counts of the new range of the trigger source
+                if not changed:
+                    break
+        finally:
+            self.settings = scopeSettings
+            self.trigger.settings = triggerSettings
+            for channel,reduction_mode in reduction_modes.items(): #the buffers are registered again by the next read
+                self.channels[channel].settings['reduction_mode'] = reduction_mode
+        found = {channel:self.channels[channel].settings['chRange'] for channel in source}
+        if region is not None:
+            self.ranges[region] = found
+        return found
+    
     def streaming(self,**kwargs):
-        raise NotImplementedError
+        '''
+        prepares a continuous acquisition of the enabled channels at the current sample rate
+        arguments: none
+        keyword arguments:
+            chunkSize: number of samples per chunk returned by the iteration
+            bufferSize: size of the driver buffers (samples per channel)
+            capacity: size of the ring buffer (samples per channel), defaults to 10*max(chunkSize,bufferSize)
+            maxSamples: number of samples after which the acquisition stops (None: until stop())
+            raw: if True, the chunks contain ADC counts (see read)
+            poll_interval: delay between two driver polls when no data is available (in s)
+        returns a Streaming object, to use as a context manager (see Streaming)
+        '''
+        return Streaming(self,**kwargs)
      
     @property
     def isBusy(self):
@@ -612,15 +1365,43 @@ class Pico5000():
         self.status["isReady"] = ps.ps5000aIsReady(self.chandle, ctypes.byref(ready))
         return ready.value==check.value
     
+    def _armBlockReady(self):
+        #prepares the block ready notification before running a block
+        #returns the driver callback, or None when polling
+        self.blockReady.clear()
+        self._blockStatus = None
+        self._callbackArmed = self.use_callback
+        return self._blockReadyCallback if self.use_callback else None
     
+    def _on_block_ready(self,handle,status,param):
+        #driver callback (driver thread)
+        self._blockStatus = status
+        self.blockReady.set()
+    
+    @property
+    def _expectedDuration(self):
+        #expected duration of the block capture (in s)
+        return self.settings['noSamples']*self.settings['timeIntervalSeconds']*self.trigger.settings['nSegments']
+    
+    @property
+    def _pollInterval(self):
+        interval = self.polling['fraction']*self._expectedDuration
+        return min(max(interval,self.polling['min_interval']),self.polling['max_interval'])
     
     def waitUntilReady(self,timeout=1.):
         '''
-        waits until the scope is ready
+        waits until the scope is ready:
+        if the block was armed with the driver callback (use_callback=True), waits for the blockReady event,
+        otherwise polls isBusy with an interval adapted to the expected capture duration (see self.polling)
         '''
+        if self._callbackArmed:
+            if not self.blockReady.wait(timeout): raise TimeoutError('The scope did not respond')
+            assert_pico_ok(self._blockStatus)
+            return
+        interval = self._pollInterval
         start_time = time.time()
         while self.isBusy:
-            time.sleep(0.01)
+            time.sleep(interval)
             if time.time()-start_time>timeout: raise TimeoutError('The scope did not respond')
     
     @property
@@ -634,30 +1415,47 @@ class Pico5000():
                 out.append(channel.source)
         return out
     
-    def read(self,**kwargs):
+    def read(self,dtype=np.float64,raw=False,accumulate=False,variance=False,accumulator=None,align=False,**kwargs):
         '''
         reads the scope results:
         arguments: none
         keyword arguments (defaults in scope.settings):
+            dtype: the voltage data type (np.float64 or np.float32),
+            raw: if True, returns the ADC counts instead of the voltages (see below),
+            accumulate: if True, returns the mean over the segments instead of the segments (see below),
+            variance: with accumulate, also returns the variance over the segments,
+            accumulator: an Accumulator the segments are added to (implies accumulate), to average over several reads,
+            align: if True, the segments are aligned on their trigger time offsets (sub-sample jitter correction,
+                   see trigger_offsets and helper_functions.align_segments), the offsets are returned in 'trigger offsets (s)',
             source: the channel(s) to read. If no channels are given, all the channels are read,
             startIndex: the sample to start reading,
             down_sample_blocksize: the number of samples to group for the data reduction (see Channel()._setDataBuffers),
             reduction_mode: the reduction_mode for the data reduction (see Channel()._setDataBuffers),
         the results (in V) are stored in scope.channels['channe_name'].data_max and scope.channels['channe_name'].data_min
-        a results structure is returned:
+        a results structure is returned (a Capture: the ADC counts, the voltages are converted on access
+        and the time axis is shared between the reads with identical timebase):
             time:                   the time (in s)
             channel+' (V)':          channel voltage (in V)
         ***in reduction_mode == aggregate, two keys are returned instead:***
             channel+'_{max} (V)':   channel max voltage (in V)
             channel+'_{min} (V)':   channel min voltage (in V)
         channel voltage (including max/min) are returned as noSamples*nSegments arrays 
+            'overflow':             {channel: one flag per segment, True when the channel went over range}
+        ***with raw == True, the ADC counts are returned instead of the voltages:***
+            channel+' (counts)':    channel ADC counts (int16, same layout as the voltages)
+            'scale':                {channel:{'chRange','analogueOffset','maxADC'}} to convert the counts,
+                                    voltages can then be obtained when needed with pico5000.volts(results,channel+' (V)')
+        ***with accumulate == True, the segments are summed in ADC counts, see Accumulator.results:***
+            channel+' (V)':          mean channel voltage (in V, noSamples*1)
+            channel+'_{var} (V^2)':  voltage variance (in V^2, noSamples*1, with variance=True)
+            'averages':             the number of averaged segments
+            'overflow':             {channel: number of averaged segments that went over range}
         '''
         #handles default values
         settings = {}
         for key,current_value in self.settings.items():
             settings[key] = kwargs[key] if key in kwargs else current_value
-        if not 'source' in kwargs:
-            settings['source'] = self.enabledChannels
+        settings['source'] = kwargs['source'] if 'source' in kwargs else self.enabledChannels
         for channel in settings['source']:
             self.channels[channel]._setDataBuffers(reduction_mode = settings['reduction_mode'])
         check_kwargs_scope(**kwargs)  
@@ -678,6 +1476,7 @@ class Pico5000():
             self.status["getValues"] = ps.ps5000aGetValues(self.chandle, settings['startIndex'], ctypes.byref(cmaxSamples), 
                                                            settings['down_sample_blocksize'], _ratio_mode, _segmentIndex, ctypes.byref(overflow))
             assert_pico_ok(self.status["getValues"])
+            self._transferred('ps5000aGetValues',cmaxSamples.value,1,settings['source'],settings['reduction_mode'])
         else:
             _fromSegmentIndex = self.trigger.settings['segmentIndex']
             _toSegmentIndex = _fromSegmentIndex+self.trigger.settings['nSegments']-1
@@ -686,20 +1485,140 @@ class Pico5000():
                                                            settings['down_sample_blocksize'], _ratio_mode,
                                                            ctypes.byref(overflow))
             assert_pico_ok(self.status["getValuesBulk"])
+            self._transferred('ps5000aGetValuesBulk',cmaxSamples.value,self.trigger.settings['nSegments'],
+                              settings['source'],settings['reduction_mode'])
         self.settings = settings
-        
-        # Create time data
-        time = np.linspace(0, (cmaxSamples.value) * self.settings['timeIntervalSeconds'], cmaxSamples.value)
-
-        results = {'time (s)':time}
-        # convert ADC counts data to mV
-        for channel in settings['source']:
+        offsets = None
+        if align:
+            assert settings['reduction_mode']!='aggregate', 'the aggregate reduction mode cannot be aligned'
+            if self.trigger.settings['nSegments']==1:
+                offsets = self.trigger_offsets(_segmentIndex.value,_segmentIndex.value)
+            else:
+                offsets = self.trigger_offsets(_fromSegmentIndex,_toSegmentIndex)
+        if accumulate or accumulator is not None:
+            assert not raw, 'raw and accumulate are exclusive'
+            assert settings['reduction_mode']!='aggregate', 'the aggregate reduction mode cannot be accumulated'
+            if accumulator is None:
+                accumulator = Accumulator(variance=variance)
+            accumulator.add(self,settings['source'],cmaxSamples.value,offsets=offsets,
+                            overflow=self._overflows(settings['source'],overflow))
+            return accumulator.results()
+        return self._results(settings['source'],cmaxSamples.value,dtype=dtype,raw=raw,offsets=offsets,overflow=overflow)
+    
+    def trigger_offsets(self,fromSegmentIndex=None,toSegmentIndex=None):
+        '''
+        returns the trigger time offset of each segment (in s): the time between the trigger event and the
+        nearest sample, the k-th sample of the segment being taken at k*dt+offset after the trigger.
+        All the offsets are fetched in a single driver call
+        keyword arguments:
+            fromSegmentIndex, toSegmentIndex: the segments (included), defaults to the segments of the last capture
+        returns:
+            offsets (float64 array, one per segment)
+        '''
+        if fromSegmentIndex is None:
+            fromSegmentIndex = self.trigger.settings['segmentIndex']
+        if toSegmentIndex is None:
+            toSegmentIndex = fromSegmentIndex+self.trigger.settings['nSegments']-1
+        n = toSegmentIndex-fromSegmentIndex+1
+        times = (ctypes.c_int64*n)()
+        timeUnits = (ctypes.c_int32*n)()
+        self.status["getTriggerTimeOffsetBulk"] = ps.ps5000aGetValuesTriggerTimeOffsetBulk64(self.chandle, ctypes.byref(times), 
+                                                                                          ctypes.byref(timeUnits),
+                                                                                          fromSegmentIndex, toSegmentIndex)
+        assert_pico_ok(self.status["getTriggerTimeOffsetBulk"])
+        #PS5000A_TIME_UNITS: fs, ps, ns, us, ms, s
+        return np.ctypeslib.as_array(times)*1e-15*1e3**np.ctypeslib.as_array(timeUnits)
+    
+    def read_chunks(self,budget=64e6,dtype=np.float64,raw=False,accumulator=None,align=False,**kwargs):
+        '''
+        reads the segments of a capture chunk by chunk, for segment counts beyond the host memory budget:
+        the channel buffer pools hold a single chunk and are reused (registered again) for each chunk
+            for chunk in scope.read_chunks(budget=16e6):
+                ...chunk['A (V)'], chunk['segments'], chunk['overflow']['A']...
+        arguments: none
+        keyword arguments:
+            budget: host memory for the buffer pools and the chunk results (in bytes)
+            dtype, raw: see read
+            accumulator: an Accumulator the chunks are added to (deep averaging), the chunks then contain
+                         only 'segments' and 'overflow'
+            align: aligns the segments on their trigger time offsets (see read)
+            other keyword arguments (source, reduction_mode, down_sample_blocksize) as in read
+        yields for each chunk the read results of its segments (see read), and:
+            'segments':  the slice of the chunk segments (relative to the first segment of the capture)
+            'overflow':  {channel: one flag per segment, True when the channel went over range}
+        '''
+        #handles default values
+        settings = {}
+        for key,current_value in self.settings.items():
+            settings[key] = kwargs[key] if key in kwargs else current_value
+        settings['source'] = kwargs['source'] if 'source' in kwargs else self.enabledChannels
+        check_kwargs_scope(**kwargs)
+        self.settings = settings
+        source = settings['source']
+        noSamples = self.settings['noSamples']
+        nSegments = self.trigger.settings['nSegments']
+        _fromSegmentIndex = self.trigger.settings['segmentIndex']
+        _ratio_mode = ratio_mode_index[settings['reduction_mode']]
+        #host bytes per segment: two int16 pools per channel and the chunk results
+        outputBytes = 0 if accumulator is not None else (2 if raw else np.dtype(dtype).itemsize)
+        if settings['reduction_mode']=='aggregate':
+            outputBytes *= 2
+        segmentBytes = len(source)*noSamples*(4+outputBytes)
+        chunkSize = max(1,min(nSegments,int(budget//segmentBytes)))
+        nChunks = -(-nSegments//chunkSize)
+        chunkSize = -(-nSegments//nChunks) #balanced chunks
+        maxADC = self._maxADC
+        for first in range(0,nSegments,chunkSize):
+            n = min(chunkSize,nSegments-first)
+            for channel in source:
+                self.channels[channel]._setDataBuffers(nSegments=n,segmentIndex=_fromSegmentIndex+first,
+                                                       reduction_mode=settings['reduction_mode'])
+            overflow = (ctypes.c_int16*n)()
+            cmaxSamples = ctypes.c_int32(noSamples)
+            self.status["getValuesBulk"] = ps.ps5000aGetValuesBulk(self.chandle, ctypes.byref(cmaxSamples), 
+                                                                   _fromSegmentIndex+first,_fromSegmentIndex+first+n-1,
+                                                                   settings['down_sample_blocksize'], _ratio_mode,
+                                                                   ctypes.byref(overflow))
+            assert_pico_ok(self.status["getValuesBulk"])
+            self._transferred('ps5000aGetValuesBulk',cmaxSamples.value,n,source,settings['reduction_mode'])
+            offsets = self.trigger_offsets(_fromSegmentIndex+first,_fromSegmentIndex+first+n-1) if align else None
+            if accumulator is not None:
+                accumulator.add(self,source,cmaxSamples.value,maxADC=maxADC,offsets=offsets,overflow=self._overflows(source,overflow))
+                results = {'overflow':self._overflows(source,overflow)}
+            else:
+                results = self._results(source,cmaxSamples.value,dtype=dtype,raw=raw,maxADC=maxADC,offsets=offsets,overflow=overflow)
+            results['segments'] = slice(first,first+n)
+            yield results
+    
+    def _transferred(self,name,noSamples,nSegments,source,reduction_mode='none'):
+        #bytes transferred by a GetValues call, for the instrumentation
+        nBytes = 2*noSamples*nSegments*len(source)*(2 if reduction_mode=='aggregate' else 1)
+        instrumentation.record_bytes(ps,name,nBytes)
+    
+    def _overflows(self,source,flags):
+        #driver overflow flags (bit n set when channel n went over range) to {channel: bool array}
+        flags = np.ctypeslib.as_array(flags)
+        return {channel:(flags>>ps.PS5000A_CHANNEL[channel_index[channel]])&1==1 for channel in source}
+    
+    def _results(self,source,noSamples,segments=slice(None),dtype=np.float64,raw=False,maxADC=None,offsets=None,overflow=None):
+        #builds the read results (a Capture) from the channel buffer pools (rows: segments), see read
+        maxADC = self._maxADC if maxADC is None else maxADC
+        # copies the counts out of the buffer pool (overwritten by the next read)
+        counts = {}
+        scale = {}
+        for channel in source:
             if self.channels[channel].settings['reduction_mode']=='aggregate':
-                results[channel+'_{max} (V)']=self.channels[channel].data_max
-                results[channel+'_{min} (V)']=self.channels[channel].data_min
+                counts[channel+'_{max}'] = self.channels[channel]._bufferMax[segments,:noSamples].T.copy()
+                counts[channel+'_{min}'] = self.channels[channel]._bufferMin[segments,:noSamples].T.copy()
             else:
-                results[channel+' (V)']=self.channels[channel].data_max
-        return results
+                counts[channel] = self.channels[channel]._bufferMax[segments,:noSamples].T.copy()
+            scale[channel] = {'chRange':self.channels[channel].settings['chRange'],
+                              'analogueOffset':self.channels[channel].settings['analogueOffset'],
+                              'maxADC':maxADC.value}
+        if overflow is not None:
+            overflow = self._overflows(source,overflow)
+        return Capture(time_axis(0.,self.settings['timeIntervalSeconds'],noSamples),counts,scale,raw=raw,dtype=dtype,
+                       offsets=offsets,overflow=overflow)
     
     def save_config(self):
         '''
@@ -713,10 +1632,24 @@ class Pico5000():
             config[channelName]=channel.settings
         return config
     
+    def _changed(self,call,arguments):
+        '''
+        diff against the last applied state of the scope: returns False when the driver call was
+        last issued with the same arguments (the call can be skipped), True otherwise.
+        self.calls counts the issued and skipped calls,
+        the caller updates self._applied[call] once the call succeeded
+        '''
+        if call in self._applied and self._applied[call]==arguments:
+            self.calls['skipped'] += 1
+            return False
+        self.calls['issued'] += 1
+        return True
+    
     def recall_config(self,config):
         '''
         recall the scope configuration from a config dictionnary,
         config dictionnary can be generated with save_config
+        only the driver calls whose settings differ from the current state are issued (see self.calls)
         '''
         for channelName, channelSettings in config.items():
             if channelName in ['A','B','C','D']:
@@ -725,6 +1658,26 @@ class Pico5000():
         self.trigger.set_trigger(**config['trigger'])
         self.awg.set_builtin(**config['awg'])
         
+
+def volts(results,key,dtype=np.float64):
+    '''
+    returns the voltages of a read result, converting the ADC counts of a raw read only when needed
+    arguments:
+        results: the output of Pico5000.read (with or without raw=True)
+        key: the voltage key, e.g. 'A (V)' or 'A_{max} (V)'
+    keyword arguments:
+        dtype: the voltage data type (np.float64 or np.float32)
+    returns:
+        the voltages (in V)
+    '''
+    if isinstance(results,Capture) and not key in results.extra:
+        return results.volts(key,dtype=dtype)
+    if key in results:
+        return results[key]
+    scale = results['scale'][key[0]]
+    _chRange = ps.PS5000A_RANGE[range_index[scale['chRange']]]
+    return helper_functions.adc2V(results[key.replace('(V)','(counts)')], _chRange, ctypes.c_int16(scale['maxADC']), dtype=dtype)
+
         
 if __name__ =='__main__':
     with Pico5000() as scope:
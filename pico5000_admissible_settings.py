@@ -1,6 +1,8 @@
+import functools
 import numpy as np
 from picosdk.ps5000a import ps5000a as ps
 from picosdk.functions import adc2mV, assert_pico_ok, mV2adc
+import helper_functions
 
 channel_index = {'A':"PS5000A_CHANNEL_A",
                  'B':"PS5000A_CHANNEL_B",
@@ -23,6 +25,7 @@ range_index = {1e-2:"PS5000A_10MV",
               20.:"PS5000A_20V",
               50.:"PS5000A_50V",
               np.inf:"PS5000A_MAX_RANGES"}
+max_range = 20. #largest input range of the 5000A series (in V)
 wave_index = {'sine':0,
                 'square':1,
                 'triangle':2,
@@ -49,6 +52,56 @@ sample_rate = {'8BIT': lambda n: 1e9/2**n if n<3 else 125e6/(n-2),
                '15BIT': lambda n: 125e6/2**n if n==3 else 125e6/(n-2),
                '16BIT': lambda n: 62.5e6/2**n if n==4 else 62.5e6/(n-2)}
 
+#sample_rate[resolution](n) = rate_constant[resolution]/(n-2) on the slow timebases (n>4)
+rate_constant = {'8BIT': 125e6,
+                 '12BIT': 62.5e6,
+                 '14BIT': 125e6,
+                 '15BIT': 125e6,
+                 '16BIT': 62.5e6}
+
+def min_timebase(resolution,enabled_channels):
+    '''
+    fastest available timebase for a resolution and a number of enabled channels
+    (disable the channels to reach the max resolution)
+    '''
+    if resolution=='8BIT':
+        return 0 if enabled_channels<=1 else 1
+    if resolution=='12BIT':
+        return 1 if enabled_channels<=1 else 2
+    if resolution=='14BIT':
+        return 3
+    if resolution=='15BIT':
+        return 3 if enabled_channels<=2 else 4
+    if resolution=='16BIT':
+        return 4 if enabled_channels<=1 else 5
+
+@functools.lru_cache(maxsize=1024)
+def find_timebase(resolution,enabled_channels,sampleRate=None,timeIntervalSeconds=None):
+    '''
+    analytic inverse of sample_rate[resolution]: the slowest timebase whose sample rate is at least sampleRate
+    (or whose time interval is at most timeIntervalSeconds), the fastest timebase if none is.
+    The hyperbolic branch gives the answer up to rounding, the exponential branch (n<5) is checked explicitly.
+    Results are memoized per (resolution, enabled channels, requested value)
+    arguments:
+        resolution: 8BIT/12BIT/14BIT/15BIT/16BIT
+        enabled_channels: number of enabled channels
+    keyword arguments:
+        sampleRate: the desired sample rate (in samples/s)
+        --or--
+        timeIntervalSeconds: the desired time interval between samples (in s)
+    returns:
+        the timebase (int)
+    '''
+    assert (sampleRate is None) != (timeIntervalSeconds is None), 'give either sampleRate or timeIntervalSeconds'
+    rate = sample_rate[resolution]
+    if sampleRate is not None:
+        admissible = lambda n: rate(n)>=sampleRate
+        guess = 2+min(rate_constant[resolution]/sampleRate,2**32)
+    else:
+        admissible = lambda n: 1./rate(n)<=timeIntervalSeconds
+        guess = 2+min(rate_constant[resolution]*timeIntervalSeconds,2**32)
+    return helper_functions.last_admissible(admissible,min_timebase(resolution,enabled_channels),2**32-1,guess)
+
 ratio_mode_index = {'none':0,
                     'aggregate':1,
                     'decimate':2,
@@ -78,8 +131,9 @@ def check_kwargs_scope(**kwargs):
     if 'chRange' in kwargs:
         assert kwargs['chRange'] in range_index, 'chRange should belong to {0}'.format(range_index.keys())
     #analogueOffset has to be checked with the scope
-    if 'source' in kwargs:
-        assert kwargs['source'] in channel_index, 'source should belong to {0}'.format(channel_index.keys())
+    if 'source' in kwargs: #a channel, or a list of channels to read
+        sources = kwargs['source'] if isinstance(kwargs['source'],(list,tuple)) else [kwargs['source']]
+        assert all(source in channel_index for source in sources), 'source should belong to {0}'.format(channel_index.keys())
     if 'threshold' in kwargs:
         assert type(kwargs['threshold']) is float, 'threshold should be a float'
     if 'direction' in kwargs:
@@ -0,0 +1,571 @@
+'''
+scan paths of the LDV scanner: the order in which the scan points are visited.
+The galvo settle time grows with the step size (see galvomirrors.Galvosystem.predict_settle): visiting
+a lattice row by row, in alternate directions, keeps every step at the lattice pitch:
+    order = scan_paths.order_path(points,method='serpentine')
+    points = points[order]
+the orderings return the indices of the points, so that the data attached to the points can follow.
+adaptive scans measure a coarse subset of the path first, then refine around the points of high amplitude (see adaptive)
+'''
+
+import math
+import numpy as np
+from scipy.spatial import cKDTree
+
+
+orderings = ['serpentine','tour','none']
+
+def travel(points):
+    '''
+    returns the total travel and the largest step (in m) of a path, m*2 array (in m)
+    '''
+    if len(points)<2:
+        return 0.,0.
+    steps = np.hypot(*np.diff(points,axis=0).T)
+    return float(np.sum(steps)),float(np.max(steps))
+
+def serpentine(points,row_tol=1e-9):
+    '''
+    rows of equal y (within row_tol, in m) in increasing y, the x direction alternates from one row to the next.
+    The rows of the two sublattices of a hex lattice are interleaved
+    arguments:
+        points: the positions (m), m*2 array
+    keyword arguments:
+        row_tol: the y resolution of the rows (in m)
+    returns:
+        the order of the points (indices)
+    '''
+    rows = np.unique(np.round(points[:,1]/row_tol),return_inverse=True)[1].ravel()
+    direction = np.where(rows%2,-1.,1.)
+    return np.lexsort((direction*points[:,0],rows))
+
+def nearest_neighbour(points,start=0,k=8):
+    '''
+    greedy tour: from start, the nearest point not visited yet is visited next
+    (the k nearest points are queried first, more when they are all visited)
+    returns:
+        the order of the points (indices)
+    '''
+    n = len(points)
+    tree = cKDTree(points)
+    visited = np.zeros(n,dtype=bool)
+    order = np.empty(n,dtype=int)
+    current = start
+    for i in range(n):
+        order[i] = current
+        visited[current] = True
+        if i==n-1:
+            break
+        n_query = min(k,n)
+        while True:
+            neighbours = np.atleast_1d(tree.query(points[current],k=n_query)[1])
+            candidates = neighbours[~visited[neighbours]]
+            if len(candidates):
+                current = candidates[0]
+                break
+            n_query = min(2*n_query,n)
+    return order
+
+def two_opt(points,order,k=8,max_passes=10):
+    '''
+    improves an open path by 2-opt moves: a section of the path is reversed when it shortens the travel.
+    Only the moves towards the k nearest points of each point are tried
+    arguments:
+        points: the positions (m), m*2 array
+        order: the initial order of the points (indices)
+    keyword arguments:
+        k: number of neighbours tried per point
+        max_passes: maximum number of passes over the path
+    returns:
+        the improved order (indices)
+    '''
+    order = np.array(order)
+    n = len(order)
+    if n<4:
+        return order
+    neighbours = cKDTree(points).query(points,k=min(k+1,n))[1][:,1:].tolist()
+    position = np.empty(n,dtype=int)
+    position[order] = np.arange(n)
+    x,y = points[:,0].tolist(),points[:,1].tolist() #scalar distances on python floats
+    def distance(a,b):
+        return math.hypot(x[a]-x[b],y[a]-y[b])
+    for _ in range(max_passes):
+        improved = False
+        for i in range(n-1):
+            a,b = int(order[i]),int(order[i+1])
+            for c in neighbours[a]:
+                j = position[c]
+                if j<=i+1:
+                    continue
+                #reversing order[i+1:j+1] replaces the steps a->b and c->d by a->c and b->d
+                gain = distance(a,b)-distance(a,c)
+                if j+1<n:
+                    d = int(order[j+1])
+                    gain += distance(c,d)-distance(b,d)
+                if gain>1e-12:
+                    order[i+1:j+1] = order[i+1:j+1][::-1]
+                    position[order[i+1:j+1]] = np.arange(i+1,j+1)
+                    a,b = int(order[i]),int(order[i+1])
+                    improved = True
+        if not improved:
+            break
+    return order
+
+def tour(points,start=0,k=8,max_passes=10):
+    '''
+    short open tour of arbitrary points: nearest neighbour tour improved by 2-opt moves (see two_opt)
+    returns:
+        the order of the points (indices)
+    '''
+    return two_opt(points,nearest_neighbour(points,start=start,k=k),k=k,max_passes=max_passes)
+
+def order_path(points,method='serpentine'):
+    '''
+    orders the points of a scan path
+    arguments:
+        points: the positions (m), m*2 array
+    keyword arguments:
+        method: 'serpentine' (lattices, see serpentine),
+                'tour' (arbitrary points, nearest neighbour and 2-opt from the first serpentine point, see tour),
+                'none' (order unchanged)
+    returns:
+        the order of the points (indices)
+    '''
+    assert method in orderings, 'the scan path order should belong to {0}'.format(orderings)
+    if method=='none' or len(points)<2:
+        return np.arange(len(points))
+    order = serpentine(points)
+    if method=='tour':
+        order = tour(points,start=order[0])
+    return order
+
+def pitch(points):
+    '''
+    returns the median distance between nearest points of a scan path (in m), its resolution
+    '''
+    return float(np.median(cKDTree(points).query(points,k=2)[0][:,1]))
+
+def lattice_levels(points,resolution,levels):
+    '''
+    nested coarse subsets of a scan path, for coarse-to-fine scans: the subset of level L keeps,
+    among the points of level L-1, the point closest to the centre of each square cell of side resolution*2**L
+    arguments:
+        points: the positions (m), m*2 array
+        resolution: the pitch of the scan path (in m)
+        levels: number of coarse levels
+    returns:
+        the coarsest level of each point (0 for the points of the full path only)
+    '''
+    level = np.zeros(len(points),dtype=int)
+    selected = np.arange(len(points))
+    for L in range(1,levels+1):
+        cell = resolution*2**L
+        keys = np.floor(points[selected]/cell)
+        distance = np.hypot(*(points[selected]-(keys+0.5)*cell).T)
+        order = np.lexsort((distance,keys[:,1],keys[:,0]))
+        keys = keys[order]
+        first = np.ones(len(order),dtype=bool)
+        first[1:] = np.any(keys[1:]!=keys[:-1],axis=1)
+        selected = selected[order[first]]
+        level[selected] = L
+    return level
+
+def _flagged(points,values,spacing,threshold,gradient_threshold):
+    #points whose value, or the value slope to a point within 1.5*spacing, exceeds the thresholds (relative to the peak)
+    peak = np.max(np.abs(values))
+    if not peak>0:
+        return np.zeros(len(points),dtype=bool)
+    flagged = np.abs(values)>=threshold*peak
+    if gradient_threshold is not None:
+        pairs = cKDTree(points).query_pairs(1.5*spacing,output_type='ndarray')
+        slope = np.abs(values[pairs[:,0]]-values[pairs[:,1]])/np.hypot(*(points[pairs[:,0]]-points[pairs[:,1]]).T)
+        flagged[pairs[slope*spacing>=gradient_threshold*peak].ravel()] = True
+    return flagged
+
+def adaptive(points,measure,levels=2,threshold=0.2,gradient_threshold=0.2,resolution=None):
+    '''
+    coarse-to-fine scan of a path: the coarsest subset of the path is measured (see lattice_levels), then,
+    one level at a time, the points of the next level around the points of high value or high value gradient
+    (see the thresholds), down to the full path
+    arguments:
+        points: the positions (m), m*2 array
+        measure: function (indices,level) -> values, measures the points of the path indices (in the path order)
+                 and returns their value (e.g. the vibration amplitude), level is the refinement level of the pass
+    keyword arguments:
+        levels: number of coarse levels, the coarse pass is 2**levels times sparser than the path
+        threshold: the points of value above threshold*(peak value) are refined
+        gradient_threshold: the points of value slope above gradient_threshold*(peak value) per spacing of their level
+                            are refined, None refines on the values only
+        resolution: the pitch of the path (in m), see pitch
+    returns:
+        the value of each point of the path (nan when not measured), the level of the pass that measured it (-1)
+    '''
+    resolution = pitch(points) if resolution is None else resolution
+    level = lattice_levels(points,resolution,levels)
+    values = np.full(len(points),np.nan)
+    passes = np.full(len(points),-1,dtype=int)
+    indices = np.flatnonzero(level==levels)
+    for L in range(levels,-1,-1):
+        values[indices] = measure(indices,L)
+        passes[indices] = L
+        if L==0:
+            break
+        spacing = resolution*2**L
+        measured = np.flatnonzero(passes>=0)
+        flagged = measured[_flagged(points[measured],values[measured],spacing,threshold,gradient_threshold)]
+        candidates = np.flatnonzero((level>=L-1) & (passes<0))
+        if not (len(flagged) and len(candidates)):
+            indices = candidates[:0]
+            continue
+        near = cKDTree(points[candidates]).query_ball_point(points[flagged],spacing)
+        indices = candidates[np.unique(np.concatenate([np.asarray(n,dtype=int) for n in near]))]
+    return values,passes
+
+
+
+def _sorted(rows,starts,ends):
+    #intervals sorted by row, then by start
+    order = np.lexsort((starts,rows))
+    return rows[order],starts[order],ends[order]
+
+def _expand(first,counts):
+    #concatenation of the ranges first[i]+arange(counts[i])
+    return np.repeat(first-np.cumsum(counts)+counts,counts)+np.arange(counts.sum())
+
+
+class Polygon():
+    '''
+    region inside a polygon (even-odd rule: a polygon going around a hole and back excludes it).
+    The regions give the intervals inside them along rows of constant y (see spans), the lattice points are
+    generated from the intervals only (see fill): any object with bounds and spans can be used as a region
+    '''
+    def __init__(self,vertices):
+        '''
+        arguments:
+            vertices: the polygon vertices (in m), n*2 array (the polygon is closed automatically)
+        '''
+        self.vertices = np.asarray(vertices,dtype=float)
+        self.bounds = (*self.vertices.min(axis=0),*self.vertices.max(axis=0)) #xmin,ymin,xmax,ymax
+    
+    def spans(self,y):
+        '''
+        returns the intervals inside the region along the rows y (increasing):
+        rows (index in y), starts and ends (in m) of the intervals, sorted by row and start
+        '''
+        start = self.vertices
+        stop = np.roll(self.vertices,-1,axis=0)
+        #rows crossing each edge, half-open [low,high) so that a vertex is crossed once
+        first = np.searchsorted(y,np.minimum(start[:,1],stop[:,1]),side='left')
+        counts = np.searchsorted(y,np.maximum(start[:,1],stop[:,1]),side='left')-first
+        edge = np.repeat(np.arange(len(start)),counts)
+        rows = _expand(first,counts)
+        t = (y[rows]-start[edge,1])/(stop[edge,1]-start[edge,1])
+        x = start[edge,0]+t*(stop[edge,0]-start[edge,0])
+        order = np.lexsort((x,rows))
+        rows,x = rows[order],x[order]
+        return rows[0::2],x[0::2],x[1::2] #crossings paired along each row
+
+
+class Circle():
+    '''
+    region inside a circle
+    '''
+    def __init__(self,radius,centre=(0.,0.)):
+        '''
+        arguments:
+            radius (in m)
+        keyword arguments:
+            centre: (x,y) (in m)
+        '''
+        self.radius = radius
+        self.centre = centre
+        self.bounds = (centre[0]-radius,centre[1]-radius,centre[0]+radius,centre[1]+radius)
+    
+    def spans(self,y):
+        '''
+        see Polygon.spans
+        '''
+        dy = y-self.centre[1]
+        rows = np.flatnonzero(np.abs(dy)<=self.radius)
+        half = np.sqrt(self.radius**2-dy[rows]**2)
+        return rows,self.centre[0]-half,self.centre[0]+half
+
+
+class Annulus():
+    '''
+    region between two concentric circles
+    '''
+    def __init__(self,inner,outer,centre=(0.,0.)):
+        '''
+        arguments:
+            inner, outer: the radii (in m)
+        keyword arguments:
+            centre: (x,y) (in m)
+        '''
+        assert inner<outer, 'the inner radius should be smaller than the outer radius'
+        self.outer = Circle(outer,centre=centre)
+        self.inner = Circle(inner,centre=centre)
+        self.bounds = self.outer.bounds
+    
+    def spans(self,y):
+        '''
+        see Polygon.spans
+        '''
+        rows,starts,ends = self.outer.spans(y)
+        holes,hole_starts,hole_ends = self.inner.spans(y)
+        left,right = np.full(len(y),np.nan),np.full(len(y),np.nan)
+        left[holes],right[holes] = hole_starts,hole_ends
+        cut = ~np.isnan(left[rows]) #the rows crossing the hole have an interval on each side
+        return _sorted(np.concatenate([rows[~cut],rows[cut],rows[cut]]),
+                       np.concatenate([starts[~cut],starts[cut],right[rows[cut]]]),
+                       np.concatenate([ends[~cut],left[rows[cut]],ends[cut]]))
+
+
+class Mask():
+    '''
+    region of the true pixels of an image mask
+    '''
+    def __init__(self,mask,pixel,origin=(0.,0.)):
+        '''
+        arguments:
+            mask: boolean image, mask[i,j] is the pixel [origin[0]+j*pixel, +pixel[ x [origin[1]+i*pixel, +pixel[
+            pixel: the pixel size (in m)
+        keyword arguments:
+            origin: (x,y) of the corner of the pixel [0,0] (in m)
+        '''
+        self.mask = np.asarray(mask,dtype=bool)
+        self.pixel = pixel
+        self.origin = origin
+        self.bounds = (origin[0],origin[1],origin[0]+pixel*self.mask.shape[1],origin[1]+pixel*self.mask.shape[0])
+        #runs of true pixels of each image row
+        edges = np.diff(np.pad(self.mask,((0,0),(1,1))).astype(np.int8),axis=1)
+        image_rows,run_starts = np.nonzero(edges==1)
+        self._runs = (run_starts,np.nonzero(edges==-1)[1])
+        self._first_run = np.searchsorted(image_rows,np.arange(self.mask.shape[0]+1))
+    
+    def spans(self,y):
+        '''
+        see Polygon.spans
+        '''
+        run_starts,run_ends = self._runs
+        i = np.floor((y-self.origin[1])/self.pixel).astype(int)
+        inside = (i>=0)&(i<self.mask.shape[0])
+        first = np.where(inside,self._first_run[np.where(inside,i,0)],0)
+        counts = np.where(inside,self._first_run[np.where(inside,i+1,0)]-first,0)
+        rows = np.repeat(np.arange(len(y)),counts)
+        runs = _expand(first,counts)
+        return rows,self.origin[0]+self.pixel*run_starts[runs],self.origin[0]+self.pixel*run_ends[runs]
+
+
+class Union():
+    '''
+    union of regions (e.g. disjoint regions scanned in a single path), the overlapping intervals are merged
+    '''
+    def __init__(self,regions):
+        '''
+        arguments:
+            regions: the regions (see Polygon)
+        '''
+        self.regions = regions
+        bounds = np.array([region.bounds for region in regions])
+        self.bounds = (*bounds[:,:2].min(axis=0),*bounds[:,2:].max(axis=0))
+    
+    def spans(self,y):
+        '''
+        see Polygon.spans
+        '''
+        rows,starts,ends = _sorted(*[np.concatenate(values) for values in zip(*[region.spans(y) for region in self.regions])])
+        if not len(rows):
+            return rows,starts,ends
+        #running maximum of the ends within each row (the rows are offset not to mix)
+        offset = rows*(np.ptp(ends)+1.)
+        reach = np.maximum.accumulate(ends-ends.min()+offset)-offset+ends.min()
+        new = np.ones(len(rows),dtype=bool)
+        new[1:] = (rows[1:]!=rows[:-1]) | (starts[1:]>reach[:-1])
+        last = np.append(np.flatnonzero(new)[1:]-1,len(rows)-1)
+        return rows[new],starts[new],reach[last]
+
+
+regions = {'circle':lambda settings: Circle(1e-3*settings['radius (mm)'],centre=_centre(settings)),
+           'rectangle':lambda settings: Polygon(_centre(settings)+1e-3*np.array([[-1,-1],[1,-1],[1,1],[-1,1]])
+                                                *[settings['xlength (mm)'],settings['ylength (mm)']]),
+           'polygon':lambda settings: Polygon(1e-3*np.asarray(settings['vertices (mm)'])),
+           'annulus':lambda settings: Annulus(1e-3*settings['inner radius (mm)'],1e-3*settings['outer radius (mm)'],
+                                              centre=_centre(settings)),
+           'mask':lambda settings: Mask(settings['mask'],1e-6*settings['pixel (um)'],
+                                        origin=1e-3*np.asarray(settings.get('origin (mm)',(0.,0.)))),
+           'regions':lambda settings: Union([region(sub) for sub in settings['regions']])}
+
+lattices = ['hex','square']
+
+def _centre(settings):
+    return 1e-3*np.array([settings.get('xoffset',0.),settings.get('yoffset',0.)])
+
+def region(settings):
+    '''
+    returns the region described by a scan path dictionary, settings['type'] in regions:
+        circle:    'radius (mm)', 'xoffset' and 'yoffset' (in mm, optional)
+        rectangle: 'xlength (mm)', 'ylength (mm)' (half lengths), 'xoffset' and 'yoffset' (optional)
+        polygon:   'vertices (mm)', n*2
+        annulus:   'inner radius (mm)', 'outer radius (mm)', 'xoffset' and 'yoffset' (optional)
+        mask:      'mask' (boolean image, see Mask), 'pixel (um)', 'origin (mm)' (optional)
+        regions:   'regions', a list of scan path dictionaries (their union)
+    '''
+    assert settings['type'] in regions, 'scan_path types should belong to {0}'.format(list(regions))
+    return regions[settings['type']](settings)
+
+class ScanPath():
+    '''
+    scan path of known length with random access, path[i], path[i:j] or path[indices] (positions in m),
+    and iteration by blocks of points (see blocks): the consumers never need the whole path in memory.
+    ScanPath wraps an m*2 array of positions, or any array-like read by slices (e.g. an h5py dataset),
+    see LatticePath for the lattice designs computed on demand
+    '''
+    def __init__(self,points,block_size=100000):
+        '''
+        arguments:
+            points: the positions (m), m*2 array-like
+        keyword arguments:
+            block_size: the number of points of the blocks
+        '''
+        assert len(np.shape(points))==2 and np.shape(points)[1]==2, 'a scan path must be an m*2 array'
+        self.points = points
+        self.block_size = block_size
+    
+    def __len__(self):
+        return len(self.points)
+    
+    def __getitem__(self,index):
+        return np.asarray(self.points[index],dtype=float)
+    
+    def __iter__(self):
+        for start,block in self.blocks():
+            yield from block
+    
+    def blocks(self,size=None,overlap=0,first=0):
+        '''
+        iterates over the blocks of the path: yields (start, points) where points = path[start-overlap:start+size]
+        (the overlap points of the previous block are repeated, e.g. overlap=1 for the steps between blocks)
+        keyword arguments:
+            size: the number of new points per block, defaults to self.block_size
+            overlap: number of points of the previous block repeated at the start of a block
+            first: index of the first point of the first block
+        '''
+        size = self.block_size if size is None else size
+        for start in range(first,len(self),size):
+            yield start,self[max(start-overlap,0):min(start+size,len(self))]
+
+
+class LatticePath(ScanPath):
+    '''
+    lattice points inside a region, computed on demand: only the intervals of the region along the lattice rows
+    are kept (the memory grows with the number of rows, not of points, see ScanPath for the access).
+    The rows are visited in increasing y, in increasing x ('none' order) or in alternate directions
+    ('serpentine' order, as scan_paths.serpentine), the lattice starts at the lower left corner of the region bounds
+    '''
+    def __init__(self,region,resolution,lattice='hex',order='serpentine',block_size=100000):
+        '''
+        arguments:
+            region: see Polygon
+            resolution: the lattice resolution (in m)
+        keyword arguments:
+            lattice: 'hex' (pitch resolution*sqrt(3)/2, every other row shifted by half a pitch,
+                     as the former LDV_scanner._design_path), or 'square' (pitch resolution)
+            order: 'serpentine' or 'none'
+            block_size: the number of points of the blocks
+        '''
+        assert lattice in lattices, 'lattice should belong to {0}'.format(lattices)
+        assert order in ['serpentine','none'], 'the order of a lattice path should be serpentine or none'
+        self.block_size = block_size
+        xmin,ymin,xmax,ymax = region.bounds
+        self.pitch = resolution*np.sqrt(3.)/2. if lattice=='hex' else resolution
+        shift = 0.5*self.pitch if lattice=='hex' else 0.
+        self._y = ymin+self.pitch*np.arange(int(np.floor((ymax-ymin)/self.pitch*(1+1e-12)))+1)
+        rows,starts,ends = region.spans(self._y)
+        x0 = xmin+shift*(rows%2)
+        first = np.ceil((starts-x0)/self.pitch-1e-9).astype(np.int64)
+        counts = np.maximum(np.floor((ends-x0)/self.pitch+1e-9).astype(np.int64)-first+1,0)
+        keep = counts>0
+        rows,x0,first,counts = rows[keep],x0[keep],first[keep],counts[keep]
+        #serpentine: the intervals, and their points, in decreasing x along every other row
+        self._reversed = np.zeros(len(rows),dtype=bool)
+        if order=='serpentine' and len(rows):
+            self._reversed = np.unique(rows,return_inverse=True)[1].ravel()%2==1
+            interval = np.lexsort((np.where(self._reversed,-1,1)*first,rows))
+            rows,x0,first,counts,self._reversed = rows[interval],x0[interval],first[interval],counts[interval],self._reversed[interval]
+        self._rows,self._x0,self._first,self._counts = rows,x0,first,counts
+        self._ends = np.cumsum(counts)
+        self._n = int(self._ends[-1]) if len(counts) else 0
+    
+    def __len__(self):
+        return self._n
+    
+    def __getitem__(self,index):
+        if isinstance(index,tuple): #e.g. path[:,0]
+            return self[index[0]][(Ellipsis,)+index[1:]]
+        if isinstance(index,slice):
+            start,stop,step = index.indices(len(self))
+            if step==1:
+                return self._range(start,stop)
+            index = np.arange(start,stop,step)
+        scalar = np.ndim(index)==0
+        index = np.atleast_1d(np.asarray(index,dtype=np.int64))
+        index = np.where(index<0,index+len(self),index)
+        if len(index) and (index.min()<0 or index.max()>=len(self)):
+            raise IndexError('scan path index out of range')
+        interval = np.searchsorted(self._ends,index,side='right')
+        k = index-(self._ends[interval]-self._counts[interval])
+        k = np.where(self._reversed[interval],self._counts[interval]-1-k,k)
+        points = np.empty((len(index),2))
+        points[:,0] = self._x0[interval]+self.pitch*(self._first[interval]+k)
+        points[:,1] = self._y[self._rows[interval]]
+        return points[0] if scalar else points
+    
+    def _range(self,start,stop):
+        #the points start to stop, expanded interval by interval
+        if stop<=start:
+            return np.empty((0,2))
+        first,last = np.searchsorted(self._ends,[start,stop-1],side='right')
+        interval = np.arange(first,last+1)
+        begin = np.maximum(self._ends[interval]-self._counts[interval],start)
+        counts = np.minimum(self._ends[interval],stop)-begin
+        k = _expand(begin-(self._ends[interval]-self._counts[interval]),counts)
+        interval = np.repeat(interval,counts)
+        k = np.where(self._reversed[interval],self._counts[interval]-1-k,k)
+        points = np.empty((stop-start,2))
+        points[:,0] = self._x0[interval]+self.pitch*(self._first[interval]+k)
+        points[:,1] = self._y[self._rows[interval]]
+        return points
+
+def fill(region,resolution,lattice='hex'):
+    '''
+    lattice points inside a region, row by row (increasing y then increasing x), see LatticePath
+    arguments:
+        region: see Polygon
+        resolution: the lattice resolution (in m)
+    keyword arguments:
+        lattice: 'hex' or 'square'
+    returns:
+        the positions (m), m*2 array
+    '''
+    return LatticePath(region,resolution,lattice=lattice,order='none')[:]
+
+def design(settings):
+    '''
+    returns the lattice points of a scan path dictionary (see region), with its 'resolution (um)'
+    and 'lattice' ('hex' by default, see fill)
+    '''
+    return fill(region(settings),1e-6*settings['resolution (um)'],lattice=settings.get('lattice','hex'))
+
+def design_path(settings,block_size=100000):
+    '''
+    returns the ScanPath of a scan path dictionary (see design), ordered by its 'order' key ('serpentine' by default):
+    a LatticePath for the 'serpentine' and 'none' orders, the 'tour' order needs all the points in memory
+    '''
+    order = settings.get('order','serpentine')
+    assert order in orderings, 'the scan path order should belong to {0}'.format(orderings)
+    if order=='tour':
+        points = design(settings)
+        return ScanPath(points[order_path(points,method=order)],block_size=block_size)
+    return LatticePath(region(settings),1e-6*settings['resolution (um)'],lattice=settings.get('lattice','hex'),
+                       order=order,block_size=block_size)
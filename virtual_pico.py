@@ -0,0 +1,575 @@
+'''
+Simulated picoscope drivers, to develop and benchmark without the hardware.
+install() registers the virtual drivers in place of picosdk.ps5000a and picosdk.ps2000,
+it must be called before importing pico5000 or pico2000 (calling it again installs new drivers):
+    import virtual_pico
+    virtual_pico.install()
+    import pico5000
+The virtual 5000 scope measures a sine wave at the frequency of its built-in generator (plus noise),
+captures complete after the time they would take on the device and transfers are slowed down
+to the USB throughput given in VirtualPs5000a.transfer_rate (in bytes/s).
+The virtual 2000 scopes each drive a simulated galvo motor (VirtualMotor) with their generator.
+'''
+
+import ctypes
+import sys
+import threading
+import time
+import types
+import numpy as np
+
+
+def _value(x):
+    #driver arguments may be passed as python or ctypes values
+    return x.value if hasattr(x,'value') else x
+
+def _address(pointer):
+    #address of a buffer passed as ctypes.byref(array) or ndarray.ctypes.data_as(...)
+    if pointer is None:
+        return None
+    if hasattr(pointer,'_obj'):
+        return ctypes.addressof(pointer._obj)
+    return ctypes.cast(pointer,ctypes.c_void_p).value
+
+def _array(pointer,length,ctype=ctypes.c_int16):
+    #numpy view of a driver buffer
+    return np.ctypeslib.as_array((ctype*length).from_address(_address(pointer)))
+
+def _set(pointer,value):
+    #writes value at the location of an output argument
+    pointer._obj.value = value
+
+
+PICO_DATA_NOT_AVAILABLE = 0x18
+PICO_BUSY = 0x27
+
+def _enum(members):
+    return {member:i for i,member in enumerate(members)}
+
+def _callback_factory(*argtypes):
+    return ctypes.CFUNCTYPE(None,*argtypes)
+
+
+class VirtualPs5000a():
+    '''
+    virtual ps5000a driver (single device), the functions follow the ps5000aApi.h signatures
+    '''
+    PS5000A_DEVICE_RESOLUTION = _enum(['PS5000A_DR_8BIT','PS5000A_DR_12BIT','PS5000A_DR_14BIT',
+                                       'PS5000A_DR_15BIT','PS5000A_DR_16BIT'])
+    PS5000A_COUPLING = _enum(['PS5000A_AC','PS5000A_DC'])
+    PS5000A_CHANNEL = {'PS5000A_CHANNEL_A':0,
+                       'PS5000A_CHANNEL_B':1,
+                       'PS5000A_CHANNEL_C':2,
+                       'PS5000A_CHANNEL_D':3,
+                       'PS5000A_EXTERNAL':4,
+                       'PS5000A_MAX_CHANNELS':4,
+                       'PS5000A_TRIGGER_AUX':5,
+                       'PS5000A_PULSE_WIDTH_SOURCE':0x10000000}
+    PS5000A_RANGE = _enum(['PS5000A_10MV','PS5000A_20MV','PS5000A_50MV','PS5000A_100MV',
+                           'PS5000A_200MV','PS5000A_500MV','PS5000A_1V','PS5000A_2V',
+                           'PS5000A_5V','PS5000A_10V','PS5000A_20V','PS5000A_50V',
+                           'PS5000A_MAX_RANGES'])
+    PS5000A_TIME_UNITS = _enum(['PS5000A_FS','PS5000A_PS','PS5000A_NS','PS5000A_US',
+                                'PS5000A_MS','PS5000A_S','PS5000A_MAX_TIME_UNITS'])
+    BlockReadyType = _callback_factory(ctypes.c_int16,ctypes.c_int32,ctypes.c_void_p)
+    StreamingReadyType = _callback_factory(ctypes.c_int16,ctypes.c_int32,ctypes.c_uint32,ctypes.c_int16,
+                                           ctypes.c_uint32,ctypes.c_int16,ctypes.c_int16,ctypes.c_void_p)
+    _ranges_mV = [10,20,50,100,200,500,1000,2000,5000,10000,20000,50000]
+    _sample_rate = {0:lambda n: 1e9/2**n if n<3 else 125e6/(n-2),
+                    1:lambda n: 500e6/2**n if n<3 else 62.5e6/(n-2),
+                    2:lambda n: 125e6/(n-2),
+                    3:lambda n: 125e6/(n-2),
+                    4:lambda n: 62.5e6/2**n if n==4 else 62.5e6/(n-2)}
+
+    def __init__(self,transfer_rate=100e6,memory=512e6,noise=0.01,jitter=True,seed=0):
+        self.transfer_rate = transfer_rate #USB throughput (bytes/s)
+        self.memory = int(memory) #device memory (samples)
+        self.noise = noise #noise level (V rms)
+        self.jitter = jitter #random trigger time offsets within one sample
+        self.rng = np.random.default_rng(seed)
+        self.calls = {} #number of calls per driver function
+        self._reset()
+
+    def _reset(self):
+        self.resolution = 0
+        self.channels = {i:{'enabled':i==0,'range':7,'offset':0.} for i in range(4)}
+        self.timebase = 8
+        self.noSamples = 0
+        self.nSegments = 1
+        self.nCaptures = 1
+        self.buffers = {}
+        self.segments = {}
+        self.sig_gen = {'offset':0.,'pkToPk':1.,'freq':1e3,'waveType':0}
+        self.ready_at = None
+        self.streaming = None
+
+    def _count(self,name):
+        self.calls[name] = self.calls.get(name,0)+1
+
+    @property
+    def _maxADC(self):
+        return 32512 if self.resolution==0 else 32767
+
+    def _dt(self,timebase=None):
+        return 1./self._sample_rate[self.resolution](self.timebase if timebase is None else timebase)
+
+    def _noise(self,n):
+        #white noise (V), drawn from a precomputed bank
+        if not hasattr(self,'_noiseBank'):
+            self._noiseBank = self.noise*self.rng.standard_normal(2**20)
+        if n>len(self._noiseBank):
+            return self.noise*self.rng.standard_normal(n)
+        start = self.rng.integers(0,len(self._noiseBank)-n+1)
+        return self._noiseBank[start:start+n]
+
+    def _signal(self,channel,n,t0,offset,dt=None,channels=None,sig_gen=None):
+        #synthetic measurement of channel (in ADC counts)
+        dt = self._dt() if dt is None else dt
+        channels = self.channels if channels is None else channels
+        sig_gen = self.sig_gen if sig_gen is None else sig_gen
+        t = t0+dt*np.arange(n)+offset
+        amplitude = 0.5*sig_gen['pkToPk']
+        y = sig_gen['offset']+amplitude*np.sin(2*np.pi*sig_gen['freq']*t+0.5*channel)
+        y = y+self._noise(n)
+        fullscale = 1e-3*self._ranges_mV[channels[channel]['range']]
+        counts = np.round((y+channels[channel]['offset'])*self._maxADC/fullscale)
+        return np.clip(counts,-self._maxADC,self._maxADC).astype(np.int16)
+
+    def _capture(self,firstSegment,nCaptures):
+        #stores nCaptures segments in the device memory, the samples are synthesized when transferred
+        dt = self._dt()
+        channels = {ch:dict(c) for ch,c in self.channels.items()}
+        sig_gen = dict(self.sig_gen)
+        for i in range(nCaptures):
+            offset = self.rng.uniform(-dt,0.) if self.jitter else 0.
+            self.segments[firstSegment+i] = {'offset':offset,'dt':dt,'noSamples':self.noSamples,
+                                             'channels':channels,'sig_gen':sig_gen,'data':None}
+
+    def _segment_data(self,segment):
+        s = self.segments[segment]
+        if s['data'] is None:
+            s['data'] = {ch:self._signal(ch,s['noSamples'],0.,s['offset'],dt=s['dt'],
+                                         channels=s['channels'],sig_gen=s['sig_gen'])
+                         for ch,c in s['channels'].items() if c['enabled']}
+        return s['data']
+
+    def _transfer(self,nBytes,start_time):
+        #the transfer lasts nBytes/transfer_rate, including the time spent synthesizing the data
+        if self.transfer_rate:
+            time.sleep(max(0.,nBytes/self.transfer_rate-(time.perf_counter()-start_time)))
+
+    # -- device --
+    def ps5000aOpenUnit(self,handle,serial,resolution):
+        self._count('ps5000aOpenUnit')
+        self._reset()
+        self.resolution = _value(resolution)
+        _set(handle,1)
+        return 0
+
+    def ps5000aChangePowerSource(self,handle,powerState):
+        self._count('ps5000aChangePowerSource')
+        return 0
+
+    def ps5000aCloseUnit(self,handle):
+        self._count('ps5000aCloseUnit')
+        return 0
+
+    def ps5000aStop(self,handle):
+        self._count('ps5000aStop')
+        self.ready_at = None
+        if self.streaming is not None:
+            self.streaming['running'] = False
+        return 0
+
+    def ps5000aGetUnitInfo(self,handle,string,stringLength,requiredSize,info):
+        self._count('ps5000aGetUnitInfo')
+        string.value = 'virtual {0}'.format(_value(info)).encode('utf-8')
+        _set(requiredSize,len(string.value))
+        return 0
+
+    def ps5000aMaximumValue(self,handle,value):
+        self._count('ps5000aMaximumValue')
+        _set(value,self._maxADC)
+        return 0
+
+    def ps5000aGetDeviceResolution(self,handle,resolution):
+        self._count('ps5000aGetDeviceResolution')
+        _set(resolution,self.resolution)
+        return 0
+
+    def ps5000aSetDeviceResolution(self,handle,resolution):
+        self._count('ps5000aSetDeviceResolution')
+        self.resolution = _value(resolution)
+        return 0
+
+    # -- configuration --
+    def ps5000aSetChannel(self,handle,channel,enabled,coupling,chRange,analogueOffset):
+        self._count('ps5000aSetChannel')
+        self.channels[_value(channel)] = {'enabled':bool(_value(enabled)),
+                                          'range':_value(chRange),
+                                          'offset':_value(analogueOffset)}
+        return 0
+
+    def ps5000aGetAnalogueOffset(self,handle,chRange,coupling,maxOffset,minOffset):
+        self._count('ps5000aGetAnalogueOffset')
+        fullscale = 1e-3*self._ranges_mV[_value(chRange)]
+        _set(maxOffset,fullscale)
+        _set(minOffset,-fullscale)
+        return 0
+
+    def ps5000aGetTimebase2(self,handle,timebase,noSamples,timeIntervalNanoseconds,maxSamples,segmentIndex):
+        self._count('ps5000aGetTimebase2')
+        self.timebase = _value(timebase)
+        _set(timeIntervalNanoseconds,1e9*self._dt())
+        _set(maxSamples,self.memory//self.nSegments)
+        return 0
+
+    def ps5000aSetSimpleTrigger(self,handle,enable,source,threshold,direction,delay,autoTrigger_ms):
+        self._count('ps5000aSetSimpleTrigger')
+        return 0
+
+    def ps5000aMemorySegments(self,handle,nSegments,nMaxSamples):
+        self._count('ps5000aMemorySegments')
+        self.nSegments = _value(nSegments)
+        _set(nMaxSamples,self.memory//self.nSegments)
+        return 0
+
+    def ps5000aSetNoOfCaptures(self,handle,nCaptures):
+        self._count('ps5000aSetNoOfCaptures')
+        self.nCaptures = _value(nCaptures)
+        return 0
+
+    def ps5000aSetSigGenBuiltInV2(self,handle,offsetVoltage,pkToPk,waveType,startFrequency,stopFrequency,
+                                  increment,dwellTime,sweepType,operation,shots,sweeps,triggerType,
+                                  triggerSource,extInThreshold):
+        self._count('ps5000aSetSigGenBuiltInV2')
+        self.sig_gen = {'offset':1e-6*_value(offsetVoltage),
+                        'pkToPk':1e-6*_value(pkToPk),
+                        'freq':_value(startFrequency),
+                        'waveType':_value(waveType)}
+        return 0
+
+    def ps5000aSigGenSoftwareControl(self,handle,state):
+        self._count('ps5000aSigGenSoftwareControl')
+        return 0
+
+    # -- block mode --
+    def ps5000aRunBlock(self,handle,noOfPreTriggerSamples,noOfPostTriggerSamples,timebase,timeIndisposedMs,
+                        segmentIndex,lpReady,pParameter):
+        self._count('ps5000aRunBlock')
+        self.timebase = _value(timebase)
+        self.noSamples = _value(noOfPreTriggerSamples)+_value(noOfPostTriggerSamples)
+        duration = self.nCaptures*self.noSamples*self._dt()
+        self._capture(_value(segmentIndex),self.nCaptures)
+        self.ready_at = time.perf_counter()+duration
+        if lpReady is not None:
+            threading.Timer(duration,lpReady,args=(1,0,pParameter)).start()
+        return 0
+
+    def ps5000aIsReady(self,handle,ready):
+        self._count('ps5000aIsReady')
+        _set(ready,int(self.ready_at is not None and time.perf_counter()>=self.ready_at))
+        return 0
+
+    def ps5000aSetDataBuffers(self,handle,channel,bufferMax,bufferMin,bufferLth,segmentIndex,mode):
+        self._count('ps5000aSetDataBuffers')
+        self.buffers[(_value(channel),_value(segmentIndex),_value(mode))] = (bufferMax,bufferMin,_value(bufferLth))
+        return 0
+
+    def ps5000aSetDataBuffer(self,handle,channel,buffer,bufferLth,segmentIndex,mode):
+        return self.ps5000aSetDataBuffers(handle,channel,buffer,None,bufferLth,segmentIndex,mode)
+
+    def _fill(self,startIndex,noSamples,downSampleRatio,mode,segmentIndex):
+        #copies a segment from the device memory into the registered buffers
+        nBytes = 0
+        overflow = 0
+        for (channel,segment,_mode),(bufferMax,bufferMin,length) in self.buffers.items():
+            if segment!=segmentIndex or _mode!=mode or not channel in self._segment_data(segment):
+                continue
+            data = self._segment_data(segment)[channel][startIndex:]
+            if mode in [1,2,4] and downSampleRatio>1:
+                n = len(data)//downSampleRatio
+                blocks = data[:n*downSampleRatio].reshape(n,downSampleRatio)
+                reduced = {1:(blocks.max(axis=1),blocks.min(axis=1)),
+                           2:(blocks[:,0],blocks[:,0]),
+                           4:(blocks.mean(axis=1).astype(np.int16),)*2}[mode]
+            else:
+                reduced = (data,data)
+            n = min(length,noSamples,len(reduced[0]))
+            _array(bufferMax,n)[:] = reduced[0][:n]
+            if bufferMin is not None:
+                _array(bufferMin,n)[:] = reduced[1][:n]
+            if np.any(np.abs(data)>=self._maxADC):
+                overflow |= 1<<channel
+            nBytes += 2*n
+        return nBytes,overflow,n if nBytes else 0
+
+    def ps5000aGetValues(self,handle,startIndex,noOfSamples,downSampleRatio,downSampleRatioMode,segmentIndex,overflow):
+        self._count('ps5000aGetValues')
+        start_time = time.perf_counter()
+        if self.ready_at is None or time.perf_counter()<self.ready_at:
+            return PICO_DATA_NOT_AVAILABLE
+        nBytes,_overflow,n = self._fill(_value(startIndex),_value(noOfSamples._obj),_value(downSampleRatio),
+                                      _value(downSampleRatioMode),_value(segmentIndex))
+        self._transfer(nBytes,start_time)
+        _set(noOfSamples,n)
+        _array(overflow,1)[0] = _overflow
+        return 0
+
+    def ps5000aGetValuesBulk(self,handle,noOfSamples,fromSegmentIndex,toSegmentIndex,downSampleRatio,
+                             downSampleRatioMode,overflow):
+        self._count('ps5000aGetValuesBulk')
+        start_time = time.perf_counter()
+        if self.ready_at is None or time.perf_counter()<self.ready_at:
+            return PICO_DATA_NOT_AVAILABLE
+        first,last = _value(fromSegmentIndex),_value(toSegmentIndex)
+        _overflow = _array(overflow,last-first+1)
+        totalBytes = 0
+        for i,segment in enumerate(range(first,last+1)):
+            nBytes,_overflow[i],n = self._fill(0,_value(noOfSamples._obj),_value(downSampleRatio),
+                                               _value(downSampleRatioMode),segment)
+            totalBytes += nBytes
+        self._transfer(totalBytes,start_time)
+        _set(noOfSamples,n)
+        return 0
+
+    def ps5000aGetValuesTriggerTimeOffsetBulk64(self,handle,times,timeUnits,fromSegmentIndex,toSegmentIndex):
+        self._count('ps5000aGetValuesTriggerTimeOffsetBulk64')
+        first,last = _value(fromSegmentIndex),_value(toSegmentIndex)
+        _times = _array(times,last-first+1,ctypes.c_int64)
+        _units = _array(timeUnits,last-first+1,ctypes.c_int32)
+        for i,segment in enumerate(range(first,last+1)):
+            _times[i] = int(round(1e15*self.segments[segment]['offset']))
+            _units[i] = self.PS5000A_TIME_UNITS['PS5000A_FS']
+        return 0
+
+    # -- streaming mode --
+    def ps5000aRunStreaming(self,handle,sampleInterval,sampleIntervalTimeUnits,maxPreTriggerSamples,
+                            maxPostTriggerSamples,autoStop,downSampleRatio,downSampleRatioMode,overviewBufferSize):
+        self._count('ps5000aRunStreaming')
+        units = 1e-15*1e3**_value(sampleIntervalTimeUnits)
+        interval = sampleInterval._obj.value*units
+        self.streaming = {'dt':interval,
+                          'start':time.perf_counter(),
+                          'read':0,
+                          'maxSamples':_value(maxPreTriggerSamples)+_value(maxPostTriggerSamples),
+                          'autoStop':bool(_value(autoStop)),
+                          'running':True}
+        return 0
+
+    def ps5000aGetStreamingLatestValues(self,handle,lpPs5000aReady,pParameter):
+        self._count('ps5000aGetStreamingLatestValues')
+        s = self.streaming
+        if s is None or not s['running']:
+            return PICO_BUSY
+        available = int((time.perf_counter()-s['start'])/s['dt'])-s['read']
+        if s['autoStop']:
+            available = min(available,s['maxSamples']-s['read'])
+        buffers = {channel:(bufferMax,length) for (channel,segment,mode),(bufferMax,bufferMin,length) in self.buffers.items()
+                   if segment==0 and self.channels[channel]['enabled']}
+        length = min(length for bufferMax,length in buffers.values())
+        startIndex = s['read']%length
+        n = min(available,length-startIndex) #the driver buffers are used circularly
+        if n<=0:
+            return PICO_BUSY
+        for channel,(buffer,_) in buffers.items():
+            _array(buffer,length)[startIndex:startIndex+n] = self._signal(channel,n,s['read']*s['dt'],0.,dt=s['dt'])
+        s['read'] += n
+        autoStop = s['autoStop'] and s['read']>=s['maxSamples']
+        lpPs5000aReady(1,n,startIndex,0,0,0,int(autoStop),pParameter)
+        if autoStop:
+            s['running'] = False
+        return 0
+
+
+class VirtualMotor():
+    '''
+    galvo motor driven by the generator offset voltage of a ps2000 unit (see galvomirrors.Motor):
+    the mirror slews towards the commanded angle, then settles exponentially.
+    channel A measures the position, channel B the positioning error
+    '''
+    def __init__(self,volts_per_deg,position_volts_per_deg,error_deg_per_volts,slew=2000.,tau=1e-4):
+        self.volts_per_deg = volts_per_deg #command gain (V/deg)
+        self.position_volts_per_deg = position_volts_per_deg
+        self.error_deg_per_volts = error_deg_per_volts
+        self.slew = slew #max angular speed (deg/s)
+        self.tau = tau #settling time constant (s)
+        self.moves = [(0.,0.,0.)] #(start time, start angle, target angle)
+
+    def command(self,volts,t):
+        #new target angle at time t
+        self.moves = self.moves[-3:]+[(t,float(self.angle(np.array([t]))[0]),volts/self.volts_per_deg)]
+
+    def _target(self,t):
+        starts = np.array([m[0] for m in self.moves])
+        return np.array([m[2] for m in self.moves])[np.maximum(np.searchsorted(starts,t,side='right')-1,0)]
+
+    def angle(self,t):
+        #mirror angle (deg) at the times t (s)
+        starts = np.array([m[0] for m in self.moves])
+        i = np.maximum(np.searchsorted(starts,t,side='right')-1,0)
+        t0,a0,target = (np.array([m[k] for m in self.moves])[i] for k in range(3))
+        distance = np.abs(target-a0)
+        direction = np.sign(target-a0)
+        ramp = np.maximum(distance-self.slew*self.tau,0.)/self.slew #duration of the slew
+        elapsed = t-t0
+        slewing = elapsed<ramp
+        remaining = np.where(slewing,distance-self.slew*elapsed,
+                             np.minimum(distance,self.slew*self.tau)*np.exp(-(elapsed-ramp)/self.tau))
+        return target-direction*remaining
+
+    def measure(self,t):
+        #channel A and B voltages at the times t
+        angle = self.angle(t)
+        return {0:self.position_volts_per_deg*angle,
+                1:(self._target(t)-angle)/self.error_deg_per_volts}
+
+
+class VirtualPs2000():
+    '''
+    virtual ps2000 driver, the functions follow the ps2000.h signatures.
+    Each unit (one per serial number) drives a VirtualMotor with its generator,
+    by default the two galvo motors of Galvomirrors_config.
+    Every driver call lasts latency (in s), as a USB round trip, and the values are
+    transferred at transfer_rate (in bytes/s, 0: instantly).
+    '''
+    PS2000_CHANNEL = _enum(['PS2000_CHANNEL_A','PS2000_CHANNEL_B'])
+    PS2000_VOLTAGE_RANGE = {'PS2000_20MV':1,'PS2000_50MV':2,'PS2000_100MV':3,'PS2000_200MV':4,
+                            'PS2000_500MV':5,'PS2000_1V':6,'PS2000_2V':7,'PS2000_5V':8,
+                            'PS2000_10V':9,'PS2000_20V':10}
+    PICO_COUPLING = {'AC':0,'DC':1}
+    _ranges_mV = [10,20,50,100,200,500,1000,2000,5000,10000,20000]
+    _maxADC = 32767
+
+    def __init__(self,units=None,latency=0.,noise=1e-3,seed=0,transfer_rate=0.):
+        if units is None:
+            from Galvomirrors_config import motors_config
+            units = {config['SN']:VirtualMotor(config['volts_per_deg']/config['gain'],config['output_deg_per_volts'],
+                                               config['output_error_deg_per_volts'])
+                     for config in motors_config.values()}
+        self.units = units #{serial number: VirtualMotor}
+        self.latency = latency
+        self.transfer_rate = transfer_rate
+        self.noise = noise #V rms
+        self.rng = np.random.default_rng(seed)
+        self.calls = {}
+        self.handles = {}
+        self._lock = threading.Lock()
+
+    def _call(self,name):
+        with self._lock:
+            self.calls[name] = self.calls.get(name,0)+1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def ps2000_open_unit(self):
+        self._call('ps2000_open_unit')
+        with self._lock:
+            opened = [unit['serial'] for unit in self.handles.values()]
+            available = [serial for serial in self.units if not serial in opened]
+            if not available:
+                return 0
+            handle = max(self.handles,default=0)+1
+            self.handles[handle] = {'serial':available[0],'motor':self.units[available[0]],
+                                    'channels':{0:{'range':7},1:{'range':7}},'timebase':0,'oversample':1,
+                                    'capture':None}
+        return handle
+
+    def ps2000_close_unit(self,handle):
+        self._call('ps2000_close_unit')
+        with self._lock:
+            self.handles.pop(_value(handle))
+        return 1
+
+    def ps2000_stop(self,handle):
+        self._call('ps2000_stop')
+        return 1
+
+    def ps2000_get_unit_info(self,handle,string,string_length,line):
+        self._call('ps2000_get_unit_info')
+        unit = self.handles[_value(handle)]
+        string.value = (unit['serial'] if _value(line)==4 else 'virtual {0}'.format(_value(line))).encode('utf-8')
+        return len(string.value)
+
+    def ps2000_set_channel(self,handle,channel,enabled,dc,chRange):
+        self._call('ps2000_set_channel')
+        self.handles[_value(handle)]['channels'][_value(channel)] = {'range':_value(chRange)}
+        return 1
+
+    def ps2000_get_timebase(self,handle,timebase,no_of_samples,time_interval,time_units,oversample,max_samples):
+        self._call('ps2000_get_timebase')
+        if not 0<=_value(timebase)<=23:
+            return 0
+        _set(time_interval,10*2**_value(timebase)) #ns
+        _set(time_units,2)
+        _set(max_samples,8064//_value(oversample))
+        return 1
+
+    def ps2000_set_trigger(self,handle,source,threshold,direction,delay,auto_trigger_ms):
+        self._call('ps2000_set_trigger')
+        return 1
+
+    def ps2000_set_sig_gen_built_in(self,handle,offset_voltage,pk_to_pk,wave_type,start_frequency,stop_frequency,
+                                    increment,dwell_time,sweep_type,sweeps):
+        self._call('ps2000_set_sig_gen_built_in')
+        self.handles[_value(handle)]['motor'].command(1e-6*_value(offset_voltage),time.perf_counter())
+        return 1
+
+    def ps2000_run_block(self,handle,no_of_values,timebase,oversample,time_indisposed_ms):
+        self._call('ps2000_run_block')
+        unit = self.handles[_value(handle)]
+        dt = 10e-9*2**_value(timebase)*_value(oversample)
+        start = time.perf_counter()
+        unit['capture'] = {'t':start+dt*np.arange(_value(no_of_values)),'ready_at':start+dt*_value(no_of_values)}
+        return 1
+
+    def ps2000_ready(self,handle):
+        self._call('ps2000_ready')
+        capture = self.handles[_value(handle)]['capture']
+        return int(capture is not None and time.perf_counter()>=capture['ready_at'])
+
+    def ps2000_get_values(self,handle,buffer_a,buffer_b,buffer_c,buffer_d,overflow,no_of_values):
+        self._call('ps2000_get_values')
+        start_time = time.perf_counter()
+        unit = self.handles[_value(handle)]
+        capture = unit['capture']
+        if capture is None or time.perf_counter()<capture['ready_at']:
+            return 0
+        n = min(_value(no_of_values),len(capture['t']))
+        volts = unit['motor'].measure(capture['t'][:n])
+        _overflow = 0
+        for channel,buffer in [(0,buffer_a),(1,buffer_b)]:
+            if buffer is None:
+                continue
+            fullscale = 1e-3*self._ranges_mV[unit['channels'][channel]['range']]
+            counts = np.round((volts[channel]+self.noise*self.rng.standard_normal(n))*self._maxADC/fullscale)
+            if np.any(np.abs(counts)>=self._maxADC):
+                _overflow |= 1<<channel
+            _array(buffer,n)[:] = np.clip(counts,-self._maxADC,self._maxADC)
+            if self.transfer_rate:
+                start_time += 2*n/self.transfer_rate
+        _set(overflow,_overflow)
+        time.sleep(max(0.,start_time-time.perf_counter()))
+        return n
+
+
+def install(ps5000a=None,ps2000=None):
+    '''
+    registers the virtual drivers in place of picosdk's, before or after importing pico5000 and pico2000
+    (the driver of the wrapper modules already imported is replaced, an instrumented driver included:
+    enable the instrumentation after install)
+    arguments: none
+    keyword arguments:
+        ps5000a: a VirtualPs5000a instance (a new one is created otherwise)
+        ps2000: a VirtualPs2000 instance (a new one is created otherwise)
+    returns: the virtual ps5000a driver
+    '''
+    ps5000a = VirtualPs5000a() if ps5000a is None else ps5000a
+    ps2000 = VirtualPs2000() if ps2000 is None else ps2000
+    for name,driver,wrapper in [('ps5000a',ps5000a,'pico5000'),('ps2000',ps2000,'pico2000')]:
+        module = types.ModuleType('picosdk.'+name)
+        setattr(module,name,driver)
+        sys.modules['picosdk.'+name] = module
+        if wrapper in sys.modules:
+            sys.modules[wrapper].ps = driver
+    return ps5000a